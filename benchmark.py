@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# Measures the overhead of pkgbuild.py itself, without compilers or network.
+# It generates a synthetic repository with a config/ and tags/ tree of fake
+# packages whose tarballs are local (file://) and whose configure/make are
+# trivial, and then times the main paths of the BuildManager:
+#   init      - BuildManager() from scratch, which parses configs and tags
+#   getPackage, getDependencies, resolve - over all packages
+#   build     - a full build of the closure of some packages
+#   rebuild   - the same build when everything is already built
+#   deploy    - deploying all built packages into an empty deploydir
+#   redeploy  - deploying them again, when nothing changed
+# Results can be saved as a baseline and later runs compared against it:
+#   ./benchmark.py --save baseline.json
+#   ./benchmark.py --baseline baseline.json
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import tarfile
+import argparse
+import tempfile
+import contextlib
+import yaml
+
+import pkgbuild
+
+def makeTarball( fname, dirname ):
+    # A package that "builds" with the default configure step
+    with tarfile.open( fname, 'w:gz' ) as tar:
+        for name,data,mode in ( ('configure', b'#!/bin/sh\nexit 0\n', 0o755),
+                                ('README', dirname.encode() + b'\n', 0o644) ):
+            info = tarfile.TarInfo( dirname + '/' + name )
+            info.size = len(data)
+            info.mode = mode
+            tar.addfile( info, io.BytesIO( data ) )
+
+def generate( rootdir, numpkgs, fanout, numversions, seed=0 ):
+    # Writes config/pkgNNNN.yaml, tags/bench.yaml and the tarballs of the
+    # tagged versions. Packages only depend on packages with a lower number
+    # so the closure of the first N packages is within the first N
+    rnd = random.Random( seed )
+    for dname in ('config','tags','src'):
+        os.makedirs( os.path.join( rootdir, dname ), exist_ok=True )
+    names = [ 'pkg%04d' % j for j in range(numpkgs) ]
+    tagmap = {}
+    for j,name in enumerate(names):
+        deps = rnd.sample( names[:j], min(j,fanout) )
+        configs = []
+        for k in range(numversions):
+            version = '1.%d' % k
+            dirname = '%s-%s' % (name,version)
+            configs.append( { 'version': version,
+                              'dirname': '{name}-{version}',
+                              'url': 'file://%s/src/%s.tar.gz' % (rootdir,dirname),
+                              'depends': deps,
+                              'make': 'true',
+                              'install': 'mkdir -p {installdir}/{dirname}/bin && '
+                                         'cp README {installdir}/{dirname}/bin/{name}' } )
+        with open( os.path.join( rootdir, 'config', name + '.yaml' ), 'w' ) as f:
+            f.write( yaml.dump( configs ) )
+        tagmap[name] = version
+        makeTarball( os.path.join( rootdir, 'src', dirname + '.tar.gz' ), dirname )
+    with open( os.path.join( rootdir, 'tags', 'bench.yaml' ), 'w' ) as f:
+        f.write( yaml.dump( tagmap ) )
+    return names
+
+class Benchmark():
+    def __init__( self, rootdir, repeat ):
+        self.rootdir = rootdir
+        self.repeat = repeat
+        self.results = {}
+        self.location = os.path.join( rootdir, 'location.json' )
+        with open( self.location, 'w' ) as f:
+            f.write( json.dumps( { 'bench': { 'repodir': os.path.join( rootdir, 'work' ),
+                                              'cachedir': os.path.join( rootdir, 'cache' ) } } ) )
+
+    def manager( self ):
+        return pkgbuild.BuildManager( location='bench', tags=['bench'],
+                                      config=self.location, rootdir=self.rootdir )
+
+    def time( self, name, func, repeat=None ):
+        # Keeps the best of a few runs, with the output of pkgbuild muted
+        best = None
+        for j in range( repeat or self.repeat ):
+            with open( os.devnull, 'w' ) as devnull, contextlib.redirect_stdout( devnull ):
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min( best, elapsed )
+        self.results[name] = best
+        print( "%-16s %10.4f s" % (name,best) )
+        return best
+
+    def run( self, names, numbuild ):
+        def init():
+            pkgbuild.PackageIndex.indexes.clear()
+            self.mgr = self.manager()
+            # tags and the package list are read lazily now, force them so
+            # the phase still measures the startup parsing it used to
+            self.mgr.tags
+            self.mgr.packageNames()
+        self.time( 'init', init )
+        mgr = self.mgr
+        self.time( 'getPackage', lambda: [ mgr.getPackage( name ) for name in names ] )
+        self.time( 'getDependencies', lambda: [ mgr.getDependencies( name ) for name in names ] )
+        pkgs = [ mgr.getPackage( name ) for name in names ]
+        self.time( 'resolve', lambda: [ mgr.resolve( '{installdir}/{dirname}', pkg )
+                                        for pkg in pkgs ] )
+
+        # The builds start from an empty work directory every time
+        roots = [ (name,None) for name in names[:numbuild] ]
+        workdir = os.path.join( self.rootdir, 'work' )
+        def build():
+            shutil.rmtree( workdir, ignore_errors=True )
+            self.mgr = self.manager()
+            self.mgr.useartifacts = False
+            if not self.mgr.buildPackages( roots ):
+                raise Exception( "Benchmark build failed" )
+        self.time( 'build', build, 1 )
+        self.time( 'rebuild', lambda: self.mgr.buildPackages( roots ) )
+
+        # Deploys everything that was built, in build order
+        mgr = self.mgr
+        built = [ (name,mgr.getPackage(name)['version']) for name in names[:numbuild] ]
+        def deploy():
+            for name,version in built:
+                if not mgr.getBuilder( name, version ).deploy():
+                    raise Exception( "Benchmark deploy of %s failed" % name )
+        def cleandeploy():
+            shutil.rmtree( mgr.deploydir )
+            os.makedirs( mgr.deploydir )
+            mgr.manifest = None
+            deploy()
+        self.time( 'deploy', cleandeploy )
+        self.time( 'redeploy', deploy )
+        return self.results
+
+def compare( results, baseline, tolerance ):
+    # Prints how each timing moved against the baseline. Returns False if
+    # any of them got slower by more than the tolerance
+    ok = True
+    print( "%-16s %10s %10s %8s" % ('','baseline','now','ratio') )
+    for name,now in results.items():
+        base = baseline.get( name )
+        if not base:
+            print( "%-16s %10s %10.4f" % (name,'-',now) )
+            continue
+        ratio = now/base
+        flag = ''
+        if ratio > 1.0 + tolerance:
+            flag = ' REGRESSION'
+            ok = False
+        print( "%-16s %10.4f %10.4f %7.2fx%s" % (name,base,now,ratio,flag) )
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='Benchmarks pkgbuild.py on a synthetic repository' )
+    parser.add_argument( '--packages', type=int, default=500,
+                         help='number of packages to generate' )
+    parser.add_argument( '--fanout', type=int, default=3,
+                         help='number of dependencies of every package' )
+    parser.add_argument( '--versions', type=int, default=3,
+                         help='number of versions of every package' )
+    parser.add_argument( '--build', type=int, default=50,
+                         help='build the closure of the first BUILD packages' )
+    parser.add_argument( '--repeat', type=int, default=3,
+                         help='keep the best of REPEAT runs' )
+    parser.add_argument( '--workdir', default=None,
+                         help='where the synthetic repository goes (default a temporary dir)' )
+    parser.add_argument( '--baseline', default=None,
+                         help='compare against the results in this file' )
+    parser.add_argument( '--tolerance', type=float, default=0.2,
+                         help='slowdown over the baseline that is a regression (default 0.2)' )
+    parser.add_argument( '--save', default=None,
+                         help='save the results to this file' )
+    opt = parser.parse_args()
+
+    rootdir = opt.workdir or tempfile.mkdtemp( prefix='bleedingedge-bench-' )
+    rootdir = os.path.realpath( rootdir )
+    print( "Generating %d packages in %s" % (opt.packages,rootdir) )
+    names = generate( rootdir, opt.packages, opt.fanout, opt.versions )
+    try:
+        results = Benchmark( rootdir, opt.repeat ).run( names, min(opt.build,opt.packages) )
+    finally:
+        if opt.workdir is None:
+            shutil.rmtree( rootdir, ignore_errors=True )
+
+    params = { 'packages':opt.packages, 'fanout':opt.fanout,
+               'versions':opt.versions, 'build':opt.build }
+    if opt.save:
+        with open( opt.save, 'w' ) as f:
+            f.write( json.dumps( { 'params':params, 'results':results },
+                                 indent=4, separators=(',',': ') ) )
+        print( "Results saved to", opt.save )
+    ok = True
+    if opt.baseline:
+        with open( opt.baseline ) as f:
+            baseline = json.loads( f.read() )
+        if baseline.get('params') != params:
+            print( "Warning: baseline was taken with", baseline.get('params') )
+        ok = compare( results, baseline['results'], opt.tolerance )
+    sys.exit( 0 if ok else 1 )
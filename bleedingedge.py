@@ -0,0 +1,4236 @@
+# The builder behind pkgbuild.py, which only imports it and calls main()
+# so that its bytecode is cached. Custom builders in config/ still do
+# 'import pkgbuild', which has everything in here
+import os
+import sys
+import json
+import shutil
+import importlib
+import importlib.util
+import types
+import atexit
+import fcntl
+import re,fnmatch
+from datetime import datetime
+import argparse
+import threading
+import time
+import collections
+import contextlib
+import resource
+import bisect
+import filecmp
+import stat
+import functools
+import itertools
+
+# How long the modules imported on demand took, see LazyModule
+IMPORTS = []
+
+def timedImport( name ):
+    # import_module() waits if another thread is importing it right now
+    loaded = name in sys.modules
+    start = time.time()
+    module = importlib.import_module( name )
+    if not loaded:
+        IMPORTS.append( { 'name':'import', 'module':name, 'package':None, 'version':None,
+                          'start':start, 'wall':time.time()-start } )
+    return module
+
+class LazyModule():
+    # A module that is imported the first time it is used, so that quick
+    # queries like --dump-environ do not pay for urllib, yaml or tarfile.
+    # Submodules like urllib.request are imported the same way
+    def __init__( self, name ):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__( self, attr ):
+        module = self._module
+        if module is None:
+            module = self.__dict__['_module'] = timedImport( self._name )
+        try:
+            return getattr( module, attr )
+        except AttributeError:
+            try:
+                return timedImport( self._name + '.' + attr )
+            except ImportError:
+                raise AttributeError( "module %s has no attribute %s" % (self._name,attr) )
+
+subprocess = LazyModule( 'subprocess' )
+urllib = LazyModule( 'urllib' )
+yaml = LazyModule( 'yaml' )
+gzip = LazyModule( 'gzip' )
+pickle = LazyModule( 'pickle' )
+hashlib = LazyModule( 'hashlib' )
+tarfile = LazyModule( 'tarfile' )
+zipfile = LazyModule( 'zipfile' )
+socket = LazyModule( 'socket' )
+tempfile = LazyModule( 'tempfile' )
+concurrent = LazyModule( 'concurrent' )
+sqlite3 = LazyModule( 'sqlite3' )
+plat = LazyModule( 'platform' )
+
+def nowstr():
+    # Helper to provide timestamp for logging. It's in local time
+    return datetime.now().strftime( "%Y/%m/%d %H:%M:%S" )
+
+def formatDuration( seconds ):
+    # 75 => 1m15s
+    seconds = int( seconds )
+    if seconds < 60:
+        return "%ds" % seconds
+    if seconds < 3600:
+        return "%dm%02ds" % (seconds//60,seconds%60)
+    return "%dh%02dm" % (seconds//3600,(seconds%3600)//60)
+
+def defaultCacheDir():
+    # Where we keep things that are shared by all locations, like the tag
+    # maps downloaded from Ubuntu. Follows the XDG convention
+    cachehome = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser( '~/.cache' )
+    return os.path.join( cachehome, 'bleedingedge' )
+
+def freeze( value ):
+    # Turns a parsed config into read-only structures (dicts into mapping
+    # proxies and lists into tuples) so the same parsed object can be handed
+    # out to everyone without copying it
+    if isinstance( value, dict ):
+        return types.MappingProxyType( { k:freeze(v) for k,v in value.items() } )
+    if isinstance( value, list ):
+        return tuple( freeze(v) for v in value )
+    return value
+
+def thaw( value ):
+    # The opposite of freeze(), returns plain dicts and lists
+    if isinstance( value, (dict,types.MappingProxyType) ):
+        return { k:thaw(v) for k,v in value.items() }
+    if isinstance( value, (list,tuple) ):
+        return [ thaw(v) for v in value ]
+    return value
+
+@functools.total_ordering
+class Version():
+    # A version string that compares the way people expect: numbers are
+    # compared as numbers so 1.10 comes after 1.9, a suffix like rc1 or
+    # beta2 comes before the release (1.0rc1 < 1.0 < 1.0.1) and a version
+    # without numbers, like svn or git, comes before all the releases so
+    # it is never picked unless asked for. '.', '_' and '-' are the same
+    PARTS = re.compile( r'\d+|[a-zA-Z]+' )
+
+    def __init__( self, text ):
+        self.text = str(text)
+        key = []
+        for part in self.PARTS.findall( self.text ):
+            if part.isdigit():
+                key.append( (2,int(part)) )
+            else:
+                key.append( (0,part.lower()) )
+        # the end sorts after letters and before numbers
+        key.append( (1,'') )
+        self.key = tuple(key)
+
+    def __eq__( self, other ):
+        return self.key == other.key
+
+    def __lt__( self, other ):
+        return self.key < other.key
+
+    def __hash__( self ):
+        return hash( self.key )
+
+    def __str__( self ):
+        return self.text
+
+    def __repr__( self ):
+        return "Version(%r)" % (self.text,)
+
+class ResolveError( KeyError ):
+    # An undefined key or a cycle of references in a {} template
+    def __init__( self, msg, text=None ):
+        KeyError.__init__( self, msg )
+        self.text = text
+
+    def __str__( self ):
+        if self.text is None:
+            return self.args[0]
+        return "%s in '%s'" % (self.args[0],self.text)
+
+class Template():
+    # A string with {key} references, parsed once into the literal pieces
+    # and the keys in between. {{ and }} stand for literal braces. Unlike
+    # str.format() there are no attributes, indexes nor format specs: what
+    # is between the braces is the key, so {gcc-version} works
+    PATTERN = re.compile( r'\{\{|\}\}|\{([^{}]*)\}' )
+    templates = {}
+
+    @classmethod
+    def get( cls, text ):
+        tmpl = cls.templates.get( text )
+        if tmpl is None:
+            tmpl = cls.templates[text] = Template( text )
+        return tmpl
+
+    def __init__( self, text ):
+        self.text = text
+        # literal, key, literal, key, ..., literal
+        self.pieces = []
+        literal = []
+        pos = 0
+        for m in self.PATTERN.finditer( text ):
+            literal.append( text[pos:m.start()] )
+            if m.group(1) is None:
+                literal.append( m.group()[0] )
+            else:
+                self.pieces += [ ''.join( literal ), m.group(1) ]
+                literal = []
+            pos = m.end()
+        literal.append( text[pos:] )
+        self.pieces.append( ''.join( literal ) )
+        self.keys = tuple( self.pieces[1::2] )
+
+    def render( self, values ):
+        # The text with the keys replaced by these values, in order
+        if not values:
+            return self.pieces[0]
+        out = [ self.pieces[0] ]
+        for value,literal in zip( values, self.pieces[2::2] ):
+            out += [ value, literal ]
+        return ''.join( out )
+
+class TemplateContext():
+    # Resolves {key} against a list of dicts, the first that has the key
+    # wins, e.g. the package config, then the versions of the packages
+    # being built, then the fields of the BuildManager. Values can have
+    # {} of their own. The dicts are not copied: every string resolved is
+    # remembered along with the raw values of all the keys it used, and it
+    # is only resolved again when any of these is no longer the same
+    def __init__( self, layers ):
+        self.layers = layers
+        self.cache = {}
+
+    def lookup( self, key ):
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        raise ResolveError( "Undefined key {%s}" % key )
+
+    def value( self, key, used, stack ):
+        raw = self.lookup( key )
+        used[key] = raw
+        if not isinstance( raw, str ):
+            return str( raw )
+        if '{' not in raw and '}' not in raw:
+            return raw
+        if key in stack:
+            raise ResolveError( "Reference cycle %s" % " -> ".join(
+                "{%s}" % k for k in stack[ stack.index(key): ] + (key,) ) )
+        return self.render( Template.get( raw ), used, stack + (key,) )
+
+    def render( self, tmpl, used, stack ):
+        try:
+            return tmpl.render( [ self.value( key, used, stack ) for key in tmpl.keys ] )
+        except ResolveError as e:
+            # tell where the innermost undefined key was used
+            if e.text is None:
+                e.text = tmpl.text
+            raise
+
+    def resolve( self, text ):
+        # The text with every {key} resolved
+        entry = self.cache.get( text )
+        if entry is not None:
+            result,used = entry
+            for key,raw in used:
+                if self.lookup( key ) is not raw:
+                    break
+            else:
+                return result
+        used = {}
+        result = self.render( Template.get( text ), used, () )
+        self.cache[text] = (result,tuple( used.items() ))
+        return result
+
+class PackageIndex():
+    # All configs and tags parsed once per process. Every file is kept
+    # along with the mtime and size it had when parsed, and it is parsed
+    # again only if those change. The YAML C loader is used if available.
+    # Optionally the parsed files can be persisted to a snapshot file so
+    # the next process does not parse anything at all unless it changed.
+    indexes = {}
+
+    @classmethod
+    def get( cls, rootdir, snapshot=None ):
+        # There is one index per repository and process
+        key = (rootdir,snapshot)
+        if key not in cls.indexes:
+            cls.indexes[key] = PackageIndex( rootdir, snapshot )
+        return cls.indexes[key]
+
+    def __init__( self, rootdir, snapshot=None ):
+        self.rootdir = rootdir
+        self.cfgdir = os.path.join( rootdir, 'config' )
+        self.tagdir = os.path.join( rootdir, 'tags' )
+        self.snapshot = snapshot
+        self.lock = threading.RLock()
+        # fname => [mtime, size, parsed data, frozen data]
+        self.files = {}
+        # the listing of config/ and the mtime of the directory
+        self.listing = (None,[])
+        self.dirty = False
+        if snapshot:
+            if os.path.isfile( snapshot ):
+                try:
+                    with open( snapshot, 'rb' ) as f:
+                        self.files = pickle.load( f )
+                except Exception as e:
+                    print("Exception reading index snapshot",snapshot,":",e)
+                    self.files = {}
+            atexit.register( self.save )
+
+    def parse( self, fname, data ):
+        if fname.endswith( '.json' ):
+            return json.loads( data )
+        return yaml.load( data, Loader=getattr( yaml, 'CSafeLoader', yaml.SafeLoader ) )
+
+    def load( self, fname ):
+        # Returns the frozen contents of this file or None if it does not
+        # exist. Exceptions from the parser are passed to the caller
+        with self.lock:
+            try:
+                st = os.stat( fname )
+            except OSError:
+                self.files.pop( fname, None )
+                return None
+            entry = self.files.get( fname )
+            if (entry is None) or (entry[0]!=st.st_mtime_ns) or (entry[1]!=st.st_size):
+                with open( fname, 'rb' ) as f:
+                    data = self.parse( fname, f.read() )
+                entry = [ st.st_mtime_ns, st.st_size, data, None ]
+                self.files[fname] = entry
+                self.dirty = True
+            if entry[3] is None:
+                entry[3] = freeze( entry[2] )
+            return entry[3]
+
+    def packageFiles( self ):
+        # All the files in config/ that are package configurations
+        with self.lock:
+            mtime = os.stat( self.cfgdir ).st_mtime_ns
+            if self.listing[0]!=mtime:
+                files = [ v for v in os.listdir( self.cfgdir )
+                          if (v.endswith('.json') or v.endswith('.yaml'))
+                          and os.path.isfile( os.path.join(self.cfgdir,v) ) ]
+                self.listing = (mtime,files)
+            return self.listing[1]
+
+    def save( self ):
+        # Persists every config and tag file into the snapshot
+        if not self.snapshot:
+            return
+        with self.lock:
+            for dname in (self.cfgdir,self.tagdir):
+                if not os.path.isdir( dname ):
+                    continue
+                for v in os.listdir( dname ):
+                    if v.endswith('.json') or v.endswith('.yaml'):
+                        try:
+                            self.load( os.path.join( dname, v ) )
+                        except Exception as e:
+                            print("Exception while reading from file",v,":", e)
+            if not self.dirty:
+                return
+            entries = { fname:entry[:3] + [None]
+                        for fname,entry in self.files.items() }
+            try:
+                tmpname = self.snapshot + '.tmp'
+                with open( tmpname, 'wb' ) as f:
+                    pickle.dump( entries, f, protocol=pickle.HIGHEST_PROTOCOL )
+                os.replace( tmpname, self.snapshot )
+                self.dirty = False
+            except Exception as e:
+                print("Exception writing index snapshot",self.snapshot,":",e)
+
+class TagCache():
+    # Local cache of the Ubuntu package lists (trusty, bionic, etc) used
+    # as tags. Each tag is kept as a small json file with only the packages
+    # we have configs for. Within 'ttl' seconds the cached file is used as
+    # is. After that we revalidate it with the server using the ETag and
+    # Last-Modified headers so it is downloaded again only if it changed.
+    # If the server cannot be reached we go on with what we have
+    URL = "https://packages.ubuntu.com/%s/allpackages?format=txt.gz"
+    TTL = 24*3600
+
+    def __init__( self, cachedir, ttl=None ):
+        self.cachedir = os.path.join( cachedir, 'tags' )
+        self.ttl = self.TTL if ttl is None else ttl
+
+    def get( self, tag, pkgnames ):
+        # Returns a dict pkgname => version for this tag, restricted to
+        # the packages in pkgnames
+        fname = os.path.join( self.cachedir, '%s.json' % tag )
+        cached = None
+        if os.path.isfile( fname ):
+            try:
+                with open( fname ) as f:
+                    cached = json.loads( f.read() )
+            except Exception as e:
+                print("Exception reading cached tag",fname,":",e)
+        pkgnames = sorted( pkgnames )
+        # the cache is only good if it was filtered for the same packages
+        if cached and cached.get('names')!=pkgnames:
+            cached = None
+        if cached and (time.time()-cached.get('fetched',0) < self.ttl):
+            return cached['packages']
+
+        url = self.URL % (tag,)
+        print("Url:", url)
+        req = urllib.request.Request( url )
+        if cached and cached.get('etag'):
+            req.add_header( 'If-None-Match', cached['etag'] )
+        if cached and cached.get('lastmodified'):
+            req.add_header( 'If-Modified-Since', cached['lastmodified'] )
+        try:
+            with urllib.request.urlopen( req, timeout=15 ) as resp:
+                tagmap = self.parse( resp, set(pkgnames) )
+                cached = { 'url': url,
+                           'names': pkgnames,
+                           'etag': resp.headers.get('ETag'),
+                           'lastmodified': resp.headers.get('Last-Modified'),
+                           'packages': tagmap }
+        except urllib.error.HTTPError as e:
+            if not (cached and e.code==304):
+                print("Exception while downloading",url,":",e)
+                return cached['packages'] if cached else None
+            # not modified, the cache is still good
+        except Exception as e:
+            print("Exception while downloading",url,":",e)
+            if cached:
+                print("Using cached tag",tag)
+            return cached['packages'] if cached else None
+
+        cached['fetched'] = time.time()
+        try:
+            os.makedirs( self.cachedir, exist_ok=True )
+            tmpname = fname + '.tmp'
+            with open( tmpname, 'w' ) as f:
+                f.write( json.dumps( cached ) )
+            os.replace( tmpname, fname )
+        except Exception as e:
+            print("Exception writing cached tag",fname,":",e)
+        return cached['packages']
+
+    def parse( self, stream, pkgnames ):
+        # Gunzips and parses the package list as it arrives, keeping only
+        # the packages we are interested in
+        lre = re.compile( rb"^(\S+)\s+\((\S+)\)" )
+        tagmap = {}
+        with gzip.GzipFile( fileobj=stream ) as gz:
+            for line in gz:
+                g = lre.match( line )
+                if g is None:
+                    continue
+                name = g.group(1).decode( 'utf-8', 'replace' )
+                if name in pkgnames:
+                    version = g.group(2).decode( 'utf-8', 'replace' )
+                    tagmap[name] = version.split('-')[0]
+        return tagmap
+
+class SourceCache():
+    # Content-addressed cache of downloaded sources shared by all locations
+    # in ~/.bleedingedge.json, so a tarball is downloaded once per machine
+    # and not once per builddir. Files are kept as
+    #     <cachedir>/sha256/<hash>
+    # and <cachedir>/url/<hash of url> holds the hash of what the url had.
+    # Downloads are streamed in chunks into a partial file that is resumed
+    # with an HTTP Range request if the transfer breaks, then checked
+    # against the sha256 in the package config (if any) and renamed into
+    # place, so a file in the cache or in builddir is always complete.
+    CHUNKSIZE = 1<<20
+    RETRIES = 5
+
+    def __init__( self, cachedir ):
+        self.cachedir = cachedir
+        self.locks = {}
+        self.lock = threading.Lock()
+        for sub in ('sha256','url','partial'):
+            os.makedirs( os.path.join( cachedir, sub ), exist_ok=True )
+
+    @staticmethod
+    def hashFile( fname ):
+        sha = hashlib.sha256()
+        with open( fname, 'rb' ) as f:
+            for chunk in iter( lambda: f.read( SourceCache.CHUNKSIZE ), b'' ):
+                sha.update( chunk )
+        return sha.hexdigest()
+
+    def urlKey( self, url ):
+        return hashlib.sha256( url.encode('utf-8') ).hexdigest()
+
+    def lookup( self, url, sha256=None ):
+        # Returns the cached file for this url/hash or None
+        if not sha256:
+            idxfile = os.path.join( self.cachedir, 'url', self.urlKey(url) )
+            if not os.path.isfile( idxfile ):
+                return None
+            with open( idxfile ) as f:
+                sha256 = f.read().strip()
+        fname = os.path.join( self.cachedir, 'sha256', sha256.lower() )
+        return fname if os.path.isfile( fname ) else None
+
+    def urlLock( self, url ):
+        # one lock per url so two threads never download the same file
+        with self.lock:
+            return self.locks.setdefault( url, threading.Lock() )
+
+    def fetch( self, url, dest, sha256=None ):
+        # Makes sure 'dest' holds the contents of 'url'. Returns True/False
+        if os.path.isfile( dest ):
+            if not sha256 or self.hashFile( dest )==sha256.lower():
+                return True
+            print("Checksum of existing",dest,"does not match, discarding it")
+            os.unlink( dest )
+        with self.urlLock( url ):
+            cached = self.lookup( url, sha256 )
+            if cached is None:
+                cached = self.download( url, sha256 )
+                if cached is None:
+                    return False
+            self.place( cached, dest )
+        return True
+
+    def place( self, cached, dest ):
+        # Hardlinks (or copies) a cached file into dest atomically
+        tmpname = '%s.%d.tmp' % (dest,os.getpid())
+        if os.path.lexists( tmpname ):
+            os.unlink( tmpname )
+        try:
+            os.link( cached, tmpname )
+        except OSError:
+            shutil.copyfile( cached, tmpname )
+        os.replace( tmpname, dest )
+
+    def download( self, url, sha256=None ):
+        # Downloads url into the cache and returns the cached file name
+        partial = self.partialName( url )
+        print("Downloading [%s]" % (url,))
+        # other processes sharing this cache may be at the same thing
+        with open( partial + '.lock', 'w' ) as lockf:
+            fcntl.flock( lockf, fcntl.LOCK_EX )
+            cached = self.lookup( url, sha256 )
+            if cached is not None:
+                return cached
+            count = 0
+            while True:
+                try:
+                    if self.transfer( url, partial ):
+                        break
+                except urllib.error.HTTPError as e:
+                    print("Exception while downloading",url, file=sys.stderr)
+                    print(e, file=sys.stderr)
+                    if e.code==416:
+                        # the partial file is no good to resume from
+                        os.unlink( partial )
+                    elif 400<=e.code<500:
+                        # no point in retrying
+                        return None
+                except Exception as e:
+                    print("Exception while downloading",url, file=sys.stderr)
+                    print(e, file=sys.stderr)
+                count += 1
+                if count == self.RETRIES:
+                    print("Giving up...")
+                    return None
+            return self.commit( url, partial, self.hashFile( partial ), sha256 )
+
+    def commit( self, url, partial, digest, sha256=None ):
+        # Moves a complete partial file into the cache, if it matches the
+        # checksum. Returns the cached file name or None
+        if sha256 and digest!=sha256.lower():
+            print("**** ERROR: Checksum mismatch for",url,
+                  "expected",sha256,"got",digest, file=sys.stderr)
+            os.unlink( partial )
+            return None
+        cached = os.path.join( self.cachedir, 'sha256', digest )
+        os.replace( partial, cached )
+        idxfile = os.path.join( self.cachedir, 'url', self.urlKey(url) )
+        with open( idxfile + '.tmp', 'w' ) as f:
+            f.write( digest )
+        os.replace( idxfile + '.tmp', idxfile )
+        print("[%s] downloaded to [%s]" % (url, cached))
+        return cached
+
+    def partialName( self, url ):
+        return os.path.join( self.cachedir, 'partial', self.urlKey(url) )
+
+    def stream( self, url, sha256=None ):
+        # Returns a SourceStream to read url while it is being downloaded
+        return SourceStream( self, url, sha256 )
+
+    def transfer( self, url, partial ):
+        # Streams url into the partial file, resuming from where a previous
+        # attempt stopped if the server supports ranges. Returns True when
+        # the whole file is there
+        offset = os.path.getsize( partial ) if os.path.isfile( partial ) else 0
+        req = urllib.request.Request( url )
+        if offset>0:
+            req.add_header( 'Range', 'bytes=%d-' % offset )
+        with urllib.request.urlopen( req, timeout=15 ) as usock:
+            if offset>0 and usock.getcode()==206:
+                print("Resuming",url,"from byte",offset)
+                mode = 'ab'
+            else:
+                offset = 0
+                mode = 'wb'
+            length = usock.headers.get('Content-Length') if usock.headers else None
+            received = 0
+            with open( partial, mode ) as fout:
+                for chunk in iter( lambda: usock.read( self.CHUNKSIZE ), b'' ):
+                    fout.write( chunk )
+                    received += len(chunk)
+        if length is not None and received<int(length):
+            print("Short read from",url,":",received,"of",length,"bytes")
+            return False
+        return True
+
+class SourceStream():
+    # A file-like object that reads a url while saving what is read into
+    # the source cache, so the source can be extracted while it downloads.
+    # If an earlier attempt left a partial file, that is read first and the
+    # rest is requested with a Range header. When the stream is closed
+    # without errors the file is checked and committed to the cache and
+    # 'cached' holds its name. If someone else got it into the cache while
+    # we waited for the lock, the cached file is read instead
+    def __init__( self, cache, url, sha256=None ):
+        self.cache = cache
+        self.url = url
+        self.sha256 = sha256
+        self.partial = cache.partialName( url )
+        self.sha = hashlib.sha256()
+        self.cached = None
+        self.total = None
+        self.prefix = None
+        self.prefixleft = 0
+        self.usock = None
+        self.out = None
+        self.lockf = None
+        self.urllock = None
+        self.length = None
+        self.received = 0
+
+    def __enter__( self ):
+        self.urllock = self.cache.urlLock( self.url )
+        self.urllock.acquire()
+        try:
+            self.lockf = open( self.partial + '.lock', 'w' )
+            fcntl.flock( self.lockf, fcntl.LOCK_EX )
+            cached = self.cache.lookup( self.url, self.sha256 )
+            if cached is not None:
+                self.cached = cached
+                self.prefix = open( cached, 'rb' )
+                self.prefixleft = self.total = os.path.getsize( cached )
+            else:
+                self.open()
+        except:
+            self.release()
+            raise
+        return self
+
+    def open( self ):
+        offset = os.path.getsize( self.partial ) if os.path.isfile( self.partial ) else 0
+        req = urllib.request.Request( self.url )
+        if offset>0:
+            req.add_header( 'Range', 'bytes=%d-' % offset )
+        print("Downloading [%s]" % (self.url,))
+        self.usock = urllib.request.urlopen( req, timeout=15 )
+        if offset>0 and self.usock.getcode()==206:
+            print("Resuming",self.url,"from byte",offset)
+            self.prefix = open( self.partial, 'rb' )
+            self.prefixleft = offset
+            self.out = open( self.partial, 'ab' )
+        else:
+            offset = 0
+            self.out = open( self.partial, 'wb' )
+        length = self.usock.headers.get('Content-Length') if self.usock.headers else None
+        self.length = int(length) if length is not None else None
+        self.total = offset + self.length if length is not None else None
+        self.received = 0
+
+    def read( self, size=-1 ):
+        if size is None or size<0:
+            size = SourceCache.CHUNKSIZE
+        if self.prefixleft>0:
+            data = self.prefix.read( min( size, self.prefixleft ) )
+            self.prefixleft -= len(data)
+        elif self.usock is None:
+            return b''
+        else:
+            data = self.usock.read( size )
+            self.out.write( data )
+            self.received += len(data)
+        self.sha.update( data )
+        return data
+
+    def __exit__( self, exc_type, exc_value, tb ):
+        try:
+            if exc_type is None and self.usock is not None:
+                # tar stops reading at its end marker, get the rest
+                while self.read( SourceCache.CHUNKSIZE ):
+                    pass
+                self.out.close()
+                if self.length is not None and self.received<self.length:
+                    raise Exception( "Short read from %s: %d of %d bytes" %
+                                     (self.url,self.received,self.length) )
+                self.cached = self.cache.commit( self.url, self.partial,
+                                                 self.sha.hexdigest(), self.sha256 )
+                if self.cached is None:
+                    raise Exception( "Checksum mismatch for %s" % (self.url,) )
+        finally:
+            self.release()
+
+    def release( self ):
+        for f in (self.prefix,self.out,self.usock):
+            if f is not None:
+                f.close()
+        if self.lockf is not None:
+            self.lockf.close()
+        self.urllock.release()
+
+class ProgressReader():
+    # Wraps a stream and prints how much of it has been read, every 10%
+    def __init__( self, stream, total, label ):
+        self.stream = stream
+        self.total = total
+        self.label = label
+        self.count = 0
+        self.shown = 0
+
+    def read( self, size=-1 ):
+        data = self.stream.read( size )
+        self.count += len(data)
+        if self.total:
+            pct = min( 100, 100*self.count//self.total ) // 10 * 10
+            if pct>self.shown:
+                self.shown = pct
+                print("%s: %d%% (%d of %d bytes)" % (self.label,pct,self.count,self.total))
+        return data
+
+class Extractor():
+    # Unpacks archives in process and straight from a stream, so a source
+    # can be extracted while it is still being downloaded. It understands
+    # tar, tar.gz, tar.xz, tar.bz2, tar.zst and zip. If one of the parallel
+    # decompressors below is installed, decompression runs in it and only
+    # the unpacking happens here. Member names and links are checked so
+    # nothing is ever written outside the destination directory
+    PARALLEL = { 'tar.gz':  [ ['pigz','-dc'] ],
+                 'tar.xz':  [ ['pixz','-d'], ['xz','-T0','-dc'] ],
+                 'tar.bz2': [ ['pbzip2','-dc'], ['lbzip2','-dc'] ],
+                 'tar.zst': [ ['zstd','-T0','-dc'] ] }
+    MODES = { 'tar':'r|', 'tar.gz':'r|gz', 'tar.xz':'r|xz', 'tar.bz2':'r|bz2' }
+
+    def __init__( self, destdir, label='Extracting' ):
+        self.destdir = destdir
+        self.root = os.path.realpath( destdir )
+        self.label = label
+
+    def extractFile( self, fname, ext ):
+        if ext=='zip':
+            return self.extractZip( fname )
+        with open( fname, 'rb' ) as f:
+            return self.extractStream( f, ext, os.path.getsize( fname ) )
+
+    def extractStream( self, stream, ext, total=None ):
+        # Extracts a tar archive being read from stream
+        stream = ProgressReader( stream, total, self.label )
+        if ext=='tar.zst':
+            try:
+                import zstandard
+                reader = zstandard.ZstdDecompressor().stream_reader( stream )
+                return self.extractTar( reader, 'r|' )
+            except ImportError:
+                pass
+        tool = self.parallelTool( ext )
+        if tool is not None:
+            return self.extractPiped( stream, tool )
+        if ext not in self.MODES:
+            raise Exception( "Do not know how to extract %s" % (ext,) )
+        return self.extractTar( stream, self.MODES[ext] )
+
+    def parallelTool( self, ext ):
+        for cmd in self.PARALLEL.get( ext, [] ):
+            if shutil.which( cmd[0] ):
+                return cmd
+        return None
+
+    def extractPiped( self, stream, cmd ):
+        # Decompresses through an external tool while we untar its output
+        proc = subprocess.Popen( cmd, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE )
+        errors = []
+        def feed():
+            try:
+                for chunk in iter( lambda: stream.read( SourceCache.CHUNKSIZE ), b'' ):
+                    proc.stdin.write( chunk )
+            except Exception as e:
+                errors.append( e )
+            finally:
+                try:
+                    proc.stdin.close()
+                except Exception:
+                    pass
+        feeder = threading.Thread( target=feed )
+        feeder.start()
+        try:
+            self.extractTar( proc.stdout, 'r|' )
+            # drain whatever comes after the tar end marker
+            while proc.stdout.read( SourceCache.CHUNKSIZE ):
+                pass
+        finally:
+            proc.stdout.close()
+            feeder.join()
+            proc.wait()
+        if errors:
+            raise errors[0]
+        if proc.returncode!=0:
+            raise Exception( "%s failed with status %d" % (cmd[0],proc.returncode) )
+        return True
+
+    def target( self, name ):
+        # The path an archive member goes to. Raises if it is outside
+        path = os.path.realpath( os.path.join( self.root, name ) )
+        if path!=self.root and not path.startswith( self.root + os.sep ):
+            raise Exception( "Archive member %s is outside %s" % (name,self.destdir) )
+        return path
+
+    def checkMember( self, member ):
+        if os.path.isabs( member.name ) or '..' in member.name.split('/'):
+            raise Exception( "Archive member %s is outside %s" % (member.name,self.destdir) )
+        self.target( member.name )
+        if member.issym():
+            if os.path.isabs( member.linkname ):
+                raise Exception( "Archive member %s links to absolute path %s" %
+                                 (member.name,member.linkname) )
+            self.target( os.path.join( os.path.dirname( member.name ), member.linkname ) )
+        elif member.islnk():
+            self.target( member.linkname )
+        elif not (member.isfile() or member.isdir()):
+            # devices, fifos and such have no place in a source tarball
+            return False
+        return True
+
+    def extractTar( self, stream, mode ):
+        kwargs = { 'filter':'tar' } if hasattr( tarfile, 'tar_filter' ) else {}
+        dirs = []
+        with tarfile.open( fileobj=stream, mode=mode ) as tar:
+            for member in tar:
+                if not self.checkMember( member ):
+                    continue
+                if member.isdir():
+                    # directories might be read-only, fix them at the end
+                    dirs.append( member )
+                    os.makedirs( self.target( member.name ), exist_ok=True )
+                    continue
+                tar.extract( member, self.destdir, **kwargs )
+        for member in reversed( dirs ):
+            path = self.target( member.name )
+            os.chmod( path, member.mode & 0o7777 )
+            os.utime( path, (member.mtime,member.mtime) )
+        return True
+
+    def extractZip( self, fname ):
+        with zipfile.ZipFile( fname ) as zf:
+            for info in zf.infolist():
+                path = self.target( info.filename )
+                if info.is_dir():
+                    os.makedirs( path, exist_ok=True )
+                    continue
+                os.makedirs( os.path.dirname( path ), exist_ok=True )
+                with zf.open( info ) as src, open( path, 'wb' ) as dst:
+                    shutil.copyfileobj( src, dst, SourceCache.CHUNKSIZE )
+                mode = (info.external_attr >> 16) & 0o777
+                if mode:
+                    os.chmod( path, mode )
+        return True
+
+class RepositoryCache():
+    # Mirrors of the git and svn repositories packages are built from,
+    # shared by all locations like the SourceCache, so a repository is
+    # cloned once per machine and then only what is new is fetched. Kept as
+    #     <mirrordir>/git/<name>-<hash of url>    a bare 'git clone --mirror'
+    #     <mirrordir>/svn/<name>-<hash of url>    an svn working copy
+    # Build trees are git worktrees of the mirror, or shallow clones of it
+    # when the package has a 'depth', and svn exports of the working copy,
+    # all at the revision resolved once per run so every package and the
+    # artifact key see the same one. A mirror is updated at most once per
+    # run and a lock file keeps other processes off it meanwhile
+    def __init__( self, mirrordir ):
+        self.mirrordir = mirrordir
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.updated = set()
+        self.revisions = {}
+
+    @staticmethod
+    def kind( url ):
+        # 'git' or 'svn' for the urls that are repositories, else None
+        if url.startswith( 'svn:' ) or url.startswith( 'svn+' ):
+            return 'svn'
+        if url.endswith( '.git' ) or url.startswith( 'git:' ):
+            return 'git'
+        return None
+
+    def mirrorPath( self, kind, url ):
+        name = re.sub( r'[^\w.-]', '_', os.path.basename( url.rstrip('/') ) ) or 'repo'
+        key = hashlib.sha256( url.encode('utf-8') ).hexdigest()[:16]
+        return os.path.join( self.mirrordir, kind, '%s-%s' % (name,key) )
+
+    @contextlib.contextmanager
+    def locked( self, kind, url ):
+        # One thread and one process at a time on a mirror
+        with self.lock:
+            lock = self.locks.setdefault( url, threading.Lock() )
+        path = self.mirrorPath( kind, url )
+        os.makedirs( os.path.dirname( path ), exist_ok=True )
+        with lock, open( path + '.lock', 'w' ) as lockf:
+            fcntl.flock( lockf, fcntl.LOCK_EX )
+            yield path
+
+    def run( self, args, cwd=None, quiet=False ):
+        # Runs git or svn, showing the output only if it fails. Returns the
+        # output or None if it failed or is not installed
+        if not quiet:
+            print("Exec:", " ".join( args ))
+        try:
+            pc = subprocess.run( args, cwd=cwd, stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT )
+        except OSError as e:
+            print("*** ERROR: could not run %s: %s" % (args[0],e))
+            return None
+        if pc.returncode!=0:
+            if not quiet:
+                print(pc.stdout.decode( 'utf-8', 'replace' ).rstrip())
+                print("*** ERROR: %s failed with status %d" % (args[0],pc.returncode))
+            return None
+        return pc.stdout.decode( 'utf-8', 'replace' )
+
+    def update( self, kind, url, path, partial=False ):
+        # Clones the mirror if it is not there, else fetches what is new
+        # once per run. Called with the mirror locked
+        if url in self.updated:
+            return True
+        if kind=='git':
+            if os.path.isdir( path ):
+                print(">> Updating mirror of",url)
+                ok = self.run( ['git','-C',path,'remote','update','--prune'] ) is not None
+            else:
+                print(">> Mirroring",url,"into",path)
+                tmpname = '%s.%d.tmp' % (path,os.getpid())
+                shutil.rmtree( tmpname, ignore_errors=True )
+                args = ['git','clone','--mirror','--quiet']
+                if partial:
+                    # blobs are fetched when a tree needs them
+                    args.append( '--filter=blob:none' )
+                ok = self.run( args + [url,tmpname] ) is not None
+                if ok:
+                    os.rename( tmpname, path )
+        else:
+            if os.path.isdir( path ):
+                print(">> Updating mirror of",url)
+                ok = self.run( ['svn','update','--quiet',path] ) is not None
+            else:
+                print(">> Mirroring",url,"into",path)
+                tmpname = '%s.%d.tmp' % (path,os.getpid())
+                shutil.rmtree( tmpname, ignore_errors=True )
+                ok = self.run( ['svn','checkout','--quiet',url,tmpname] ) is not None
+                if ok:
+                    os.rename( tmpname, path )
+        if ok:
+            self.updated.add( url )
+        return ok
+
+    def revision( self, kind, url, rev=None, partial=False, fetch=True ):
+        # The commit (git) or revision number (svn) that rev, a branch,
+        # tag, commit or number, is right now. The latest if rev is None.
+        # Returns None if the mirror cannot be updated or rev is unknown,
+        # which is not tried again in this run either. Without fetch, it
+        # is what rev was when the mirror was last updated, or None if
+        # there is no mirror, and nothing goes to the network
+        with self.lock:
+            if (url,rev) in self.revisions:
+                return self.revisions[(url,rev)]
+        if not fetch:
+            return self.localRevision( kind, url, rev )
+        with self.locked( kind, url ) as path:
+            out = None
+            if self.update( kind, url, path, partial ):
+                if kind=='git':
+                    out = self.run( ['git','-C',path,'rev-parse','--verify','--quiet',
+                                     '%s^{commit}' % (rev or 'HEAD',)] )
+                else:
+                    out = self.run( ['svn','info','--show-item','last-changed-revision',
+                                     '-r',str(rev or 'HEAD'),path] )
+            if not out:
+                print("*** ERROR: Revision",rev or 'HEAD',"not found in",url)
+            with self.lock:
+                return self.revisions.setdefault( (url,rev), out.strip() if out else None )
+
+    def localRevision( self, kind, url, rev=None ):
+        path = self.mirrorPath( kind, url )
+        if not os.path.isdir( path ):
+            return None
+        if kind=='git':
+            out = self.run( ['git','-C',path,'rev-parse','--verify','--quiet',
+                             '%s^{commit}' % (rev or 'HEAD',)], quiet=True )
+        elif rev is None:
+            out = self.run( ['svn','info','--show-item','last-changed-revision',path],
+                            quiet=True )
+        else:
+            # asking svn about other revisions means asking the server
+            out = str(rev) if str(rev).isdigit() else None
+        return out.strip() if out else None
+
+    def pin( self, url, rev, revision ):
+        # Takes rev to be this revision for the rest of the run, as it was
+        # resolved somewhere else
+        with self.lock:
+            self.revisions[(url,rev)] = revision
+
+    def checkout( self, kind, url, rev, dest, depth=None, partial=False ):
+        # Puts the tree of url at rev into dest, which must not exist.
+        # The mirror is brought up to date first. Returns True/False
+        revision = self.revision( kind, url, rev, partial )
+        if revision is None:
+            return False
+        with self.locked( kind, url ) as path:
+            if not self.update( kind, url, path, partial ):
+                return False
+            if kind=='git':
+                if depth:
+                    # a clone of its own with only the last commits
+                    ok = self.run( ['git','init','--quiet',dest] ) is not None and \
+                         self.run( ['git','-C',dest,'fetch','--quiet','--depth',str(depth),
+                                    'file://' + path, revision] ) is not None and \
+                         self.run( ['git','-C',dest,'checkout','--quiet','--detach',
+                                    'FETCH_HEAD'] ) is not None
+                else:
+                    # trees removed since are forgotten first
+                    self.run( ['git','-C',path,'worktree','prune'] )
+                    ok = self.run( ['git','-C',path,'worktree','add','--force','--detach',
+                                    dest,revision] ) is not None
+            else:
+                ok = self.run( ['svn','update','--quiet','-r',revision,path] ) is not None and \
+                     self.run( ['svn','export','--quiet',path,dest] ) is not None
+        if ok:
+            print(">> Checked out",url,"at",revision,"into",dest)
+        return ok
+
+class BuildManager():
+    # This is the build manager. It is the main entry point in the library
+    # You need to instantiate one of these and optionally limit the configs
+    # by providing a tag like 'bleeding', 'stable', 'fred', etc
+    # Make sure these tags exist in the configs otherwise you will end up
+    # empty handed as it will not match anything
+
+    # how many packages resolve() keeps a TemplateContext for
+    MAXCONTEXTS = 1024
+
+    def __init__( self,
+                  location = "default",
+                  tags = ['default',],
+                  platform=None,
+                  config="~/.bleedingedge.json",
+                  snapshot=None,
+                  tagttl=None,
+                  trace=None,
+                  rootdir=None ):
+
+        # This is the default platform
+        self.platform = platform or os.uname().sysname
+        self.versions = {}
+        self.mgrcontext = TemplateContext( [ self.versions, self.__dict__ ] )
+        self.pkgcontexts = {}
+
+        # as default-ready, get the path of this script. The config/ and
+        # tags/ directories are read from there unless told otherwise
+        thisscript = os.path.realpath(__file__)
+        self.thisdir = rootdir or os.path.dirname( thisscript )
+        self.index = PackageIndex.get( self.thisdir, snapshot )
+        self.numjobs = os.cpu_count()
+        self.modlock = threading.Lock()
+        self.tracer = Tracer()
+        if trace:
+            self.tracer.open( trace )
+        self.fromstep = None
+        self.forcestep = None
+        self.deploymode = 'copy'
+        self.deployconflicts = 'warn'
+        self.farm = None
+        self.manifest = None
+        self.logcompress = None
+        self.logmaxbytes = None
+        self.logkeep = 3
+        self.logtail = 30
+        self.follow = False
+        self.sources = None
+        self.sourcecache = None
+        self.mirrors = None
+        self.mirrordir = None
+        self.prefetcher = None
+        self.fetchjobs = 4
+        self.artifacts = None
+        self.artifactdir = None
+        self.useartifacts = True
+        self.compcache = None
+        self.ccachedir = None
+        self.ccachesize = 5<<30
+        self.useccache = True
+        self.ccstats = {}
+        self.diskbudget = None
+        self.tmpfs = False
+        self.tmpreserved = 0
+        self.history = None
+        self.dedup = None
+        self.deduper = None
+        self.cachedir = defaultCacheDir()
+        self.tagttl = tagttl
+        self.tagnames = tags
+        self.tagmaps = None
+        self.taglock = threading.Lock()
+        self.newconfig = None
+        self.dirsready = False
+        self.tagregex = {}
+        self.versionindex = {}
+        self.pkgnames = (None,frozenset())
+        self.depsolver = None
+        self.critical = None
+
+        # try to open the main config to read where the files will be
+        usercfg = os.path.expanduser( config )
+        if os.path.isfile( usercfg ):
+            # found main config, read
+            with open( usercfg ) as f:
+                js = json.loads( f.read() )
+            setjs = js.get( location )
+            if setjs is None:
+                print("*** ERROR Location",location,"is not specified in",usercfg)
+                return
+            # default all to repodir/... whenever not specified
+            self.repodir = setjs.get('repodir') or self.thisdir
+            self.builddir = setjs.get('builddir') or "%s/%s" % (self.repodir,'build')
+            self.installdir = setjs.get('installdir') or "%s/%s" % (self.repodir,'install')
+            self.deploydir  = setjs.get('deploydir')  or "%s/%s" % (self.repodir,'deploy')
+            self.tmpdir     = setjs.get('tmpdir') or "%s/%s" % (self.repodir,'tmp')
+            self.deploymode = setjs.get('deploymode') or self.deploymode
+            self.deployconflicts = setjs.get('deployconflicts') or self.deployconflicts
+            self.farmdir    = setjs.get('farmdir') or "%s/%s" % (self.repodir,'farms')
+            self.logcompress = setjs.get('logcompress')
+            self.logmaxbytes = setjs.get('logmaxbytes')
+            self.logkeep    = setjs.get('logkeep', self.logkeep)
+            self.logtail    = setjs.get('logtail', self.logtail)
+            self.cachedir   = setjs.get('cachedir') or self.cachedir
+            self.sourcecache = setjs.get('sourcecache')
+            self.mirrordir  = setjs.get('mirrordir')
+            self.artifactdir = setjs.get('artifactdir')
+            self.ccachedir  = setjs.get('ccachedir')
+            self.ccachesize = setjs.get('ccachesize', self.ccachesize)
+            self.diskbudget = setjs.get('diskbudget')
+            self.tmpfs      = setjs.get('tmpfs', self.tmpfs)
+            self.dedup      = setjs.get('dedup')
+            if self.tagttl is None:
+                self.tagttl = setjs.get('tagttl')
+        else:
+            # this is a new system - set the defaults to the directory that
+            # contains this script
+            self.repodir = self.thisdir
+            self.builddir =  "%s/build" % (self.repodir,)
+            self.installdir = "%s/install" % (self.repodir,)
+            self.deploydir  = "%s/deploy" % (self.repodir,)
+            self.tmpdir     = "%s/tmp" % ( self.repodir,)
+            self.farmdir    = "%s/farms" % ( self.repodir,)
+
+            # the default config is written for user's reference so he/she
+            # can tweak it later on, once we build something
+            self.newconfig = usercfg
+
+        # Nothing else is read or written until it is needed, so queries
+        # like --dump-environ are quick. The tags are read by tags and
+        # the directories created by makeDirectories()
+
+    @property
+    def tags( self ):
+        # you can specify several locations in your ~/.bleedingedge.json file
+        # the default would be just 'default'
+        # used to filter out all configurations that are not tagged with this
+        # They are read the first time they are needed, since the Ubuntu
+        # ones can mean going to the network
+        with self.taglock:
+            if self.tagmaps is None:
+                with self.tracer.span( 'tags' ):
+                    self.tagmaps = self.readTags( self.tagnames )
+            return self.tagmaps
+
+    def makeDirectories( self ):
+        # Writes the default config and creates the directories, before
+        # anything is built or deployed
+        if self.dirsready:
+            return
+        self.dirsready = True
+        if self.newconfig and not os.path.exists( self.newconfig ):
+            with open( self.newconfig, "w" ) as f:
+                cfg = { 'default':
+                        {   'repodir': self.repodir,
+                            'builddir': self.builddir,
+                            'installdir': self.installdir,
+                            'deploydir': self.deploydir,
+                            'tmpdir': self.tmpdir } }
+                # write a pretty json for their amusement
+                f.write( json.dumps( cfg, indent=4, separators=(',',': ') ) )
+
+        # build default directories
+        for dname in (self.repodir,self.builddir,self.installdir, self.deploydir):
+            try:
+                if not os.path.exists( dname ):
+                    os.makedirs( dname )
+                    print("Created directory", dname)
+            except Exception as e:
+                print("Exception while creating", dname, ": ", e)
+            if not os.path.exists( dname ):
+                print("Error: could not create ", dname, file=sys.stderr)
+            else:
+                if not os.path.isdir( dname ):
+                    print("Error: path exists but is not", \
+                        "a directory:", dname, file=sys.stderr)
+
+    def dumpEnvironment( self, farms=None ):
+        # With farms, the environment points at all of them, the first
+        # one taking precedence, instead of at deploydir
+        dirs = [ self.farmPath( name ) for name in farms ] if farms else [ self.deploydir ]
+        for dname in dirs:
+            if not os.path.isdir( dname ):
+                print("Warning:", dname, "does not exist", file=sys.stderr)
+        cmd = """
+        export PATH=$PATH:%s
+        export LD_LIBRARY_PATH=$LD_LIBRARY_PATH:%s
+        """ % ( ":".join( d + "/bin" for d in dirs ), ":".join( d + "/lib" for d in dirs ) )
+        return self.resolve( cmd )
+
+    def farmPath( self, name ):
+        return os.path.join( self.resolve( self.farmdir ), name )
+
+    def useFarm( self, name ):
+        # Deploys into the link farm {farmdir}/<name> instead of deploydir.
+        # Each farm is a stack of packages of its own, made of symlinks into
+        # the install directories, so several of them can be kept side by
+        # side and switching between them is cheap
+        self.farm = name
+        self.deploydir = self.farmPath( name )
+        self.deploymode = 'symlink'
+        self.manifest = None
+        os.makedirs( self.deploydir, exist_ok=True )
+
+    def parse( self, pkgstring ):
+        # this gets complicated because some damn packages have a dash on them as apache-maven
+        # we need a routine to parse the command-line and generate a package name and version
+        # The longest name that is a package wins, so apr-util-1.5 is
+        # apr-util version 1.5 and not apr version util-1.5
+        pkgnames = self.packageNames()
+        splits = pkgstring.split( '-' )
+        for j in range(len(splits),0,-1):
+            pkgname = '-'.join(splits[0:j])
+            version = '-'.join(splits[j:])
+            if pkgname in pkgnames:
+                return (pkgname,version)
+        return None,None
+
+    def updateStatus( self, pkgname, version, done, key=None ):
+        # we keep the status in the install directory as a touched file
+        # with the timestamp of when the deployment has completed and the
+        # artifact key of what was built, if known
+        fname = self.resolve( "{installdir}/{pkgname}-{version}.done",
+                              {'pkgname':pkgname,'version':version} )
+        if done:
+            with open( fname, "w" ) as f:
+                f.write( nowstr() )
+                if key:
+                    f.write( "\n" + key )
+        else:
+            # remove the sentinel
+            if os.path.isfile( fname ):
+                os.unlink( fname )
+
+    def checkIsBuilt( self, pkgname, version, key=None ):
+        # If a key is given, the package has to have been built with it.
+        # Sentinels without a key are taken as good
+        fname = self.resolve( "{installdir}/{pkgname}-{version}.done",
+                              {'pkgname':pkgname,'version':version} )
+        if not os.path.isfile( fname ):
+            return False
+        if key is None:
+            return True
+        with open( fname ) as f:
+            lines = f.read().splitlines()
+        return len(lines)<2 or lines[1]==key
+
+    def getManifest( self ):
+        # The manifest of what is deployed into deploydir
+        with self.modlock:
+            if self.manifest is None:
+                self.manifest = DeployManifest( self.resolve( "{deploydir}" ),
+                                                self.deployconflicts )
+        return self.manifest
+
+    def getSourceCache( self ):
+        # The cache of downloaded sources, shared by all locations
+        with self.modlock:
+            return self.getSourceCacheLocked()
+
+    def getSourceCacheLocked( self ):
+        if self.sources is None:
+            cachedir = self.sourcecache or os.path.join( self.cachedir, 'sources' )
+            self.sources = SourceCache( cachedir )
+        return self.sources
+
+    def getMirrors( self ):
+        # The mirrors of git and svn repositories, shared by all locations
+        with self.modlock:
+            if self.mirrors is None:
+                self.mirrors = RepositoryCache( self.mirrordir or
+                                                os.path.join( self.cachedir, 'mirrors' ) )
+        return self.mirrors
+
+    def getArtifactCache( self ):
+        # The cache of built packages or None if disabled
+        if not self.useartifacts:
+            return None
+        with self.modlock:
+            if self.artifacts is None:
+                cachedir = self.artifactdir or os.path.join( self.cachedir, 'artifacts' )
+                self.artifacts = ArtifactCache( cachedir )
+        return self.artifacts
+
+    def getCompilerCache( self ):
+        # The compiler cache or None if disabled
+        if not self.useccache:
+            return None
+        with self.modlock:
+            if self.compcache is None:
+                cachedir = self.ccachedir or os.path.join( self.cachedir, 'ccache' )
+                self.compcache = CompilerCache( cachedir, self.ccachesize )
+        return self.compcache
+
+    def getHistory( self ):
+        with self.modlock:
+            if self.history is None:
+                self.history = BuildHistory( os.path.join( self.cachedir, 'history.db' ) )
+        return self.history
+
+    def getDedup( self ):
+        # The index of the files in installdir, see InstallDedup
+        with self.modlock:
+            if self.deduper is None:
+                mode = self.dedup if self.dedup in ('reflink','hardlink') else 'auto'
+                self.deduper = InstallDedup( os.path.join( self.cachedir, 'dedup.db' ),
+                                             mode, self.numjobs )
+        return self.deduper
+
+    def dedupNode( self, pkgname, version ):
+        # Shares the files of this package that other prefixes already have
+        # when 'dedup' is set in the location config
+        if not self.dedup:
+            return
+        pkg = self.getPackage( pkgname, version )
+        dirname = self.resolve( pkg.get('dirname') or '{name}-{version}', pkg )
+        prefix = os.path.join( self.installdir, dirname )
+        with self.tracer.span( 'dedup', pkgname, version ):
+            count,saved = self.getDedup().dedup( [prefix] )
+        if count:
+            print(">> Deduplicated %d files of %s %s, %.1f MB saved" %
+                  (count, pkgname, version, saved/2**20))
+
+    def dedupInstalls( self, dryrun=False ):
+        # Shares identical files across all of installdir
+        installdir = self.resolve( self.installdir )
+        if not os.path.isdir( installdir ):
+            return True
+        roots = [ os.path.join( installdir, d ) for d in sorted( os.listdir( installdir ) ) ]
+        dedup = self.getDedup()
+        start = time.time()
+        count,saved = dedup.dedup( [ d for d in roots if os.path.isdir( d ) ], dryrun )
+        print("%s %d files, %.1f MB %s in %.1fs" %
+              ("Would share" if dryrun else "Shared", count, saved/2**20,
+               "to save" if dryrun else "saved", time.time()-start))
+        return True
+
+    @staticmethod
+    def freeSpace( path ):
+        # Bytes that can still be written in this filesystem
+        st = os.statvfs( path )
+        return st.f_bavail*st.f_frsize
+
+    @staticmethod
+    def availableMemory():
+        # MemAvailable from /proc/meminfo or None if there is no such thing
+        try:
+            with open( '/proc/meminfo' ) as f:
+                for line in f:
+                    if line.startswith( 'MemAvailable:' ):
+                        return int( line.split()[1] )*1024
+        except (OSError,ValueError):
+            pass
+        return None
+
+    def reserveTmpfs( self, bld ):
+        # Decides if this package is built in {tmpdir} instead of builddir,
+        # which is worth it when tmpdir is a tmpfs. Packages say so with
+        # 'tmpfs: true' or 'tmpfs: false' in their config. Otherwise, if
+        # tmpfs is 'auto' in the location config, packages whose previous
+        # build tree fits in tmpdir and in the free memory, counting the
+        # other packages building there, go to tmpdir. Returns the build
+        # directory in tmpdir and the bytes reserved, or (None,0)
+        wanted = bld.pkg.get( 'tmpfs' )
+        if wanted is None:
+            wanted = self.tmpfs
+        if not wanted:
+            return None,0
+        tmpbuild = os.path.join( self.resolve( self.tmpdir ), 'build' )
+        os.makedirs( tmpbuild, exist_ok=True )
+        stats = self.getHistory().get( bld.pkgname, bld.version )
+        estimate = int( 1.25*stats['size'] ) if stats and stats.get('size') else 0
+        if wanted=='auto' and not estimate:
+            # never built, we do not know how big it gets
+            return None,0
+        with self.modlock:
+            room = self.freeSpace( tmpbuild ) - self.tmpreserved
+            memory = self.availableMemory()
+            if memory is not None:
+                room = min( room, memory - self.tmpreserved )
+            if estimate > room:
+                print(">> Not building %s %s in %s: needs %.0f MB, %.0f MB free" %
+                      (bld.pkgname, bld.version, tmpbuild, estimate/2**20, room/2**20))
+                return None,0
+            self.tmpreserved += estimate
+        return tmpbuild,estimate
+
+    def releaseTmpfs( self, reserved ):
+        with self.modlock:
+            self.tmpreserved -= reserved
+
+    def tmpfsFull( self, tmpbuild ):
+        # True if tmpdir has run out of space, or nearly so
+        st = os.statvfs( tmpbuild )
+        return st.f_bavail < max( st.f_blocks//50, (64<<20)//max(st.f_frsize,1) )
+
+    def artifactKey( self, pkgname, version, depkeys ):
+        # Hash of everything that goes into building this package: its
+        # config with all {} resolved, the platform, where it installs to,
+        # the revision of its repositories, if any, and the keys of the
+        # packages it depends on
+        pkg = self.getPackage( pkgname, version )
+        config = {}
+        for name,value in thaw( pkg ).items():
+            if isinstance( value, str ):
+                try:
+                    value = self.resolve( value, pkg )
+                except Exception:
+                    # things like {numjobs} are not known here and
+                    # should not change the key anyway
+                    pass
+            config[name] = value
+        # a package built from a repository changes when the repository
+        # does, even if its config does not. This only looks at what the
+        # mirrors had when they were last updated, the scheduler fetches
+        # them right before the build - see BuildScheduler.settle()
+        bld = self.getBuilder( pkgname, version )
+        if bld.repositories():
+            config['revision'] = bld.revision( fetch=False ) or 'unknown'
+        data = { 'config': config,
+                 'platform': [ self.platform, plat.machine() ],
+                 'installdir': self.installdir,
+                 'depends': sorted( depkeys ) }
+        js = json.dumps( data, sort_keys=True )
+        return hashlib.sha256( js.encode('utf-8') ).hexdigest()
+
+    def restoreNode( self, pkgname, version, key ):
+        # Installs this package from the artifact cache if it is there
+        cache = self.getArtifactCache()
+        if cache is None or key is None:
+            return False
+        pkg = self.getPackage( pkgname, version )
+        dirname = self.resolve( pkg.get('dirname') or '{name}-{version}', pkg )
+        if not cache.lookup( pkgname, version, key ):
+            return False
+        with self.tracer.span( 'restore', pkgname, version ):
+            if not cache.restore( pkgname, version, key, self.installdir, dirname ):
+                return False
+        self.updateStatus( pkgname, version, True, key )
+        self.dedupNode( pkgname, version )
+        return True
+
+    def prefetch( self, nodes ):
+        # Starts downloading the sources of these (name,version) packages in
+        # the background and returns the Prefetcher
+        with self.modlock:
+            if self.prefetcher is None:
+                self.prefetcher = Prefetcher( self.getSourceCacheLocked(), self.fetchjobs )
+        for pkgname,version in nodes:
+            try:
+                bld = self.getBuilder( pkgname, version )
+                for url,pkgfile,sha256 in bld.sources():
+                    self.prefetcher.submit( url, pkgfile, sha256 )
+            except Exception as e:
+                print("Exception finding the sources of",pkgname,version,":",e)
+        return self.prefetcher
+
+    def fetchPackages( self, pkglist ):
+        # Only downloads the sources of these packages and all their
+        # dependencies, so they are in the source cache for a later build
+        sched = self.schedule( pkglist )
+        if sched is None:
+            return False
+        self.makeDirectories()
+        return self.prefetch( sched.order ).waitAll()
+
+    def planPackages( self, pkglist ):
+        # Returns what building these packages would do, without doing
+        # anything - see BuildScheduler.plan() - or None
+        sched = self.schedule( pkglist )
+        if sched is None:
+            return None
+        return sched.plan()
+
+    def buildEnvironment( self ):
+        # The environment the build commands run with. We add our deploydir
+        # to PATH and LD_LIBRARY_PATH so the packages use our libraries and
+        # tools by default. Each builder gets its own copy instead of us
+        # changing os.environ, as several builders can run at the same time
+        env = dict( os.environ )
+        env['PATH'] = ":".join( [env.get("PATH",""),self.resolve( "{deploydir}/bin:{deploydir}/x86_64-unknown-linux-gnu/bin" ) ] )
+        env['LD_LIBRARY_PATH'] = self.resolve( "{deploydir}/lib:{deploydir}/lib64:{deploydir}/x86_64-unknown-linux-gnu/lib" )
+        return env
+
+    def build( self, pkgname, version=None ):
+        # Executes all steps to retrieve this package, compile and install in
+        # its final destination, dependencies included
+        return self.buildPackages( [(pkgname,version)] )
+
+    def buildPackages( self, pkglist, maxparallel=None ):
+        # Builds a list of (pkgname,version) packages with all their
+        # dependencies. Packages that do not depend on each other are
+        # built at the same time - see BuildScheduler
+        sched = self.schedule( pkglist, maxparallel )
+        if sched is None:
+            return False
+        ok = sched.run()
+        self.critical = sched.criticalPath()
+        if self.ccstats:
+            print(self.compilerCacheSummary())
+        if self.diskbudget is not None:
+            # what was just built stays, whether some tag selects it or not
+            self.collectGarbage( self.diskbudget, keep=sched.order )
+        return ok
+
+    def collectGarbage( self, budget=None, dryrun=False, keep=() ):
+        # Frees disk in builddir and installdir, see GarbageCollector. The
+        # install prefixes of the (name,version) nodes in keep are left
+        gc = GarbageCollector( self, keep )
+        freed = gc.collect( budget, dryrun )
+        print("%s %.1f MB, %.1f MB in use" % ("Would free" if dryrun else "Freed",
+                                              freed/2**20, gc.usage()/2**20))
+        return True
+
+    def buildMatrix( self, variants, report=None, maxparallel=None ):
+        # Builds every variant, a list of (pkgname,version) like one
+        # compiler each, sharing whatever they have in common. Variants
+        # are built at the same time unless they need different versions
+        # of the same dependency in deploydir, in which case they go in
+        # different waves. A failure does not stop the rest. Writes a
+        # pass/fail/duration report of the versions that were resolved.
+        # A variant that resolves to other versions than asked for is a
+        # mismatch and is not built, one that resolves to the same
+        # packages as another is only built and counted once
+        stats = self.getHistory()
+        waves = []
+        results = []
+        seen = {}
+        for pkglist in variants:
+            solver = DependencySolver( self )
+            roots = [ solver.add( pkgname, version ) for pkgname,version in pkglist ]
+            result = { 'requested': [ "%s-%s" % (n,v) if v else n for n,v in pkglist ],
+                       'status': 'unresolved', 'duration': 0.0 }
+            result['packages'] = result['requested']
+            results.append( result )
+            if None in roots:
+                continue
+            result['packages'] = [ "%s-%s" % node for node in roots ]
+            if any( version is not None and str(version)!=node[1]
+                    for (pkgname,version),node in zip( pkglist, roots ) ):
+                print("Matrix variant %s resolves to %s, not building it" %
+                      (" ".join( result['requested'] ), " ".join( result['packages'] )))
+                result['status'] = 'mismatch'
+                continue
+            same = seen.setdefault( frozenset( roots ), result )
+            if same is not result:
+                print("Matrix variant %s is the same as %s, building it once" %
+                      (" ".join( result['requested'] ), " ".join( same['requested'] )))
+                result['status'] = 'duplicate'
+                result['same'] = same['packages']
+                continue
+            # what goes into deploydir, which has to agree within a wave
+            deployed = dict( dep for deps in solver.nodes.values() for dep in deps )
+            estimate = sum( (stats.get( *node ) or {}).get( 'wall', 0.0 ) for node in solver.order )
+            result['roots'] = roots
+            for wave in waves:
+                if all( wave['deployed'].get(name,version)==version
+                        for name,version in deployed.items() ):
+                    break
+            else:
+                wave = { 'deployed':{}, 'variants':[] }
+                waves.append( wave )
+            wave['deployed'].update( deployed )
+            wave['variants'].append( (estimate,pkglist,result) )
+
+        for num,wave in enumerate( waves ):
+            print(">> Matrix wave %d of %d: %d variants" % (num+1,len(waves),len(wave['variants'])))
+            sched = BuildScheduler( self, maxparallel=maxparallel )
+            # the longest variants first
+            for estimate,pkglist,result in sorted( wave['variants'], key=lambda x: -x[0] ):
+                sched.addVariant( pkglist )
+            sched.run()
+            self.critical = max( filter( None, [ self.critical, sched.criticalPath() ] ) )
+            walls = {}
+            for ev in self.tracer.events:
+                if ev['name']=='build':
+                    walls[ (ev['package'],ev['version']) ] = ev['wall']
+            for estimate,pkglist,result in wave['variants']:
+                roots = result.pop( 'roots' )
+                # a variant whose dependency failed fails too, the report
+                # tells which packages were the culprits
+                if any( node in sched.failed or node in sched.cancelled for node in roots ):
+                    result['status'] = 'fail'
+                else:
+                    result['status'] = 'pass'
+                result['duration'] = sum( walls.get( node, 0.0 ) for node in roots )
+                failed = [ "%s-%s" % node for node in sched.failed
+                           if node in roots or any( node in sched.solver.closures[root] for root in roots ) ]
+                if failed:
+                    result['failed'] = sorted( failed )
+
+        lines = [ "%-40s %-10s %10s" % ('variant','status','duration') ]
+        for result in results:
+            line = "%-40s %-10s %9.1fs" % ( " ".join( result['packages'] ), result['status'],
+                                            result['duration'] )
+            if result.get('failed'):
+                line += "  failed: " + " ".join( result['failed'] )
+            if result['status']=='mismatch':
+                line += "  requested: " + " ".join( result['requested'] )
+            if result.get('same'):
+                line += "  same as: " + " ".join( result['same'] )
+            lines.append( line )
+        print("\n".join( lines ))
+        if report:
+            with open( report, 'w' ) as f:
+                if report.endswith( '.json' ):
+                    f.write( json.dumps( { 'variants':results }, indent=1 ) )
+                else:
+                    f.write( "\n".join( lines ) + "\n" )
+            print("Matrix report written to", report)
+        return all( result['status'] in ('pass','duplicate') for result in results )
+
+    def buildSummary( self ):
+        # The time every package spent in each step and the critical path
+        # of the last build, printed at the end of every run
+        lines = [ self.tracer.summary( Builder.STEPS + ('extract','deploy','restore','cache') ) ]
+        if self.critical:
+            wall,path = self.critical
+            lines.append( "Critical path %.1fs: %s" % (wall, " -> ".join(
+                "%s-%s" % node for node in path )) )
+        return "\n".join( lines )
+
+    def compilerCacheSummary( self ):
+        # Hits and misses of the compiler cache per package built
+        lines = [ "%-20s %-10s %8s %8s %8s %6s" % ('package','version','hits','misses','skipped','hit%') ]
+        for (pkgname,version),counts in sorted( self.ccstats.items() ):
+            cacheable = counts['hit'] + counts['miss']
+            lines.append( "%-20s %-10s %8d %8d %8d %5.0f%%" %
+                          ( pkgname, version, counts['hit'], counts['miss'], counts['skip'],
+                            100.0*counts['hit']/cacheable if cacheable else 0 ) )
+        return "\n".join( lines )
+
+    def formatPlan( self, actions, asjson=False ):
+        # The plan as a table or as JSON. Dependencies come first
+        if asjson:
+            plan = [ { 'name':node[0], 'version':node[1], 'action':action }
+                     for node,action in actions ]
+            return json.dumps( { 'plan':plan }, indent=1 )
+        lines = [ "%-8s %s %s" % (action,node[0],node[1]) for node,action in actions ]
+        counts = collections.Counter( action for node,action in actions )
+        lines.append( "%d to build, %d to restore, %d up to date" %
+                      (counts['build'],counts['restore'],counts['skip']) )
+        return "\n".join( lines )
+
+    def planMatrix( self, variants, asjson=False ):
+        # The plan of every matrix variant as a table or as JSON, or None
+        # if one could not be resolved. Nothing is built, see planPackages()
+        plans = []
+        for pkglist in variants:
+            actions = self.planPackages( pkglist )
+            if actions is None:
+                return None
+            plans.append( ( [ "%s-%s" % (n,v) if v else n for n,v in pkglist ], actions ) )
+        if asjson:
+            return json.dumps( { 'variants':[
+                { 'requested':requested,
+                  'plan':[ { 'name':node[0], 'version':node[1], 'action':action }
+                           for node,action in actions ] }
+                for requested,actions in plans ] }, indent=1 )
+        return "\n".join( "Matrix variant %s\n%s" % (" ".join( requested ), self.formatPlan( actions ))
+                          for requested,actions in plans )
+
+    def schedule( self, pkglist, maxparallel=None ):
+        # Resolves the whole graph of these (pkgname,version) packages at
+        # once. Returns the BuildScheduler or None if it could not be
+        # resolved
+        sched = BuildScheduler( self, maxparallel=maxparallel )
+        with self.tracer.span( 'resolve' ):
+            for pkgname,version in pkglist:
+                print("Requested package [%s] version [%s]" % (pkgname,version))
+                node = sched.addPackage( pkgname, version )
+                if not node:
+                    return None
+                sched.roots.add( node )
+        return sched
+
+    def buildNode( self, pkgname, version, numjobs, key=None, seed='',
+                   fromstep=None, forcestep=None ):
+        # Builds one single package assuming all its dependencies have
+        # already been built and deployed into deploydir. If a key is given
+        # the package is restored from the artifact cache when possible and
+        # stored there once built. The steps that already completed in a
+        # previous attempt are skipped - see Builder.runSteps()
+        self.makeDirectories()
+        if not (fromstep or forcestep) and self.restoreNode( pkgname, version, key ):
+            return True
+        print("Searching for builder for package [%s] version [%s]" %(pkgname,version))
+        bld = self.getBuilder( pkgname, version )
+        bld.numjobs = numjobs
+        bld.env = self.buildEnvironment()
+        # packages can opt out of the compiler cache with 'ccache: false'
+        compcache = self.getCompilerCache() if bld.pkg.get('ccache',True) else None
+        if compcache is not None:
+            statsfile = bld.resolve( "{builddir}/{dirname}.ccstats" )
+            if os.path.exists( statsfile ):
+                os.unlink( statsfile )
+            bld.env = compcache.environment( bld.env, statsfile )
+
+        # Not deployed, go through the compilation process again. This can
+        # happen in tmpdir and only what is installed ends up on disk
+        prefix = bld.resolve( "{installdir}/{dirname}" )
+        if self.dedup and os.path.isdir( prefix ):
+            # make install would write into the files other prefixes share
+            self.getDedup().unshare( prefix )
+        started = time.time()
+        tmpbuild,reserved = self.reserveTmpfs( bld )
+        if tmpbuild:
+            print(">> Building %s %s in %s" % (pkgname, bld.version, tmpbuild))
+            bld.pkg['builddir'] = tmpbuild
+        ok = False
+        try:
+            ok = bld.runSteps( seed, fromstep, forcestep )
+        except Exception as e:
+            print("Exception caught building ", pkgname, version)
+            print(e)
+        finally:
+            self.releaseTmpfs( reserved )
+        if not ok and tmpbuild and self.tmpfsFull( tmpbuild ):
+            print(">> %s is full, building %s %s on disk" % (tmpbuild, pkgname, bld.version))
+            shutil.rmtree( bld.resolve( "{builddir}/{dirname}" ), ignore_errors=True )
+            if os.path.isfile( bld.stepsFile() ):
+                os.unlink( bld.stepsFile() )
+            del bld.pkg['builddir']
+            bld.pkg.pop( 'pkgfile', None )
+            tmpbuild = None
+            try:
+                ok = bld.runSteps( seed, fromstep, forcestep )
+            except Exception as e:
+                print("Exception caught building ", pkgname, version)
+                print(e)
+        # how long it took and its steps, to schedule the longest first
+        # next time and to tell regressions, and how big the build tree
+        # got, to decide where to build it
+        values = { 'started': started, 'wall': time.time() - started,
+                   'confighash': self.artifactKey( pkgname, bld.version, [] ) }
+        steps = [ (ev['name'],ev['wall'],ev['maxrss']) for ev in self.tracer.events
+                  if ev['package']==pkgname and ev['version']==bld.version
+                  and ev['start']>=started and ev['name'] in Builder.STEPS ]
+        if steps:
+            values['maxrss'] = max( step[2] for step in steps )
+        revision = bld.revision( fetch=False )
+        if revision is not None:
+            values['revision'] = revision
+        tree = bld.resolve( "{builddir}/{dirname}" )
+        if ok and os.path.isdir( tree ):
+            values['size'] = GarbageCollector.diskUsage( tree )
+        # a build that skipped steps, resumed or from --from-step/--force-step,
+        # says nothing about how long the package takes to build
+        status = 'ok' if ok else 'failed'
+        if ok and set( step[0] for step in steps )!=set( Builder.STEPS ):
+            status = 'partial'
+        self.getHistory().record( pkgname, bld.version, status, steps, **values )
+        if ok:
+            if tmpbuild:
+                # nothing of it is kept in memory, the tarball included
+                shutil.rmtree( tree, ignore_errors=True )
+                for fname in [ bld.stepsFile() ] + [
+                        os.path.join( tmpbuild, '%s-%s%s' % (pkgname,bld.version,ext) )
+                        for ext in GarbageCollector.ARCHIVES ]:
+                    if os.path.isfile( fname ):
+                        os.unlink( fname )
+
+        if compcache is not None:
+            counts = compcache.stats( statsfile )
+            if counts:
+                self.ccstats[(pkgname,bld.version)] = counts
+                print(">> Compiler cache for %s %s: %d hits, %d misses, %d not cacheable" %
+                      (pkgname, bld.version, counts['hit'], counts['miss'], counts['skip']))
+            compcache.trim()
+
+        # update this package's status
+        self.updateStatus( pkgname, bld.version, ok, key )
+        if ok and self.diskbudget is not None:
+            # with a disk budget the build tree goes as soon as it is installed
+            builddir = bld.resolve( "{builddir}/{dirname}" )
+            if os.path.isdir( builddir ):
+                shutil.rmtree( builddir )
+            if os.path.isfile( bld.stepsFile() ):
+                os.unlink( bld.stepsFile() )
+        cache = self.getArtifactCache()
+        if ok and cache is not None and key is not None:
+            with self.tracer.span( 'cache', pkgname, bld.version ):
+                cache.store( pkgname, bld.version, key, self.installdir,
+                             bld.resolve( '{dirname}' ) )
+        if ok:
+            self.dedupNode( pkgname, bld.version )
+        return ok
+
+    def getDirectDependencies( self, pkgname, version=None ):
+        # Returns the (name,version) of the packages listed in the 'depends'
+        # field of this package - not the whole closure, which is what
+        # getDependencies() does. Versions are resolved against the configs
+        pkg = self.getPackage( pkgname, version )
+        if pkg is None:
+            return None
+        deps = []
+        depends = pkg.get('depends') or []
+        if isinstance( depends, str ):
+            depends = [ depends ]
+        for dep in depends:
+            if isinstance(dep,list) or isinstance(dep,tuple):
+                depname,depver = dep
+            else:
+                depname,depver = self.parse( dep )
+                if depname is None:
+                    print("**** ERROR: Dependency",dep,"of",pkgname,"does not match any package")
+                    return None
+            deppkg = self.getPackage( depname, depver or None )
+            if deppkg is None:
+                return None
+            deps.append( (depname,deppkg['version']) )
+        return deps
+
+    def packageNames( self ):
+        # list all files in config/ ending in .json or .yaml and take the
+        # unique set of them. Computed again only if config/ changes
+        files = self.index.packageFiles()
+        if self.pkgnames[0] is not files:
+            pkgs = frozenset([ v.rsplit('.',1)[0] for v in files ])
+            self.pkgnames = (files,pkgs)
+        return self.pkgnames[1]
+
+    def getAllPackages( self ):
+        return sorted( self.packageNames() )
+
+    def getDependencies( self, pkgname, version=None ):
+        # Returns all the packages this one depends on, directly or not, as
+        # a list of (name,version) with the dependencies first. We want to
+        # return an empty list not None so the for loop does not break
+        # The graph is kept between calls. It is not pinned, as different
+        # calls can ask for different versions of the same package
+        if self.depsolver is None:
+            self.depsolver = DependencySolver( self, pinned=False )
+        solver = self.depsolver
+        node = solver.add( pkgname, version )
+        if node is None:
+            return []
+        return [ dep for dep in solver.order if dep in solver.closures[node] ]
+
+    # custom builder modules, by file, loaded once per process
+    builders = {}
+
+    def loadBuilder( self, modname, srcfile ):
+        # Imports config/<modname>.py, again only if it changed since
+        st = os.stat( srcfile )
+        stamp = (st.st_mtime_ns,st.st_size)
+        cached = self.builders.get( srcfile )
+        if cached is not None and cached[0]==stamp:
+            return cached[1]
+        start = time.time()
+        spec = importlib.util.spec_from_file_location( modname, srcfile )
+        module = importlib.util.module_from_spec( spec )
+        sys.modules[modname] = module
+        spec.loader.exec_module( module )
+        IMPORTS.append( { 'name':'import', 'module':srcfile, 'package':None, 'version':None,
+                          'start':start, 'wall':time.time()-start } )
+        self.builders[srcfile] = (stamp,module)
+        return module
+
+    def getBuilder( self, pkgname, version=None ):
+        # Retrieve the builder object responsible for this particular
+        # package and version. We try first to match a python file like
+        # <this-script-dir>/gcc-5.1.0.py for gcc version 5.1.0
+        # then we try to match
+        # <this-script-dir>/gcc.py for gcc (generic)
+        # if both are not found, returns just the default Builder
+        altfiles = []
+        if version:
+            altfiles.append( ("%s-%s" % (pkgname,version), "%s/config/%s-%s.py" % (self.thisdir,pkgname,version)) )
+        altfiles.append( (pkgname, "%s/config/%s.py" % (self.thisdir,pkgname)) )
+        for modname,srcfile in altfiles:
+            if os.path.isfile( srcfile ):
+                # builders can be requested from several threads at once
+                with self.modlock:
+                    module = self.loadBuilder( modname, srcfile )
+                bld = module.CustomBuilder( self, pkgname, version )
+                return bld
+        return Builder( self, pkgname, version )
+
+    def getPackage( self, pkgname, version=None ):
+        # we make this in two steps because we have to transform
+        # the configuration that is in the file and stuff it with defaults
+        # if they are not present.
+        # Doing this way we also can reuse a config from a previous version and
+        # modify them
+        # The package returned is read-only, make a dict() of it if you
+        # need to change it
+        pkg = self.__getPackage( pkgname, version )
+        if pkg is not None:
+            pkg = dict( pkg )
+            # Version can be different - we might have specified gcc 4.2.8 but
+            # the only config available is gcc 5.1.2 which we assume is o.k.
+            if (version is not None) and (not 'version' in pkg):
+                pkg['version'] = version
+            # 'name' is not a required field since it's implicit on the file
+            # location so we just add it here for consistency.
+            pkg['name'] = pkgname
+            pkg = types.MappingProxyType( pkg )
+        return pkg
+
+    def __loadPackage( self, pkgname ):
+        # Then, we need to find a configuration file for this package
+        # that resides on the same directory than this script, in
+        # config/<packagename>.{platform}.json
+        # The files are parsed only once, see PackageIndex
+        alltried = []
+        for ext in ['json','yaml']:
+          for inner in [ '.' + self.platform + '.', '.' ]:
+            pkgfile = '%s/config/%s%s%s' % (self.thisdir,pkgname,inner,ext)
+            alltried.append( pkgfile )
+            try:
+                data = self.index.load( pkgfile )
+            except Exception as e:
+                print("Exception while reading from file",pkgfile,":", e)
+                return None
+            if data is not None:
+                return data
+
+        namestr= ", ".join( alltried )
+        print("**** ERROR: Package file",pkgname,"is missing. Tried:", namestr )
+        return None
+
+    def versionIndex( self, pkgname, js ):
+        # The configs of this package that have our tags, sorted by version,
+        # as two lists: the versions, for bisect, and the configs. Built
+        # once per parsed file
+        cached = self.versionindex.get( pkgname )
+        if cached is not None and cached[0] is js:
+            return cached[1],cached[2]
+        allvs = sorted( ( (Version(item['version']),item) for item in js
+                          if self.matchTags( pkgname, item['version'] ) ),
+                        key=lambda x: x[0] )
+        keys = [ vs for vs,item in allvs ]
+        items = [ item for vs,item in allvs ]
+        self.versionindex[pkgname] = (js,keys,items)
+        return keys,items
+
+    def allConfigs( self, pkgname ):
+        # All the configs of this package, whatever their tags
+        js = self.__loadPackage( pkgname )
+        if js is None:
+            return ()
+        if isinstance( js, types.MappingProxyType ):
+            return (js,)
+        return js
+
+    def listVersions( self, pkgname ):
+        # Returns all (version, matches our tags) in the config of this
+        # package, sorted
+        js = self.__loadPackage( pkgname )
+        if js is None:
+            return None
+        if isinstance( js, types.MappingProxyType ):
+            js = (js,)
+        allvs = sorted( Version(item['version']) for item in js )
+        return [ (str(vs),self.matchTags( pkgname, str(vs) )) for vs in allvs ]
+
+    def __getPackage( self, pkgname, version=None ):
+        js = self.__loadPackage( pkgname )
+        if js is None:
+            return None
+
+        # The file can be a list of configurations or just one
+        # if configuration is just a dict, meaning there is only one, return it
+        if isinstance( js, types.MappingProxyType ):
+            # Returns it only if this config's tag matches what we've specified
+            if not self.matchTags( pkgname, js['version'] ):
+                print("Could not find a valid configuration with tags:")
+                print('    ', ','.join(self.tags))
+                return None
+            return js
+
+        # pick the version that best approximates AND has our tag (if any)
+        keys,items = self.versionIndex( pkgname, js )
+        if not items:
+            # otherwise, return the first version available if everything was wrong
+            return js[0]
+        if not version:
+            return items[-1]
+        vs = Version( version )
+        pos = bisect.bisect_left( keys, vs )
+        if pos<len(keys) and keys[pos]==vs:
+            return items[pos]
+        # No perfect match: the config of the closest version below is
+        # the lower bound we want. If there is none, the lowest one
+        pos = bisect.bisect_right( keys, vs )
+        return items[pos-1] if pos>0 else items[0]
+
+    # Reads ubuntu version files (trusty, bionic, etc)
+    def readUbuntuTag( self, tag ):
+        cache = TagCache( self.cachedir, self.tagttl )
+        return cache.get( tag, self.getAllPackages() )
+
+    def readTags( self, tags ):
+        print("ReadTags:", tags)
+        # produces a dict of tag => { pkgname => [versions] } for this package
+        # The patterns are compiled only when needed, see matchTags()
+        ver = {}
+        for tag in tags:
+            fname = os.path.join( self.thisdir, "tags/%s.yaml" % tag )
+            if os.path.isfile( fname ):
+                try:
+                    tagmap = self.index.load( fname )
+                except Exception as e:
+                    print("Tag file",fname," Exception",e)
+                    return None
+            else:
+                tagmap = self.readUbuntuTag( tag )
+                if not tagmap:
+                    print("Tag",tag,"does not exist!")
+                    continue
+            pkgmap = {}
+            for pkgname,verlist in tagmap.items():
+                if isinstance(verlist,str):
+                    verlist = (verlist,)
+                pkgmap[pkgname] = verlist
+            ver[tag] = pkgmap
+        return ver
+
+    def tagRegex( self, tag, pkgname ):
+        # Compiles the version wildcards of this package in this tag into
+        # one regular expression, the first time it is asked for
+        key = (tag,pkgname)
+        rexpr = self.tagregex.get( key )
+        if rexpr is None:
+            verlist = self.tags[tag].get( pkgname )
+            if verlist is None:
+                return None
+            matchstr = '|'.join('(?:{0})'.format(fnmatch.translate(str(x)))
+                                for x in verlist)
+            rexpr = re.compile(matchstr)
+            self.tagregex[key] = rexpr
+        return rexpr
+
+    def matchTags( self, pkgname, version ):
+        #print( "Matching",pkgname," to version", version )
+        for tag in self.tags:
+            rexpr = self.tagRegex( tag, pkgname )
+            if (rexpr is None) or (rexpr.match(version) is None):
+                #print("Match(",pkgname,",",version,")=False", rexpr)
+                return False
+        #print("Match(",pkgname,",",version,")=True")
+        return True
+
+    def context( self, pkg=None ):
+        # What {} are resolved against: the package from config, then the
+        # versions of the packages being built, then this manager's fields
+        # Contexts are kept by package dict, which they hold on to so its
+        # id is not reused, and dropped all at once when there are many
+        if pkg is None:
+            return self.mgrcontext
+        entry = self.pkgcontexts.get( id(pkg) )
+        if entry is None or entry[0] is not pkg:
+            if len(self.pkgcontexts) >= self.MAXCONTEXTS:
+                self.pkgcontexts = {}
+            entry = (pkg,TemplateContext( [ pkg, self.versions, self.__dict__ ] ))
+            self.pkgcontexts[id(pkg)] = entry
+        return entry[1]
+
+    def resolve( self, newval, pkg=None ):
+        # Substitutes all {}, see TemplateContext. Raises ResolveError for
+        # undefined keys and reference cycles
+        return self.context( pkg ).resolve( newval )
+
+class DeployManifest():
+    # Keeps track of what is deployed in a deploydir: which version of each
+    # package and which files came from it, along with the size and mtime
+    # of the installed file they were taken from. Deploying a package then
+    # only touches the files that are missing or changed and removes the
+    # ones the previous version had but this one does not.
+    # Files can be copied (the default), hardlinked or symlinked into
+    # {installdir}/{dirname}. Linking turns a deploy into a metadata-only
+    # operation, at the price of deploydir depending on installdir.
+    # When two packages ship the same file with different contents, the
+    # package that deployed it first keeps it and the conflict is reported,
+    # or the deploy fails if conflicts is 'error'
+    MODES = ('copy','hardlink','symlink')
+    CONFLICTS = ('warn','error')
+
+    def __init__( self, deploydir, conflicts='warn' ):
+        if conflicts not in self.CONFLICTS:
+            raise ValueError( "Unknown deploy conflict policy %s" % (conflicts,) )
+        self.deploydir = deploydir
+        self.conflicts = conflicts
+        self.fname = os.path.join( deploydir, '.bleedingedge-manifest.json' )
+        self.lock = threading.RLock()
+        self.packages = {}
+        if os.path.isfile( self.fname ):
+            try:
+                with open( self.fname ) as f:
+                    self.packages = json.loads( f.read() ).get('packages',{})
+            except Exception as e:
+                print("Exception reading manifest",self.fname,":",e)
+                self.clear()
+        elif os.path.isdir( deploydir ) and os.listdir( deploydir ):
+            # deployed by an older version or by hand - we have no idea
+            # of what is in there so start from scratch
+            self.clear()
+
+    def clear( self ):
+        print(">> Removing ",self.deploydir)
+        if os.path.exists( self.deploydir ):
+            shutil.rmtree( self.deploydir )
+        os.makedirs( self.deploydir )
+        self.packages = {}
+        self.save()
+
+    def save( self ):
+        # write to a temporary and rename so we never leave half a manifest
+        tmpname = self.fname + '.tmp'
+        with open( tmpname, 'w' ) as f:
+            f.write( json.dumps( {'packages':self.packages}, indent=1, sort_keys=True ) )
+        os.replace( tmpname, self.fname )
+
+    def owners( self, relpath, exclude=None ):
+        # Returns the packages that deployed this file, except 'exclude'
+        return [ name for name,entry in self.packages.items()
+                 if name!=exclude and relpath in (entry.get('files') or {}) ]
+
+    def record( self, pkgname, version ):
+        # Records a package deployed by a custom command. We cannot tell
+        # which files it has put in place so it cannot be removed later on
+        # other than by wiping the whole deploydir
+        with self.lock:
+            self.packages[pkgname] = {'version':version, 'files':None}
+            self.save()
+
+    def prune( self, keep ):
+        # Removes all packages that are not in 'keep', a set of (name,version)
+        with self.lock:
+            stale = [ name for name,entry in self.packages.items()
+                      if (name,entry['version']) not in keep ]
+            if not stale:
+                return True
+            if any( self.packages[name].get('files') is None for name in stale ):
+                # an untracked package is going away
+                self.clear()
+                return True
+            for name in stale:
+                print(">> Undeploying", name, self.packages[name]['version'])
+                files = self.packages.pop( name )['files']
+                self.removeFiles( name, files )
+            self.save()
+            return True
+
+    def removeFiles( self, pkgname, files ):
+        # Removes the files that were deployed by this package and no other.
+        # Files that another package ships too are put back from it, in
+        # case they were the ones of this package
+        dirs = set()
+        for relpath in files:
+            dst = os.path.join( self.deploydir, relpath )
+            owners = self.owners( relpath, exclude=pkgname )
+            if owners:
+                entry = self.packages[owners[0]]
+                if entry.get('srcdir') and entry['files'].get(relpath):
+                    src = os.path.join( entry['srcdir'], relpath )
+                    if not self.uptodate( src, dst, entry.get('mode') ):
+                        self.place( src, dst, entry.get('mode') )
+                continue
+            if os.path.lexists( dst ) and not os.path.isdir( dst ):
+                os.unlink( dst )
+            dirs.add( os.path.dirname( dst ) )
+        # clean up the directories that became empty, deepest first
+        for dname in sorted( dirs, key=len, reverse=True ):
+            while dname.startswith( self.deploydir + os.sep ):
+                try:
+                    os.rmdir( dname )
+                except OSError:
+                    break
+                dname = os.path.dirname( dname )
+
+    def deploy( self, pkgname, version, srcdir, mode='copy' ):
+        # Brings the files of this package in deploydir in line with srcdir
+        if not os.path.isdir( srcdir ):
+            print("Install directory",srcdir,"does not exist")
+            return False
+        files = {}
+        for dirpath,dirnames,filenames in os.walk( srcdir ):
+            for fname in filenames + [ d for d in dirnames
+                                       if os.path.islink( os.path.join(dirpath,d) ) ]:
+                src = os.path.join( dirpath, fname )
+                st = os.lstat( src )
+                files[ os.path.relpath( src, srcdir ) ] = [ st.st_size, st.st_mtime_ns ]
+        with self.lock:
+            old = self.packages.get( pkgname ) or {}
+            oldfiles = old.get('files') or {}
+            same = old.get('version')==version and old.get('mode')==mode
+            conflicts = self.findConflicts( pkgname, srcdir, files )
+            if conflicts and self.conflicts=='error':
+                self.reportConflicts( pkgname, conflicts )
+                return False
+            added = unchanged = 0
+            for relpath,sig in files.items():
+                if relpath in conflicts:
+                    continue
+                src = os.path.join( srcdir, relpath )
+                dst = os.path.join( self.deploydir, relpath )
+                if same and oldfiles.get(relpath)==sig and os.path.lexists( dst ):
+                    unchanged += 1
+                    continue
+                if self.uptodate( src, dst, mode ):
+                    # e.g. the same link left by the previous stack
+                    unchanged += 1
+                    continue
+                self.place( src, dst, mode )
+                added += 1
+            stale = [ relpath for relpath in oldfiles if relpath not in files ]
+            self.removeFiles( pkgname, stale )
+            self.packages[pkgname] = {'version':version, 'mode':mode,
+                                      'srcdir':srcdir, 'files':files}
+            self.save()
+        self.reportConflicts( pkgname, conflicts )
+        print(">> Deployed %s %s: %d updated, %d unchanged, %d removed" %
+              (pkgname, version, added, unchanged, len(stale)))
+        return True
+
+    def findConflicts( self, pkgname, srcdir, files ):
+        # Files of this package that another package has deployed with
+        # different contents. Returns a dict relpath => other package
+        conflicts = {}
+        for relpath in files:
+            owners = self.owners( relpath, exclude=pkgname )
+            if not owners:
+                continue
+            src = os.path.join( srcdir, relpath )
+            dst = os.path.join( self.deploydir, relpath )
+            if not self.identical( src, dst ):
+                conflicts[relpath] = owners[0]
+        return conflicts
+
+    def reportConflicts( self, pkgname, conflicts ):
+        if not conflicts:
+            return
+        byowner = collections.defaultdict( list )
+        for relpath,owner in sorted( conflicts.items() ):
+            byowner[owner].append( relpath )
+        for owner,relpaths in byowner.items():
+            print(">> Conflict: %d files of %s are already deployed by %s: %s%s" %
+                  (len(relpaths), pkgname, owner, " ".join( relpaths[:5] ),
+                   " ..." if len(relpaths)>5 else ""))
+
+    def identical( self, src, dst ):
+        # True if both files have the same contents
+        try:
+            if os.path.samefile( src, dst ):
+                return True
+            if os.path.islink( src ):
+                # relative links in the install tree are replicated as is
+                return os.path.islink( dst ) and os.readlink( src )==os.readlink( dst )
+            if os.path.getsize( src )!=os.path.getsize( dst ):
+                return False
+            return filecmp.cmp( src, dst, shallow=False )
+        except OSError:
+            return False
+
+    def uptodate( self, src, dst, mode ):
+        # True if dst is already what place() would make of src, so
+        # switching between stacks only touches the files that differ
+        try:
+            if os.path.islink( src ):
+                return os.path.islink( dst ) and os.readlink( dst )==os.readlink( src )
+            if mode=='symlink':
+                return os.path.islink( dst ) and os.readlink( dst )==src
+            sst = os.stat( src )
+            dst = os.lstat( dst )
+        except OSError:
+            return False
+        if stat.S_ISLNK( dst.st_mode ):
+            return False
+        if mode=='hardlink' and (sst.st_dev,sst.st_ino)==(dst.st_dev,dst.st_ino):
+            return True
+        # copies keep the mtime of the original
+        return (sst.st_size,sst.st_mtime_ns)==(dst.st_size,dst.st_mtime_ns)
+
+    def place( self, src, dst, mode ):
+        # Puts one file in deploydir, replacing whatever was there
+        dname = os.path.dirname( dst )
+        if not os.path.isdir( dname ):
+            if os.path.lexists( dname ):
+                os.unlink( dname )
+            os.makedirs( dname )
+        if os.path.lexists( dst ):
+            if os.path.isdir( dst ) and not os.path.islink( dst ):
+                shutil.rmtree( dst )
+            else:
+                os.unlink( dst )
+        if os.path.islink( src ):
+            # symlinks in the install tree are usually relative, as in
+            # libfoo.so -> libfoo.so.1, so we just replicate them
+            os.symlink( os.readlink( src ), dst )
+        elif mode=='symlink':
+            os.symlink( src, dst )
+        elif mode=='hardlink':
+            try:
+                os.link( src, dst )
+            except OSError:
+                # different filesystems
+                shutil.copy2( src, dst )
+        else:
+            shutil.copy2( src, dst )
+
+class Prefetcher():
+    # Downloads sources in the background with a bounded pool of threads
+    # while the builds go on. Builders then only wait for their own source
+    # - see Builder.download(). Downloads are known by url and checksum, as
+    # a builder may want the file somewhere else, e.g. in tmpdir
+    def __init__( self, sources, numthreads=4 ):
+        self.sources = sources
+        self.executor = concurrent.futures.ThreadPoolExecutor( max_workers=numthreads )
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def submit( self, url, pkgfile, sha256=None ):
+        with self.lock:
+            if (url,sha256) not in self.futures:
+                self.futures[(url,sha256)] = self.executor.submit(
+                    self.sources.fetch, url, pkgfile, sha256 )
+
+    def wait( self, url, sha256=None ):
+        # Waits for this download. Returns True/False or None if it was
+        # never submitted
+        with self.lock:
+            fut = self.futures.get( (url,sha256) )
+        if fut is None:
+            return None
+        try:
+            return fut.result()
+        except Exception as e:
+            print("Exception while fetching",url,":",e)
+            return False
+
+    def waitAll( self ):
+        # Waits for everything. Returns True if all downloads went fine
+        with self.lock:
+            keys = list( self.futures )
+        return all( [ self.wait( url, sha256 ) for url,sha256 in keys ] )
+
+class CompilerCache():
+    # Cache of compiled objects shared by all builds, see compcache.py.
+    # The build commands get a directory with links named after the
+    # compilers to compcache.py in front of their PATH. The cache is kept
+    # under maxsize bytes by evicting the objects that were least recently
+    # used, as hits touch their object
+    NAMES = ('cc','gcc','c++','g++','clang','clang++')
+    WRAPPER = os.path.join( os.path.dirname( os.path.realpath(__file__) ), 'compcache.py' )
+
+    def __init__( self, cachedir, maxsize ):
+        self.cachedir = cachedir
+        self.maxsize = maxsize
+        self.bindir = os.path.join( cachedir, 'bin' )
+        self.objdir = os.path.join( cachedir, 'objects' )
+        self.lock = threading.Lock()
+        os.makedirs( self.bindir, exist_ok=True )
+
+    def setup( self, path ):
+        # Links the compilers found in this PATH to the wrapper
+        with self.lock:
+            for name in self.NAMES:
+                link = os.path.join( self.bindir, name )
+                found = shutil.which( name, path=path )
+                if found is None or os.path.dirname( found )==self.bindir:
+                    if os.path.lexists( link ):
+                        os.unlink( link )
+                    continue
+                if os.path.islink( link ) and os.readlink( link )==self.WRAPPER:
+                    continue
+                if os.path.lexists( link ):
+                    os.unlink( link )
+                os.symlink( self.WRAPPER, link )
+
+    def environment( self, env, statsfile ):
+        # Returns a copy of this build environment that goes through the cache
+        env = dict( env )
+        self.setup( env.get('PATH','') )
+        env['PATH'] = ":".join( [ self.bindir, env.get('PATH','') ] )
+        env['COMPCACHE_DIR'] = self.cachedir
+        env['COMPCACHE_BIN'] = self.bindir
+        env['COMPCACHE_STATS'] = statsfile
+        return env
+
+    def stats( self, statsfile ):
+        # Returns the number of hits, misses and skips of one build
+        counts = collections.Counter()
+        try:
+            with open( statsfile ) as f:
+                counts.update( line.strip() for line in f )
+        except OSError:
+            pass
+        return counts
+
+    def trim( self ):
+        # Evicts the least recently used objects until the cache is under
+        # 90% of its maximum size
+        with self.lock:
+            entries = {}
+            total = 0
+            for dirpath,dirnames,filenames in os.walk( self.objdir ):
+                for fname in filenames:
+                    path = os.path.join( dirpath, fname )
+                    try:
+                        st = os.stat( path )
+                    except OSError:
+                        continue
+                    total += st.st_size
+                    digest,ext = os.path.splitext( path )
+                    entry = entries.setdefault( digest, [0,0] )
+                    entry[0] += st.st_size
+                    if ext=='.o':
+                        entry[1] = st.st_mtime
+            if total<=self.maxsize:
+                return 0
+            removed = 0
+            for digest,(size,mtime) in sorted( entries.items(), key=lambda x: x[1][1] ):
+                if total<=0.9*self.maxsize:
+                    break
+                # the object goes first, so nobody takes it as complete
+                for ext in ('.o','.d','.stderr'):
+                    if os.path.exists( digest + ext ):
+                        os.unlink( digest + ext )
+                total -= size
+                removed += 1
+            print(">> Compiler cache: evicted %d objects" % removed)
+            return removed
+
+class ArtifactCache():
+    # Cache of built packages. After a successful install(), the install
+    # prefix {installdir}/{dirname} is packed into a compressed archive
+    #     <cachedir>/<pkgname>-<version>-<key>.tar.gz
+    # where the key is a hash of the resolved package config, the platform
+    # and the keys of its dependencies, so it changes whenever any of these
+    # change. The directory can be local or shared (think NFS) by several
+    # locations and machines. A package whose key is found is extracted
+    # instead of being built again
+    def __init__( self, cachedir ):
+        # the directory is only created when something is stored, so
+        # looking things up, as --plan does, leaves no trace
+        self.cachedir = cachedir
+
+    def archive( self, pkgname, version, key ):
+        return os.path.join( self.cachedir, '%s-%s-%s.tar.gz' % (pkgname,version,key) )
+
+    def lookup( self, pkgname, version, key ):
+        # Returns the archive for this key or None
+        fname = self.archive( pkgname, version, key )
+        return fname if os.path.isfile( fname ) else None
+
+    def store( self, pkgname, version, key, installdir, dirname ):
+        # Packs {installdir}/{dirname} into the cache
+        fname = self.archive( pkgname, version, key )
+        srcdir = os.path.join( installdir, dirname )
+        if not os.path.isdir( srcdir ):
+            print("Install directory",srcdir,"does not exist, not caching it")
+            return False
+        tmpname = self.tmpname( fname )
+        try:
+            with tarfile.open( tmpname, 'w:gz' ) as tar:
+                tar.add( srcdir, arcname=dirname )
+            self.insert( pkgname, version, key, dirname, tmpname )
+        except Exception as e:
+            print("Exception caching",pkgname,version,":",e)
+            if os.path.exists( tmpname ):
+                os.unlink( tmpname )
+            return False
+        print(">> Cached", pkgname, version, "into", fname)
+        return True
+
+    def tmpname( self, fname ):
+        # Where an archive is written before it is moved into place
+        os.makedirs( self.cachedir, exist_ok=True )
+        return '%s.%s.%d.%d.tmp' % (fname,socket.gethostname(),os.getpid(),threading.get_ident())
+
+    def insert( self, pkgname, version, key, dirname, tmpname, host=None ):
+        # Moves an archive packed elsewhere, e.g. by store() or by a build
+        # farm worker, into the cache
+        fname = self.archive( pkgname, version, key )
+        os.replace( tmpname, fname )
+        with open( fname[:-len('.tar.gz')] + '.json', 'w' ) as f:
+            f.write( json.dumps( { 'name':pkgname, 'version':version,
+                                   'key':key, 'dirname':dirname,
+                                   'host':host or socket.gethostname(),
+                                   'created':nowstr() }, indent=1 ) )
+        return fname
+
+    def restore( self, pkgname, version, key, installdir, dirname ):
+        # Extracts the cached archive into {installdir}/{dirname}
+        fname = self.lookup( pkgname, version, key )
+        if fname is None:
+            return False
+        destdir = os.path.join( installdir, dirname )
+        tmpdir = tempfile.mkdtemp( prefix='.restore-', dir=installdir )
+        try:
+            with tarfile.open( fname, 'r:gz' ) as tar:
+                for member in tar.getmembers():
+                    if member.name!=dirname and not member.name.startswith( dirname+'/' ):
+                        raise Exception( "Unexpected member %s in %s" % (member.name,fname) )
+                if hasattr( tarfile, 'tar_filter' ):
+                    tar.extractall( tmpdir, filter='tar' )
+                else:
+                    tar.extractall( tmpdir )
+            if os.path.exists( destdir ):
+                shutil.rmtree( destdir )
+            os.replace( os.path.join( tmpdir, dirname ), destdir )
+        except Exception as e:
+            print("Exception restoring",pkgname,version,"from",fname,":",e)
+            return False
+        finally:
+            shutil.rmtree( tmpdir, ignore_errors=True )
+        print(">> Restored", pkgname, version, "from", fname)
+        return True
+
+class Tracer():
+    # Records every step of the run (checkout, extract, configure, make,
+    # install, deploy, resolve, ...) with its wall time, the cpu time (user
+    # and sys), peak rss and bytes read and written by the commands it ran
+    # and by our own thread while in it. Spans nest, so the usage of a make
+    # is also accounted in the build of its package. The records can be
+    # streamed as JSON lines and saved as a Chrome/Perfetto trace, with
+    # one row per package
+    def __init__( self ):
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.jsonl = None
+        self.tracefile = None
+        self.t0 = time.time()
+
+    def open( self, prefix ):
+        # Writes <prefix>.jsonl as we go and <prefix>.trace.json in save()
+        self.jsonl = open( prefix + '.jsonl', 'a' )
+        self.tracefile = prefix + '.trace.json'
+
+    def stack( self ):
+        if not hasattr( self.local, 'stack' ):
+            self.local.stack = []
+        return self.local.stack
+
+    def threadUsage( self ):
+        if hasattr( resource, 'RUSAGE_THREAD' ):
+            return resource.getrusage( resource.RUSAGE_THREAD )
+        return None
+
+    @contextlib.contextmanager
+    def span( self, name, pkgname=None, version=None ):
+        ev = { 'name':name, 'package':pkgname, 'version':version,
+               'start':time.time(), 'utime':0.0, 'stime':0.0, 'maxrss':0,
+               'read':0, 'written':0, 'status':'ok' }
+        stack = self.stack()
+        before = self.threadUsage()
+        stack.append( ev )
+        try:
+            yield ev
+        except:
+            ev['status'] = 'error'
+            raise
+        finally:
+            stack.pop()
+            after = self.threadUsage()
+            if before is not None and after is not None:
+                ev['utime'] += after.ru_utime - before.ru_utime
+                ev['stime'] += after.ru_stime - before.ru_stime
+                ev['read'] += 512*(after.ru_inblock - before.ru_inblock)
+                ev['written'] += 512*(after.ru_oublock - before.ru_oublock)
+            ev['end'] = time.time()
+            ev['wall'] = ev['end'] - ev['start']
+            self.record( ev )
+
+    def addUsage( self, ru ):
+        # Accounts the rusage of a child process in all open spans
+        for ev in self.stack():
+            ev['utime'] += ru.ru_utime
+            ev['stime'] += ru.ru_stime
+            # ru_maxrss is in kilobytes on Linux
+            ev['maxrss'] = max( ev['maxrss'], ru.ru_maxrss*1024 )
+            ev['read'] += 512*ru.ru_inblock
+            ev['written'] += 512*ru.ru_oublock
+
+    def record( self, ev ):
+        with self.lock:
+            self.events.append( ev )
+            if self.jsonl is not None:
+                self.jsonl.write( json.dumps( ev ) + "\n" )
+                self.jsonl.flush()
+
+    def save( self ):
+        # Writes the Chrome trace, if asked for
+        if self.tracefile is None:
+            return
+        lanes = {}
+        trace = []
+        with self.lock:
+            events = list( self.events ) + list( IMPORTS )
+        for ev in sorted( events, key=lambda e: e['start'] ):
+            lane = "%s %s" % (ev['package'],ev['version']) if ev['package'] else 'main'
+            if lane not in lanes:
+                lanes[lane] = len(lanes)
+                trace.append( { 'name':'thread_name', 'ph':'M', 'pid':1,
+                                'tid':lanes[lane], 'args':{'name':lane} } )
+            args = { k:ev[k] for k in ('utime','stime','maxrss','read','written','status','module')
+                     if k in ev }
+            trace.append( { 'name':ev['name'], 'cat':ev['package'] or 'main',
+                            'ph':'X', 'pid':1, 'tid':lanes[lane],
+                            'ts':int( (ev['start']-self.t0)*1e6 ),
+                            'dur':int( ev['wall']*1e6 ), 'args':args } )
+        with open( self.tracefile, 'w' ) as f:
+            f.write( json.dumps( { 'traceEvents':trace } ) )
+        print("Trace written to", self.tracefile)
+
+    def importSummary( self ):
+        # The modules imported on demand and how long each took
+        return "Imports: " + ", ".join( "%s %.0fms" % (ev['module'],1000*ev['wall'])
+                                        for ev in IMPORTS )
+
+    def summary( self, steps ):
+        # Returns a table with the time spent per package in each step
+        with self.lock:
+            events = list( self.events )
+        rows = collections.OrderedDict()
+        for ev in events:
+            if not ev['package']:
+                continue
+            row = rows.setdefault( (ev['package'],ev['version']), {} )
+            if ev['name']=='build':
+                row['build'] = ev
+            else:
+                row[ev['name']] = row.get(ev['name'],0.0) + ev['wall']
+        cols = [ step for step in steps if any( step in row for row in rows.values() ) ]
+        header = "%-20s %-10s" % ('package','version') + \
+                 "".join( " %9s" % c for c in cols ) + \
+                 " %9s %9s %9s %9s %9s" % ('total','user','sys','maxrss','io MB')
+        lines = [ header, '-'*len(header) ]
+        for (pkgname,version),row in rows.items():
+            line = "%-20s %-10s" % (pkgname,version)
+            line += "".join( " %9.1f" % row[c] if c in row else " %9s" % '-' for c in cols )
+            b = row.get('build')
+            if b:
+                line += " %9.1f %9.1f %9.1f %8.0fM %9.1f" % ( b['wall'], b['utime'], b['stime'],
+                            b['maxrss']/2**20, (b['read']+b['written'])/2**20 )
+            lines.append( line )
+        return "\n".join( lines )
+
+class BuildHistory():
+    # Every build of every package, whether it went well or not or only ran
+    # some of its steps ('partial'), with how long each of its steps took, its peak memory and how big its build
+    # tree got. Kept in a SQLite database in the cache directory, shared
+    # by all locations and hosts that share the cache. It is what tells
+    # where to build a package, in which order and when a run will end,
+    # and what shows that a new version takes twice as long to build
+    SCHEMA = [ """CREATE TABLE IF NOT EXISTS builds (
+                     id INTEGER PRIMARY KEY, name TEXT, version TEXT, confighash TEXT,
+                     status TEXT, wall REAL, maxrss INTEGER, size INTEGER,
+                     host TEXT, started REAL, revision TEXT )""",
+               """CREATE TABLE IF NOT EXISTS steps (
+                     build INTEGER, step TEXT, wall REAL, maxrss INTEGER )""",
+               """CREATE INDEX IF NOT EXISTS builds_name ON builds( name, version )""" ]
+    # how much slower or bigger a version can get before it is reported
+    TOLERANCE = 0.25
+
+    def __init__( self, fname ):
+        self.fname = fname
+        self.lock = threading.Lock()
+        os.makedirs( os.path.dirname( fname ), exist_ok=True )
+        self.db = sqlite3.connect( fname, timeout=60, check_same_thread=False )
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            for sql in self.SCHEMA:
+                self.db.execute( sql )
+            # databases of previous releases do not have the revisions
+            columns = [ row['name'] for row in self.db.execute( "PRAGMA table_info(builds)" ) ]
+            if 'revision' not in columns:
+                self.db.execute( "ALTER TABLE builds ADD COLUMN revision TEXT" )
+        self.importStats( os.path.join( os.path.dirname( fname ), 'buildstats.json' ) )
+
+    def importStats( self, fname ):
+        # Takes over the JSON file of previous releases, once
+        if not os.path.isfile( fname ):
+            return
+        try:
+            with open( fname ) as f:
+                stats = json.loads( f.read() )
+            with self.db:
+                for entry in stats.values():
+                    self.db.execute( "INSERT INTO builds (name,version,status,wall,size,host,started) "
+                                     "VALUES (?,?,'ok',?,?,?,?)",
+                                     ( entry['name'], entry['version'], entry.get('wall'),
+                                       entry.get('size'), socket.gethostname(),
+                                       os.path.getmtime( fname ) ) )
+            os.rename( fname, fname + '.imported' )
+        except Exception as e:
+            print("Exception importing build stats",fname,":",e)
+
+    def get( self, pkgname, version ):
+        # The last good build of this version or, if it was never built,
+        # of the latest version of the package that was
+        with self.lock:
+            rows = self.db.execute( "SELECT * FROM builds WHERE name=? AND status='ok' "
+                                    "ORDER BY started", (pkgname,) ).fetchall()
+        rows = [ row for row in rows if row['version']==version ] or rows
+        if not rows:
+            return None
+        latest = max( Version( row['version'] ) for row in rows )
+        row = [ row for row in rows if Version( row['version'] )==latest ][-1]
+        return { name:row[name] for name in ('wall','maxrss','size') if row[name] is not None }
+
+    def record( self, pkgname, version, status, steps=(), **values ):
+        # Stores one build. Steps are (step,wall,maxrss)
+        values.update( name=pkgname, version=version, status=status,
+                       host=socket.gethostname() )
+        values.setdefault( 'started', time.time() )
+        columns = sorted( values )
+        row = [ values[name] for name in columns ]
+        with self.lock, self.db:
+            cursor = self.db.execute( "INSERT INTO builds (%s) VALUES (%s)" %
+                                      ( ",".join( columns ), ",".join( '?'*len(row) ) ), row )
+            self.db.executemany( "INSERT INTO steps (build,step,wall,maxrss) VALUES (?,?,?,?)",
+                                 [ (cursor.lastrowid,)+tuple(step) for step in steps ] )
+
+    def versions( self, pkgname, status=None ):
+        # The last build of every version of this package, oldest version
+        # first, with the duration of its steps. Only builds with this
+        # status if given
+        with self.lock:
+            rows = self.db.execute( "SELECT * FROM builds WHERE name=? AND status=coalesce(?,status) "
+                                    "ORDER BY started", (pkgname,status) ).fetchall()
+            last = {}
+            for row in rows:
+                last[row['version']] = dict( row )
+            for entry in last.values():
+                entry['steps'] = { step['step']:step['wall'] for step in self.db.execute(
+                    "SELECT step,wall FROM steps WHERE build=?", (entry['id'],) ) }
+        return [ last[version] for version in sorted( last, key=Version ) ]
+
+    def packages( self ):
+        with self.lock:
+            return [ row[0] for row in self.db.execute( "SELECT DISTINCT name FROM builds ORDER BY name" ) ]
+
+    def regressions( self, pkgname ):
+        # Compares every version that built against the previous one that
+        # did. Returns (version,previous,what,before,after) for everything
+        # that got worse by more than TOLERANCE
+        found = []
+        previous = None
+        for entry in self.versions( pkgname, 'ok' ):
+            if previous is not None:
+                pairs = [ ('wall',previous['wall'],entry['wall']),
+                          ('maxrss',previous['maxrss'],entry['maxrss']) ]
+                pairs += [ ('step '+step,previous['steps'][step],wall)
+                           for step,wall in sorted( entry['steps'].items() )
+                           if previous['steps'].get( step ) ]
+                for what,before,after in pairs:
+                    if before and after and after > before*(1.0+self.TOLERANCE):
+                        found.append( (entry['version'],previous['version'],what,before,after) )
+            previous = entry
+        return found
+
+    def report( self, pkgnames=None ):
+        # A table of the last build of every version of these packages with
+        # the regressions between consecutive versions marked
+        lines = [ "%-20s %-12s %-8s %10s %10s %-16s %s" %
+                  ('package','version','status','duration','peak MB','host','built') ]
+        flagged = []
+        for pkgname in ( pkgnames or self.packages() ):
+            regressed = collections.defaultdict( list )
+            for version,previous,what,before,after in self.regressions( pkgname ):
+                regressed[version].append( "%s %.1fx vs %s" % (what,after/before,previous) )
+            for entry in self.versions( pkgname ):
+                lines.append( "%-20s %-12s %-8s %9.1fs %10.0f %-16s %s%s" %
+                              ( pkgname, entry['version'], entry['status'], entry['wall'] or 0,
+                                (entry['maxrss'] or 0)/2**20, entry['host'],
+                                datetime.fromtimestamp( entry['started'] ).strftime( "%Y/%m/%d %H:%M" ),
+                                "  REGRESSION: " + ", ".join( regressed[entry['version']] )
+                                if regressed[entry['version']] else '' ) )
+                if regressed[entry['version']]:
+                    flagged.append( (pkgname,entry['version']) )
+        return "\n".join( lines ),flagged
+
+class GarbageCollector():
+    # Keeps the disk used by builddir and installdir in check. What can go,
+    # in this order:
+    #  - the build trees and tarballs of packages that are installed, as
+    #    they can be extracted again from the source cache
+    #  - the install prefixes (and their sentinels) of packages that are
+    #    neither selected by any tag nor deployed in deploydir or a farm
+    #    nor part of the run that is collecting, least recently built first
+    # With a budget, things are removed only until the usage fits in it,
+    # otherwise all of them go. Logs not written in a day are compressed.
+    # The source cache is shared by all locations and is left alone
+    ARCHIVES = ('.tar.gz','.tgz','.tar.xz','.tar.bz2','.tar.zst','.tzst','.tar','.zip')
+    LOGAGE = 24*3600
+
+    def __init__( self, buildmgr, keep=() ):
+        self.buildmgr = buildmgr
+        self.keep = set( keep )
+        self.builddir = buildmgr.resolve( buildmgr.builddir )
+        self.installdir = buildmgr.resolve( buildmgr.installdir )
+
+    @staticmethod
+    def diskUsage( path ):
+        # Bytes used on disk by this file or tree, hardlinks counted once
+        total = 0
+        seen = set()
+        if os.path.isfile( path ) or os.path.islink( path ):
+            return os.lstat( path ).st_blocks*512
+        for dirpath,dirnames,filenames in os.walk( path ):
+            for fname in dirnames + filenames:
+                try:
+                    st = os.lstat( os.path.join( dirpath, fname ) )
+                except OSError:
+                    continue
+                if (st.st_dev,st.st_ino) in seen:
+                    continue
+                seen.add( (st.st_dev,st.st_ino) )
+                total += st.st_blocks*512
+        return total
+
+    def usage( self ):
+        return sum( self.diskUsage( d ) for d in (self.builddir,self.installdir)
+                    if os.path.isdir( d ) )
+
+    def deployed( self ):
+        # (name,version) of everything deployed in deploydir and the farms.
+        # The manifests are read directly, DeployManifest would wipe a
+        # deploydir that has none
+        mgr = self.buildmgr
+        dirs = [ mgr.resolve( mgr.deploydir ) ]
+        farmdir = mgr.resolve( mgr.farmdir )
+        if os.path.isdir( farmdir ):
+            dirs += [ os.path.join( farmdir, d ) for d in os.listdir( farmdir ) ]
+        nodes = set()
+        for dname in dirs:
+            fname = os.path.join( dname, '.bleedingedge-manifest.json' )
+            if not os.path.isfile( fname ):
+                continue
+            with open( fname ) as f:
+                packages = json.loads( f.read() ).get('packages',{})
+            nodes.update( (name,entry['version']) for name,entry in packages.items() )
+        return nodes
+
+    def tagMaps( self ):
+        # All the tags we know of: the ones in tags/ and the ones in use
+        mgr = self.buildmgr
+        tagmaps = list( mgr.tags.values() )
+        tagdir = os.path.join( mgr.thisdir, 'tags' )
+        for fname in sorted( os.listdir( tagdir ) ):
+            if fname.endswith( '.yaml' ):
+                tagmap = mgr.index.load( os.path.join( tagdir, fname ) )
+                if isinstance( tagmap, types.MappingProxyType ):
+                    tagmaps.append( tagmap )
+        return tagmaps
+
+    def packages( self ):
+        # (name,version) => dirname of every version in the configs, and
+        # the set of them that is selected by some tag, deployed or kept
+        mgr = self.buildmgr
+        tagmaps = self.tagMaps()
+        dirnames = {}
+        referenced = self.deployed() | self.keep
+        for pkgname in mgr.getAllPackages():
+            patterns = []
+            for tagmap in tagmaps:
+                verlist = tagmap.get( pkgname )
+                if verlist is not None:
+                    if isinstance( verlist, (str,int,float) ):
+                        verlist = (verlist,)
+                    patterns += [ str(v) for v in verlist ]
+            for item in mgr.allConfigs( pkgname ):
+                version = str( item['version'] )
+                pkg = dict( item, name=pkgname, version=version )
+                try:
+                    dirname = mgr.resolve( pkg.get('dirname') or '{name}-{version}', pkg )
+                except Exception:
+                    dirname = '%s-%s' % (pkgname,version)
+                dirnames[(pkgname,version)] = dirname
+                if any( fnmatch.fnmatch( version, pat ) for pat in patterns ):
+                    referenced.add( (pkgname,version) )
+        return dirnames,referenced
+
+    def candidates( self ):
+        # Returns what can be removed, in the order it should go, as a list
+        # of (description,[paths])
+        dirnames,referenced = self.packages()
+        trees = []
+        installs = []
+        for node,dirname in dirnames.items():
+            sentinel = os.path.join( self.installdir, '%s-%s.done' % node )
+            built = os.path.isfile( sentinel )
+            if built:
+                # the checkpoints go with the tree, they refer to it
+                paths = [ os.path.join( self.builddir, dirname ),
+                          os.path.join( self.builddir, dirname + '.steps' ) ]
+                paths += [ os.path.join( self.builddir, '%s-%s%s' % (node[0],node[1],ext) )
+                           for ext in self.ARCHIVES ]
+                paths = [ p for p in paths if os.path.lexists( p ) ]
+                if paths:
+                    trees.append( ( "build files of %s %s" % node, paths ) )
+            prefix = os.path.join( self.installdir, dirname )
+            if node not in referenced and os.path.isdir( prefix ):
+                mtime = os.path.getmtime( sentinel ) if built else os.path.getmtime( prefix )
+                installs.append( ( mtime, "install of %s %s" % node, [sentinel,prefix] ) )
+        installs.sort()
+        return trees + [ (desc,paths) for mtime,desc,paths in installs ]
+
+    def compressLogs( self, dryrun=False ):
+        # Gzips the logs that were not written to in a day
+        if not os.path.isdir( self.builddir ):
+            return 0
+        count = 0
+        now = time.time()
+        for fname in os.listdir( self.builddir ):
+            path = os.path.join( self.builddir, fname )
+            if not re.search( r'\.(log|err)(\.\d+)?$', fname ) or not os.path.isfile( path ):
+                continue
+            if now - os.path.getmtime( path ) < self.LOGAGE:
+                continue
+            count += 1
+            if dryrun:
+                print("Would compress", path)
+                continue
+            with open( path, 'rb' ) as fin, gzip.open( path + '.gz', 'ab' ) as fout:
+                shutil.copyfileobj( fin, fout )
+            os.unlink( path )
+        return count
+
+    def remove( self, path ):
+        if os.path.isdir( path ) and not os.path.islink( path ):
+            shutil.rmtree( path )
+        elif os.path.lexists( path ):
+            os.unlink( path )
+
+    def collect( self, budget=None, dryrun=False ):
+        # Frees space until the usage fits in the budget, or everything
+        # that can go if there is no budget. Returns the bytes freed
+        mgr = self.buildmgr
+        self.compressLogs( dryrun )
+        used = self.usage()
+        if budget is not None and used<=budget:
+            return 0
+        freed = 0
+        for desc,paths in self.candidates():
+            if budget is not None and used-freed<=budget:
+                break
+            size = sum( self.diskUsage( p ) for p in paths if os.path.lexists( p ) )
+            if dryrun:
+                print("Would remove %s (%.1f MB)" % (desc,size/2**20))
+            else:
+                print(">> Removing %s (%.1f MB)" % (desc,size/2**20))
+                for path in paths:
+                    self.remove( path )
+            freed += size
+        if budget is not None and used-freed>budget:
+            print("Warning: %.1f MB used, over the budget of %.1f MB, with nothing else to remove" %
+                  ((used-freed)/2**20, budget/2**20))
+        return freed
+
+class InstallDedup():
+    # Shares the contents of identical files between the install prefixes,
+    # as versions of the same package install mostly the same headers,
+    # docs and locale data. Files are hashed in parallel and every file
+    # whose contents are already somewhere else in installdir becomes a
+    # reflink of it, if the filesystem can do that, or a hardlink. The
+    # hashes are kept in a SQLite index in the cache directory by inode,
+    # size and mtime, so a file is hashed once and scanning a prefix again
+    # costs a stat per file. Modes are
+    #    reflink   copy-on-write clones only (btrfs, xfs)
+    #    hardlink  hardlinks only, for files with the same owner and mode
+    #    auto      reflinks where possible, hardlinks elsewhere
+    # Hardlinked files must not be written to in place, so a prefix that
+    # is built again is unshared first
+    SCHEMA = [ """CREATE TABLE IF NOT EXISTS files (
+                     dev INTEGER, ino INTEGER, size INTEGER, mtime INTEGER,
+                     digest TEXT, path TEXT, clone INTEGER,
+                     PRIMARY KEY (dev,ino) )""",
+               """CREATE INDEX IF NOT EXISTS files_digest ON files( digest, size )""" ]
+    # smaller files are left alone, they would save next to nothing
+    MINSIZE = 1024
+    # ioctl to clone a whole file, from linux/fs.h
+    FICLONE = 0x40049409
+
+    def __init__( self, fname, mode='auto', numjobs=None ):
+        self.mode = mode
+        self.numjobs = numjobs or os.cpu_count()
+        self.lock = threading.Lock()
+        # device => False once reflinks failed on it
+        self.reflinks = {}
+        os.makedirs( os.path.dirname( fname ), exist_ok=True )
+        self.db = sqlite3.connect( fname, timeout=60, check_same_thread=False )
+        with self.db:
+            for sql in self.SCHEMA:
+                self.db.execute( sql )
+
+    def scan( self, root ):
+        # (path,stat) of every regular file under root worth sharing
+        for dirpath,dirnames,filenames in os.walk( root ):
+            for fname in filenames:
+                path = os.path.join( dirpath, fname )
+                try:
+                    st = os.lstat( path )
+                except OSError:
+                    continue
+                if stat.S_ISREG( st.st_mode ) and st.st_size>=self.MINSIZE:
+                    yield path,st
+
+    @staticmethod
+    def hashFile( path ):
+        try:
+            return SourceCache.hashFile( path )
+        except OSError:
+            return None
+
+    def digests( self, files, dryrun=False ):
+        # (path,stat,digest,clone) of these files. The digest comes from the
+        # index if the inode did not change since, otherwise the file is
+        # hashed, several at a time, and indexed unless this is a dry run
+        entries = []
+        tohash = []
+        with self.lock:
+            for path,st in files:
+                row = self.db.execute( "SELECT size,mtime,digest,clone FROM files "
+                                       "WHERE dev=? AND ino=?", (st.st_dev,st.st_ino) ).fetchone()
+                if row and row[0]==st.st_size and row[1]==st.st_mtime_ns:
+                    entries.append( (path,st,row[2],row[3]) )
+                else:
+                    tohash.append( (path,st) )
+        with concurrent.futures.ThreadPoolExecutor( self.numjobs ) as pool:
+            hashed = list( pool.map( self.hashFile, [ path for path,st in tohash ] ) )
+        with self.lock, self.db:
+            for (path,st),digest in zip( tohash, hashed ):
+                if digest is None:
+                    continue
+                if not dryrun:
+                    self.db.execute( "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,NULL)",
+                                     (st.st_dev,st.st_ino,st.st_size,st.st_mtime_ns,digest,path) )
+                entries.append( (path,st,digest,None) )
+        return entries
+
+    def canonical( self, st, digest, prune=True ):
+        # (path,stat) of the first indexed file with this content on the
+        # same filesystem that is still there as it was, or None. Stale
+        # rows found on the way are dropped if prune
+        rows = self.db.execute( "SELECT ino,mtime,path FROM files WHERE digest=? AND size=? "
+                                "AND dev=? ORDER BY rowid",
+                                (digest,st.st_size,st.st_dev) ).fetchall()
+        for ino,mtime,path in rows:
+            try:
+                cst = os.lstat( path )
+                if cst.st_ino==ino and cst.st_mtime_ns==mtime and cst.st_size==st.st_size:
+                    return path,cst
+            except OSError:
+                pass
+            # removed or changed since, the next scan indexes it again
+            if prune:
+                self.db.execute( "DELETE FROM files WHERE dev=? AND ino=?", (st.st_dev,ino) )
+        return None
+
+    def reflink( self, src, sst, dest ):
+        # Clones src into dest sharing its blocks. Returns True/False
+        if self.mode=='hardlink' or self.reflinks.get( sst.st_dev ) is False:
+            return False
+        tmpname = '%s.%d.dedup' % (dest,os.getpid())
+        try:
+            with open( src, 'rb' ) as fin, open( tmpname, 'wb' ) as fout:
+                fcntl.ioctl( fout.fileno(), self.FICLONE, fin.fileno() )
+            shutil.copystat( dest, tmpname )
+            os.replace( tmpname, dest )
+            return True
+        except OSError:
+            self.reflinks[sst.st_dev] = False
+            if os.path.exists( tmpname ):
+                os.unlink( tmpname )
+            return False
+
+    def hardlink( self, src, sst, dest, st ):
+        # Replaces dest by a link to src if nothing but the name and the
+        # mtime tells them apart. Returns True/False
+        if self.mode=='reflink' or (sst.st_mode,sst.st_uid,sst.st_gid)!=(st.st_mode,st.st_uid,st.st_gid):
+            return False
+        tmpname = '%s.%d.dedup' % (dest,os.getpid())
+        try:
+            os.link( src, tmpname )
+            os.replace( tmpname, dest )
+            return True
+        except OSError:
+            # too many links or some such
+            if os.path.lexists( tmpname ):
+                os.unlink( tmpname )
+            return False
+
+    def dedup( self, roots, dryrun=False ):
+        # Shares every file under these directories that has the same
+        # contents as one anywhere in installdir. Returns (files,bytes saved)
+        # A dry run leaves the index alone and counts what the real run would
+        # share and free, taking the files it hashed as if they were indexed
+        files = [ entry for root in roots if os.path.isdir( root )
+                  for entry in self.scan( root ) ]
+        entries = self.digests( files, dryrun )
+        count = saved = 0
+        # how many names each inode still has, it is freed with the last
+        links = {}
+        # (digest,size,dev) => (path,stat) of the files a dry run did not index
+        unindexed = {}
+        with self.lock, self.db:
+            for path,st,digest,clone in entries:
+                found = self.canonical( st, digest, prune=not dryrun )
+                if found is None and dryrun:
+                    found = unindexed.setdefault( (digest,st.st_size,st.st_dev), (path,st) )
+                if found is None:
+                    continue
+                src,sst = found
+                if sst.st_ino==st.st_ino or clone==sst.st_ino:
+                    continue
+                if dryrun:
+                    # a reflink can only be known by trying it
+                    if self.mode=='hardlink' and (sst.st_mode,sst.st_uid,sst.st_gid)!=(st.st_mode,st.st_uid,st.st_gid):
+                        continue
+                elif self.reflink( src, sst, path ):
+                    nst = os.lstat( path )
+                    self.db.execute( "DELETE FROM files WHERE dev=? AND ino=?", (st.st_dev,st.st_ino) )
+                    self.db.execute( "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?)",
+                                     (nst.st_dev,nst.st_ino,nst.st_size,nst.st_mtime_ns,
+                                      digest,path,sst.st_ino) )
+                elif self.hardlink( src, sst, path, st ):
+                    self.db.execute( "DELETE FROM files WHERE dev=? AND ino=?", (st.st_dev,st.st_ino) )
+                else:
+                    continue
+                count += 1
+                links[st.st_ino] = links.get( st.st_ino, st.st_nlink ) - 1
+                if links[st.st_ino]==0:
+                    saved += st.st_blocks*512
+        return count,saved
+
+    def unshare( self, root ):
+        # Gives every hardlinked file under root a copy of its own, before
+        # something writes into them
+        count = 0
+        for dirpath,dirnames,filenames in os.walk( root ):
+            for fname in filenames:
+                path = os.path.join( dirpath, fname )
+                st = os.lstat( path )
+                if not stat.S_ISREG( st.st_mode ) or st.st_nlink<2:
+                    continue
+                tmpname = '%s.%d.dedup' % (path,os.getpid())
+                shutil.copy2( path, tmpname )
+                os.replace( tmpname, path )
+                count += 1
+        return count
+
+class DependencySolver():
+    # Resolves the dependency graph of a set of packages once for all of
+    # them. Every package is looked up a single time, the closure of every
+    # node is kept as it is completed and the graph is checked for cycles
+    # and for different versions of the same package, as only one of them
+    # can be deployed. The nodes end up in topological order, dependencies
+    # first. The graph is walked without recursion so long chains are fine
+    def __init__( self, buildmgr, pinned=True ):
+        self.buildmgr = buildmgr
+        self.pinned = pinned
+        # (name,version) => tuple of (name,version) it depends on
+        self.nodes = {}
+        # (name,version) => frozenset of everything it depends on
+        self.closures = {}
+        # packages in topological order, dependencies first
+        self.order = []
+        # name => (name,version), the version of each package in the graph
+        self.pins = {}
+        # (name,version) => (name,version) that required it first
+        self.requiredby = {}
+
+    def add( self, pkgname, version=None ):
+        # Adds this package and its closure. Returns its node or None if
+        # something could not be resolved
+        pkg = self.buildmgr.getPackage( pkgname, version )
+        if pkg is None:
+            print("Could not find package",pkgname,version)
+            return None
+        root = (pkgname,pkg['version'])
+        if not self.pin( root, None ):
+            return None
+        if root in self.nodes:
+            return root
+        deps = self.direct( root )
+        if deps is None:
+            return None
+        stack = [ [root,deps,0] ]
+        onpath = set( [root] )
+        while stack:
+            top = stack[-1]
+            node,deps,pos = top
+            if pos==len(deps):
+                # all dependencies are done, so is this node
+                stack.pop()
+                onpath.discard( node )
+                self.nodes[node] = tuple( deps )
+                closure = set( deps )
+                for dep in deps:
+                    closure |= self.closures[dep]
+                self.closures[node] = frozenset( closure )
+                self.order.append( node )
+                continue
+            top[2] += 1
+            dep = deps[pos]
+            if dep in self.nodes:
+                continue
+            if dep in onpath:
+                cycle = [ item[0] for item in stack ]
+                cycle = cycle[ cycle.index(dep): ] + [dep]
+                print("**** ERROR: Dependency cycle:",
+                      " -> ".join( "%s-%s" % n for n in cycle ))
+                return None
+            depdeps = self.direct( dep )
+            if depdeps is None:
+                return None
+            onpath.add( dep )
+            stack.append( [dep,depdeps,0] )
+        return root
+
+    def direct( self, node ):
+        # The nodes this node depends on directly, or None
+        deps = self.buildmgr.getDirectDependencies( node[0], node[1] )
+        if deps is None:
+            print("Dependencies of",node[0],node[1],"could not be resolved")
+            return None
+        result = []
+        for dep in deps:
+            if dep[0]==node[0] or dep in result:
+                continue
+            if not self.pin( dep, node ):
+                return None
+            result.append( dep )
+        return result
+
+    def pin( self, node, parent ):
+        # Checks this is the only version of this package in the graph
+        if not self.pinned:
+            return True
+        def who( parent ):
+            return "%s-%s" % parent if parent else "the command line"
+        other = self.pins.get( node[0] )
+        if other is None:
+            self.pins[node[0]] = node
+            self.requiredby[node] = parent
+            self.buildmgr.versions[node[0]+'-version'] = node[1]
+        elif other!=node:
+            print("**** ERROR: Conflicting versions of",node[0],":",
+                  other[1],"required by",who( self.requiredby[other] ),"and",
+                  node[1],"required by",who( parent ))
+            return False
+        return True
+
+class BuildScheduler():
+    # Builds a set of packages and their dependencies as a DAG instead of
+    # recursing into one dependency at a time. Every package whose
+    # dependencies are satisfied is started right away on its own thread,
+    # so independent packages like gmp, libelf and binutils build at the
+    # same time. The global CPU budget (numjobs) is split across the
+    # packages that are running and, when one package fails, only the
+    # packages downstream of it are cancelled; everything else goes on.
+    def __init__( self, buildmgr, numjobs=None, maxparallel=None ):
+        self.buildmgr = buildmgr
+        self.numjobs = int( numjobs or buildmgr.numjobs )
+        self.maxparallel = int( maxparallel or self.numjobs )
+        self.solver = DependencySolver( buildmgr )
+        # (name,version) => tuple of (name,version) it depends on
+        self.nodes = self.solver.nodes
+        # (name,version) => artifact key
+        self.keys = {}
+        # nodes whose keys depend on repositories not fetched yet
+        self.unsettled = set()
+        # the packages that were asked for, as opposed to dependencies
+        self.roots = set()
+        # packages in the order they were added, dependencies first
+        self.order = self.solver.order
+        self.lock = threading.Condition()
+
+    def addPackage( self, pkgname, version=None ):
+        # Adds this package and its whole dependency closure to the graph
+        # Returns the node or None if something could not be resolved
+        return self.solver.add( pkgname, version )
+
+    def dependsOn( self, node, other ):
+        # True if node depends on other, directly or not
+        return other in self.solver.closures[node]
+
+    def nodeKey( self, node ):
+        # The artifact cache key of this node, see ArtifactCache
+        if node not in self.keys:
+            depkeys = [ self.nodeKey( dep ) for dep in self.nodes[node] ]
+            self.keys[node] = self.buildmgr.artifactKey( node[0], node[1], depkeys )
+        return self.keys[node]
+
+    def findUnsettled( self ):
+        # The nodes built from repositories and everything that depends on
+        # them. Their keys are a guess until the repositories are fetched
+        mgr = self.buildmgr
+        unsettled = set()
+        for node in self.order:
+            if any( dep in unsettled for dep in self.nodes[node] ) or \
+               mgr.getBuilder( *node ).repositories():
+                unsettled.add( node )
+        return unsettled
+
+    def settle( self, node ):
+        # Fetches the repositories of this node, right before it is built,
+        # and works its key out again with them and with the final keys of
+        # its dependencies. Returns True if that turns out to be built
+        # already, a trunk that did not move for instance
+        if node not in self.unsettled:
+            return False
+        mgr = self.buildmgr
+        mgr.getBuilder( *node ).revision()
+        self.keys.pop( node, None )
+        if (mgr.fromstep or mgr.forcestep) and node in self.roots:
+            return False
+        key = self.nodeKey( node ) if mgr.useartifacts else None
+        return mgr.checkIsBuilt( node[0], node[1], key )
+
+    def criticalPath( self ):
+        # The chain of dependencies that took the longest to build, from
+        # the 'build' spans of the tracer. Returns (seconds,[nodes])
+        walls = {}
+        for ev in self.buildmgr.tracer.events:
+            if ev['name']=='build':
+                walls[ (ev['package'],ev['version']) ] = ev['wall']
+        paths = {}
+        for node in self.order:
+            best = max( [ paths[dep] for dep in self.nodes[node] ] or [(0.0,[])] )
+            paths[node] = ( best[0] + walls.get(node,0.0), best[1] + [node] )
+        return max( paths.values() ) if paths else (0.0,[])
+
+    def dependents( self, node ):
+        # All nodes that depend on this one, directly or not
+        return [ other for other in self.order if self.dependsOn( other, node ) ]
+
+    def priorities( self ):
+        # How long, from the previous builds, the longest chain of builds
+        # that starts at every node takes
+        stats = self.buildmgr.getHistory()
+        dependents = collections.defaultdict( list )
+        for node,deps in self.nodes.items():
+            for dep in deps:
+                dependents[dep].append( node )
+        priority = {}
+        self.estimates = {}
+        for node in reversed( self.order ):
+            entry = stats.get( node[0], node[1] ) or {}
+            self.estimates[node] = entry.get( 'wall' ) or 0.0
+            after = [ priority[other] for other in dependents[node] ]
+            priority[node] = self.estimates[node] + max( after or [0.0] )
+        return priority
+
+    def progress( self, pending, priority ):
+        # One line with how many packages are done and when, according to
+        # the previous builds, the whole thing should end. That is at least
+        # the longest chain left and at least the work left spread over
+        # the packages that can run at once
+        now = time.time()
+        left = [ (self.estimates[node],priority[node]) for node in pending ]
+        left += [ ( max( 0.0, self.estimates[node] - (now - self.started[node]) ),
+                    max( 0.0, priority[node] - (now - self.started[node]) ) )
+                  for node in self.running ]
+        eta = max( [ sum( est for est,prio in left )/self.maxparallel ] +
+                   [ prio for est,prio in left ] )
+        total = len(self.done) + len(self.failed) + len(self.cancelled) + len(left)
+        unknown = sum( 1 for node in list(pending)+list(self.running) if not self.estimates[node] )
+        print(">> Progress: %d of %d packages done, %s elapsed, ETA %s%s" %
+              ( total-len(left), total, formatDuration( now - self.begin ), formatDuration( eta ),
+                " (%d never built before)" % unknown if unknown else '' ))
+
+    def addVariant( self, pkglist ):
+        # Adds a set of (pkgname,version) resolved on their own, so that
+        # variants can have different versions of the same package, like
+        # gcc 5 and gcc 7. Returns their nodes or None
+        solver = DependencySolver( self.buildmgr )
+        roots = []
+        for pkgname,version in pkglist:
+            node = solver.add( pkgname, version )
+            if node is None:
+                return None
+            roots.append( node )
+        for node in solver.order:
+            if node not in self.nodes:
+                self.nodes[node] = solver.nodes[node]
+                self.solver.closures[node] = solver.closures[node]
+                self.order.append( node )
+        self.roots.update( roots )
+        return roots
+
+    def deployedNodes( self ):
+        # packages that others depend on are deployed into deploydir. A farm
+        # gets the packages that were asked for too, it is the whole stack
+        deployed = set( dep for deps in self.nodes.values() for dep in deps )
+        if self.buildmgr.farm:
+            deployed.update( self.roots )
+        return deployed
+
+    def plan( self ):
+        # What run() is going to do with every node, dependencies first, as
+        # a list of (node,action): 'skip' if it is built already, 'restore'
+        # if it is in the artifact cache and 'build' otherwise. It only
+        # looks: nothing is written and nothing goes to the network, the
+        # repositories are taken as their mirrors last were - see settle()
+        mgr = self.buildmgr
+        keyed = mgr.useartifacts
+        # packages asked for with --from-step/--force-step are always rebuilt
+        override = mgr.fromstep or mgr.forcestep
+        cache = mgr.getArtifactCache()
+        actions = []
+        for node in self.order:
+            forced = override and node in self.roots
+            key = self.nodeKey( node ) if keyed else None
+            if not forced and mgr.checkIsBuilt( node[0], node[1], key ):
+                action = 'skip'
+            elif not forced and cache is not None and cache.lookup( node[0], node[1], key ):
+                action = 'restore'
+            else:
+                action = 'build'
+            actions.append( (node,action) )
+        return actions
+
+    def run( self ):
+        # Runs the whole graph. Returns True if every package was built
+        mgr = self.buildmgr
+        mgr.makeDirectories()
+        self.done = set()
+        self.failed = set()
+        self.cancelled = set()
+        self.running = {}
+        self.started = {}
+        self.finished = []
+        # jobs taken by the packages running, out of numjobs
+        self.allocated = 0
+        jobs = {}
+        self.begin = time.time()
+        actions = self.plan()
+        # these are checked again when their turn comes, see settle()
+        self.unsettled = self.findUnsettled()
+        pending = [ node for node,action in actions
+                    if action!='skip' or node in self.unsettled ]
+        for node in self.order:
+            if node not in pending:
+                print("Package",node[0],node[1],': nothing to do')
+
+        # packages that others depend on are deployed as soon as they are
+        # available. Whatever else is in deploydir is removed and what is
+        # already there is only updated. This is done even if everything
+        # is built, so switching deploydir to another stack only touches
+        # the files that differ
+        self.deployed = self.deployedNodes()
+        mgr.getManifest().prune( self.deployed )
+        if pending:
+            # download everything we are going to need while we build, except
+            # for what is going to be restored from the artifact cache
+            tobuild = [ node for node,action in actions if action=='build' ]
+            # the packages that can start right away fetch and extract their
+            # sources themselves, in one go
+            self.prefetch( [ node for node in tobuild
+                             if any( dep in pending for dep in self.nodes[node] ) ] )
+        for node in self.order:
+            if node not in pending:
+                self.done.add( node )
+                if not self.deploy( node ):
+                    self.fail( node, pending )
+
+        priority = self.priorities()
+        with self.lock:
+            while pending or self.running:
+                # what sits on the longest chain of builds goes first
+                ready = [ node for node in pending
+                          if all( dep in self.done for dep in self.nodes[node] ) ]
+                ready.sort( key=lambda node: -priority[node] )
+                while ready and len(self.running)<self.maxparallel:
+                    # split what the running packages did not take across
+                    # what is about to run. Packages already running keep
+                    # theirs until they finish
+                    nslots = min( self.maxparallel-len(self.running), len(ready) )
+                    numjobs = max( 1, (self.numjobs-self.allocated) // nslots )
+                    node = ready.pop(0)
+                    pending.remove( node )
+                    jobs[node] = numjobs
+                    self.allocated += numjobs
+                    print(">> Building",node[0],node[1],"with",numjobs,"jobs")
+                    th = threading.Thread( target=self.runNode,
+                                           args=(node,numjobs) )
+                    self.running[node] = th
+                    self.started[node] = time.time()
+                    th.start()
+                if not self.running:
+                    # nothing can run anymore
+                    break
+                while not self.finished:
+                    self.lock.wait()
+                for node,ok in self.finished:
+                    self.running.pop( node ).join()
+                    self.allocated -= jobs.pop( node )
+                    if ok:
+                        self.done.add( node )
+                    else:
+                        self.fail( node, pending )
+                self.finished = []
+                self.progress( pending, priority )
+
+        for node in self.cancelled:
+            print("Package",node[0],node[1],"was not built: dependency failed")
+        return not (self.failed or self.cancelled)
+
+    def prefetch( self, nodes ):
+        # Downloads the sources of these nodes in the background
+        self.buildmgr.prefetch( nodes )
+
+    def fail( self, node, pending ):
+        # Marks this node as failed and cancels everything downstream of it
+        print("Package",node[0],node[1],"failed")
+        self.failed.add( node )
+        for other in self.dependents( node ):
+            if other in pending:
+                pending.remove( other )
+                self.cancelled.add( other )
+
+    def runNode( self, node, numjobs ):
+        ok = False
+        try:
+            mgr = self.buildmgr
+            if self.settle( node ):
+                print("Package",node[0],node[1],': nothing to do')
+                ok = self.deploy( node )
+            else:
+                key = self.nodeKey( node ) if mgr.useartifacts else None
+                seed = ','.join( self.nodeKey( dep ) for dep in self.nodes[node] )
+                with mgr.tracer.span( 'build', node[0], node[1] ) as ev:
+                    if node in self.roots:
+                        ok = mgr.buildNode( node[0], node[1], numjobs, key, seed,
+                                            mgr.fromstep, mgr.forcestep )
+                    else:
+                        ok = mgr.buildNode( node[0], node[1], numjobs, key, seed )
+                    ok = ok and self.deploy( node )
+                    if not ok:
+                        ev['status'] = 'failed'
+
+        except Exception as e:
+            print("Exception caught building", node[0], node[1], ":", e)
+            ok = False
+        with self.lock:
+            self.finished.append( (node,ok) )
+            self.lock.notify()
+
+    def deploy( self, node ):
+        # Deploys this package into deploydir if anything depends on it
+        if node not in self.deployed:
+            return True
+        print(">> Deploying ", node[0], node[1])
+        with self.buildmgr.tracer.span( 'deploy', node[0], node[1] ):
+            dep = self.buildmgr.getBuilder( *node )
+            return dep.deploy()
+
+class LogFile():
+    # A build log that is written as the output arrives instead of being
+    # held in memory. It can be compressed with gzip, or with zstd if the
+    # zstandard module is installed, and it is rotated into .1, .2, ...
+    # once it grows over maxbytes, keeping the last 'keep' of them
+    SUFFIXES = { None:'', 'gzip':'.gz', 'zstd':'.zst' }
+
+    def __init__( self, fname, compress=None, maxbytes=None, keep=3 ):
+        if compress not in self.SUFFIXES:
+            raise ValueError( "Unknown log compression %s" % (compress,) )
+        self.fname = fname
+        self.compress = compress
+        self.maxbytes = maxbytes
+        self.keep = keep
+        self.raw = None
+        self.stream = None
+        self.size = 0
+
+    def __enter__( self ):
+        self.open()
+        return self
+
+    def __exit__( self, *args ):
+        self.close()
+
+    def open( self ):
+        self.raw = open( self.fname, 'ab' )
+        self.size = self.raw.tell()
+        if self.compress=='gzip':
+            # gzip files can be appended to as separate members
+            self.stream = gzip.GzipFile( fileobj=self.raw, mode='ab' )
+        elif self.compress=='zstd':
+            import zstandard
+            self.stream = zstandard.ZstdCompressor().stream_writer( self.raw )
+        else:
+            self.stream = self.raw
+
+    def close( self ):
+        if self.stream is not None and self.stream is not self.raw:
+            self.stream.close()
+        if self.raw is not None and not self.raw.closed:
+            self.raw.close()
+        self.stream = self.raw = None
+
+    def write( self, data ):
+        if isinstance( data, str ):
+            data = data.encode( 'utf-8' )
+        self.stream.write( data )
+        self.size += len(data)
+        if self.maxbytes and self.size>=self.maxbytes:
+            self.rotate()
+
+    def flush( self ):
+        self.stream.flush()
+
+    def rotate( self ):
+        self.close()
+        for j in range( self.keep-1, 0, -1 ):
+            older = '%s.%d' % (self.fname,j)
+            if os.path.exists( older ):
+                os.replace( older, '%s.%d' % (self.fname,j+1) )
+        if self.keep>0:
+            os.replace( self.fname, self.fname + '.1' )
+        else:
+            os.unlink( self.fname )
+        self.open()
+
+class Builder:
+    # The steps that build a package, in order, and their default commands
+    STEPS = ('checkout','configure','make','install')
+    DEFAULTS = { 'configure': "./configure --prefix={installdir}/{dirname}",
+                 'make': "make -j {numjobs}",
+                 'install': "make install" }
+
+    def __init__(self,buildmgr,pkgname,version):
+        # Retrieves a package of configuration from the manager
+        # and initializes the log streams
+        self.buildmgr = buildmgr
+        self.pkgname  = pkgname
+        self.version  = version
+        self.numjobs  = os.cpu_count()
+        self.env      = None
+        self.pkg      = dict( buildmgr.getPackage( pkgname, version ) )
+        # {numjobs} is this builder's share of the cpu budget, unless the
+        # config says otherwise
+        self.jobs     = {}
+        self.context  = TemplateContext( [ self.pkg, self.jobs, buildmgr.versions,
+                                           buildmgr.__dict__ ] )
+        if self.version != self.pkg['version']:
+            print("Replacing",pkgname,"version",version,"with",self.pkg['version'])
+        self.version  = self.pkg['version']
+        self.logfile = self.logName( "{builddir}/{dirname}.log" )
+        self.errfile = self.logName( "{builddir}/{dirname}.err" )
+
+    def logName( self, fname ):
+        # Log files get the extension of their compression, if any
+        return self.resolve( fname ) + LogFile.SUFFIXES[ self.buildmgr.logcompress ]
+
+    def openLog( self, fname ):
+        # Opens one of our log files for appending
+        mgr = self.buildmgr
+        return LogFile( fname, mgr.logcompress, mgr.logmaxbytes, mgr.logkeep )
+
+    def logError( self, msg ):
+        # Writes a message to this package's error log
+        with self.openLog( self.errfile ) as errf:
+            errf.write( msg )
+
+    def filetype( self, filename ):
+        # Canonicalize the type of compression/zippping mechanism from a file name
+        fnlow = filename.lower()
+        if fnlow.endswith( '.tar.gz' ) or fnlow.endswith( 'tgz' ):
+            return 'tar.gz'
+        if fnlow.endswith( '.tar.xz' ):
+            return 'tar.xz'
+        if fnlow.endswith( '.tar.bz2' ):
+            return 'tar.bz2'
+        if fnlow.endswith( '.tar.zst' ) or fnlow.endswith( '.tzst' ):
+            return 'tar.zst'
+        if fnlow.endswith( '.tar' ):
+            return 'tar'
+        if fnlow.endswith( '.zip' ):
+            return 'zip'
+
+    def resolve( self, value ):
+        # Resolves all {} dependencies in a string
+        self.jobs['numjobs'] = self.numjobs
+        return self.context.resolve( value )
+
+    def download( self, url, pkgfile, sha256=None ):
+        # Downloads url into pkgfile through the shared source cache.
+        # If sha256 is given, the file has to match it. If the file is
+        # being prefetched we wait for it and then take it from the cache
+        prefetcher = self.buildmgr.prefetcher
+        if prefetcher is not None:
+            ok = prefetcher.wait( url, sha256 )
+            if ok is False:
+                return False
+            if ok and os.path.isfile( pkgfile ):
+                return True
+        return self.buildmgr.getSourceCache().fetch( url, pkgfile, sha256 )
+
+    def isRepository( self, url ):
+        return RepositoryCache.kind( url ) is not None
+
+    def repositories( self ):
+        # The list of (kind,url,subdir) of the repositories checkout() puts
+        # together into {builddir}/{dirname}, the first one at its top,
+        # where kind is 'git' or 'svn'. Builders of trees made of several
+        # repositories override this
+        url = self.resolve( self.pkg.get('url') or '' )
+        kind = RepositoryCache.kind( url )
+        return [ (kind,url,'') ] if kind else []
+
+    def wantedRevision( self ):
+        rev = self.pkg.get('revision')
+        return self.resolve( str(rev) ) if rev is not None else None
+
+    def revisions( self, fetch=True ):
+        # What each of the repositories of this package is at, as resolved
+        # from the 'revision' in its config (a branch, tag, commit or svn
+        # revision, the latest if not given). Without fetch, only what is
+        # known without going to the network - see RepositoryCache
+        mirrors = self.buildmgr.getMirrors()
+        return [ mirrors.revision( kind, url, self.wantedRevision(),
+                                   self.pkg.get('partial',False), fetch )
+                 for kind,url,subdir in self.repositories() ]
+
+    def revision( self, fetch=True ):
+        # The revisions as one string. None if it is not built from
+        # repositories or they cannot be resolved
+        revs = self.revisions( fetch )
+        return None if not revs or None in revs else ",".join( revs )
+
+    def pinRevisions( self, revs ):
+        # Builds these revisions, as resolved by whoever asked for the build
+        mirrors = self.buildmgr.getMirrors()
+        for (kind,url,subdir),revision in zip( self.repositories(), revs ):
+            mirrors.pin( url, self.wantedRevision(), revision )
+
+    def pkgFile( self, url ):
+        # Where the tarball of this url is stored in builddir
+        pkgfile = self.pkg.get('pkgfile')
+        if not pkgfile:
+            if not 'ext' in self.pkg:
+                self.pkg['ext'] = self.filetype( url )
+            pkgfile = self.resolve( "{builddir}/{name}-{version}.{ext}" )
+            self.pkg['pkgfile'] = pkgfile
+        return pkgfile
+
+    def sources( self ):
+        # The list of (url,pkgfile,sha256) this builder will download in
+        # checkout(). Builders that download other things should override
+        # this so the sources can be prefetched
+        url = self.resolve( self.pkg.get('url') or '' )
+        if not url or self.isRepository( url ):
+            return []
+        return [ (url, self.pkgFile( url ), self.pkg.get('sha256')) ]
+
+    def checkout( self ):
+        # Downloads and extracts the tarball file form the web, or checks
+        # out the repositories from their mirrors
+        fullpath = self.resolve( '{builddir}/{dirname}' )
+        repos = self.repositories()
+        if repos:
+            if os.path.exists( fullpath ):
+                print("Removing existing path", fullpath)
+                shutil.rmtree( fullpath )
+            mirrors = self.buildmgr.getMirrors()
+            for kind,url,subdir in repos:
+                dest = os.path.join( fullpath, subdir ) if subdir else fullpath
+                if not mirrors.checkout( kind, url, self.wantedRevision(), dest,
+                                         self.pkg.get('depth'), self.pkg.get('partial',False) ):
+                    self.logError( "Could not check out %s\n" % (url,) )
+                    return False
+            return True
+        url = self.resolve( self.pkg['url'] )
+        if not url:
+            self.logError( "Configuration missign [url]" )
+            return False
+        if os.path.exists( fullpath ):
+            print("Removing existing path", fullpath)
+            shutil.rmtree( fullpath )
+        dirname = self.pkg.get('dirname')
+        if not dirname:
+            dirname = '{name}-{version}'
+            self.pkg['dirname'] = dirname
+        pkgfile = self.pkgFile( url )
+        return self.fetchExtract( url, pkgfile, self.pkg.get('sha256'), fullpath )
+
+    def fetchExtract( self, url, pkgfile, sha256, fullpath ):
+        # Gets a source and extracts it into builddir. If it is not around
+        # and nobody is downloading it already, it is extracted while it
+        # downloads
+        ext = self.pkg.get('ext') or self.filetype( pkgfile )
+        cache = self.buildmgr.getSourceCache()
+        prefetcher = self.buildmgr.prefetcher
+        ok = prefetcher.wait( url, sha256 ) if prefetcher is not None else None
+        if ok is False:
+            return False
+        if ok or ext=='zip' or os.path.isfile( pkgfile ) or cache.lookup( url, sha256 ):
+            if not self.download( url, pkgfile, sha256 ):
+                return False
+            return self.extract( pkgfile, fullpath )
+        if os.path.exists( fullpath ):
+            print("Removing existing path", fullpath)
+            shutil.rmtree( fullpath )
+        builddir = self.resolve( '{builddir}' )
+        try:
+            with self.buildmgr.tracer.span( 'extract', self.pkgname, self.version ), \
+                 cache.stream( url, sha256 ) as src:
+                label = "Fetching and extracting %s" % (os.path.basename(pkgfile),)
+                Extractor( builddir, label ).extractStream( src, ext, src.total )
+            cache.place( src.cached, pkgfile )
+        except Exception as e:
+            # a plain download retries and resumes, and starts over if
+            # what was left of an earlier attempt is no good (416)
+            print("Exception while fetching and extracting",url,":",e)
+            print("Downloading",url,"before extracting it")
+            if not self.download( url, pkgfile, sha256 ):
+                self.logError( "Could not fetch and extract [%s]: %s\n" % (url,e) )
+                return False
+            return self.extract( pkgfile, fullpath )
+        return True
+
+    def extract( self, pkgfile, fullpath ):
+        # extracts the file (name) passed into the canonical directory
+        # Currently it understands tar, gzip, bz2, xz, zstd and zip. Tarballs
+        # are expected to have a top directory, zip files might not
+        if os.path.exists( fullpath ):
+            print("Removing existing path", fullpath)
+            shutil.rmtree( fullpath )
+        ext = self.pkg.get('ext') or self.filetype( pkgfile )
+        if not ext:
+            self.logError( "Could not identify a valid extension in [%s] for extraction" % (pkgfile,) )
+            return False
+        destdir = self.resolve( '{builddir}' )
+        if ext=='zip':
+            with zipfile.ZipFile( pkgfile ) as zf:
+                tops = set( name.split('/')[0] for name in zf.namelist() )
+            if len(tops)!=1:
+                # no top directory, extract inside {dirname}
+                destdir = fullpath
+                os.makedirs( destdir )
+        try:
+            label = "Extracting %s" % (os.path.basename(pkgfile),)
+            with self.buildmgr.tracer.span( 'extract', self.pkgname, self.version ):
+                Extractor( destdir, label ).extractFile( pkgfile, ext )
+        except Exception as e:
+            print("Exception while extracting",pkgfile,":",e)
+            self.logError( "Could not extract [%s]: %s\n" % (pkgfile,e) )
+            return False
+        return True
+
+    def runcmd( self, cmd ):
+        # Run a system command, funneling stdout and stderr to the respective
+        # configuration logs as the output arrives. The last lines of stderr
+        # are kept around to be shown if the command fails
+        cmd = self.resolve( cmd )
+        print("Exec:", cmd)
+        logstr = "%s %s\n%s\n" % ("*"*30, nowstr(), cmd)
+        tail = collections.deque( maxlen=self.buildmgr.logtail )
+        with self.openLog( self.logfile ) as logf, self.openLog( self.errfile ) as errf:
+            logf.write( logstr )
+            errf.write( logstr )
+            pc = subprocess.Popen( cmd,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   env=self.env,
+                                   shell=True )
+            # stderr is read on its own thread so neither pipe fills up
+            errthread = threading.Thread( target=self.pump,
+                                          args=(pc.stderr,errf,tail) )
+            errthread.start()
+            try:
+                self.pump( pc.stdout, logf, None )
+            except Exception as e:
+                print("Exception running", cmd, ":", e)
+            errthread.join()
+            # wait4() gives us what this command alone has used
+            pid,status,ru = os.wait4( pc.pid, 0 )
+            pc.returncode = os.waitstatus_to_exitcode( status )
+            self.buildmgr.tracer.addUsage( ru )
+        if pc.returncode != 0 and tail:
+            print("Last %d lines of stderr:" % len(tail))
+            for line in tail:
+                print("    ", line.decode( 'utf-8', 'replace' ).rstrip())
+        return pc.returncode
+
+    def pump( self, pipe, logf, tail ):
+        # Copies the output of a command into a log file line by line
+        prefix = "[%s] " % (self.pkgname,)
+        for line in pipe:
+            logf.write( line )
+            if tail is not None:
+                tail.append( line )
+            if self.buildmgr.follow:
+                print( prefix + line.decode( 'utf-8', 'replace' ), end='' )
+        pipe.close()
+
+    def stepCommand( self, step ):
+        # The command of a step from the package configuration, or the default
+        return self.pkg.get( step ) or self.DEFAULTS.get( step )
+
+    def stepSignature( self, step ):
+        # What a step depends on: its command with everything resolved but
+        # {numjobs}, which does not change the outcome. For checkout this is
+        # where the sources come from
+        if step=='checkout':
+            sig = [ type(self).__module__, self.resolve( self.pkg.get('url') or '' ),
+                    self.pkg.get('sha256') ] + \
+                  [ list(src) for src in self.sources() ]
+            if self.repositories():
+                sig += [ self.revision(), self.pkg.get('depth') ]
+            return json.dumps( sig )
+        pkg = dict( self.pkg, numjobs='{{numjobs}}' )
+        return self.buildmgr.resolve( self.stepCommand( step ) or '', pkg )
+
+    def stepsFile( self ):
+        return self.resolve( "{builddir}/{dirname}.steps" )
+
+    def loadSteps( self ):
+        # Returns step => hash of the steps that completed
+        fname = self.stepsFile()
+        if not os.path.isfile( fname ):
+            return {}
+        try:
+            with open( fname ) as f:
+                return json.loads( f.read() )
+        except Exception as e:
+            print("Exception reading",fname,":",e)
+            return {}
+
+    def saveSteps( self, done ):
+        fname = self.stepsFile()
+        with open( fname + '.tmp', 'w' ) as f:
+            f.write( json.dumps( done, indent=1 ) )
+        os.replace( fname + '.tmp', fname )
+
+    def runSteps( self, seed='', fromstep=None, forcestep=None ):
+        # Runs checkout(), configure(), make() and install() in sequence,
+        # skipping the steps that have already completed with the same
+        # commands and inputs. Each step is checkpointed with a hash of its
+        # signature chained with the hashes of the steps before it and the
+        # seed (the keys of our dependencies), so changing one command
+        # invalidates that step and all that come after it.
+        # fromstep reruns that step and everything after it. forcestep
+        # reruns only that step
+        done = self.loadSteps()
+        prev = seed
+        rerun = False
+        for step in self.STEPS:
+            sig = hashlib.sha256( ('%s|%s|%s' % (prev,step,self.stepSignature(step))).encode('utf-8') ).hexdigest()
+            prev = sig
+            if step==fromstep:
+                rerun = True
+            forced = (step==forcestep)
+            fullpath = self.resolve( '{builddir}/{dirname}' )
+            if (not rerun) and (not forced) and done.get(step)==sig and os.path.isdir( fullpath ):
+                print("Step",step,"of",self.pkgname,self.version,"is up to date")
+                continue
+            if not forced:
+                # everything after this step has to run again
+                rerun = True
+                for later in self.STEPS[ self.STEPS.index(step): ]:
+                    done.pop( later, None )
+            else:
+                done.pop( step, None )
+            self.saveSteps( done )
+            with self.buildmgr.tracer.span( step, self.pkgname, self.version ) as ev:
+                ok = getattr( self, step )()
+                if not ok:
+                    ev['status'] = 'failed'
+            if not ok:
+                return False
+            done[step] = sig
+            self.saveSteps( done )
+        return True
+
+    def configure( self ):
+        # Try to get the configure command from package configuration
+        # This is usually the commnand that changes most frequently
+        # This step can also be used to apply patches, if any
+        cmd = "cd {builddir}/{dirname} && " + self.stepCommand( 'configure' )
+        status = self.runcmd( cmd )
+        if status!=0:
+            print("Command failed with status %d" % (status))
+            return False
+        return True
+
+    def make( self ):
+        # Try to get the make command from package configuration
+        # Otherwise go with just 'make'
+        cmd = "cd {builddir}/{dirname} && " + self.stepCommand( 'make' )
+        status = self.runcmd( cmd )
+        if status!=0:
+            print("Command failed with status %d" % (status))
+            return False
+        return True
+
+    def install( self ):
+        # Try to get the install command from package configuration
+        # If not found, just run 'make install' which is the usual for 99%
+        # of the packages out there
+        cmd = "cd {builddir}/{dirname} && " + self.stepCommand( 'install' )
+        status = self.runcmd( cmd )
+        if status!=0:
+            print("Command failed with status %d" % (status))
+            print("Check log files",self.logfile,"and",self.errfile)
+            return False
+        return True
+
+    def deploy( self ):
+        # Try to get the deploy commnd from package configuration
+        # the default is to mirror {installdir}/{dirname} into {deploydir}
+        # so everything stays in the same place. This is done incrementally
+        # through the deploy manifest, see DeployManifest
+        manifest = self.buildmgr.getManifest()
+        cmd = self.pkg.get('deploy')
+        if not cmd:
+            srcdir = self.resolve( "{installdir}/{dirname}" )
+            try:
+                return manifest.deploy( self.pkgname, self.version, srcdir,
+                                        self.buildmgr.deploymode )
+            except Exception as e:
+                print("Exception deploying", self.pkgname, self.version, ":", e)
+                return False
+        cmd = "cd {builddir}/{dirname} && " + cmd
+        status = self.runcmd( cmd )
+        if status!=0:
+            print("Command failed with status %d" % (status))
+            print("Check log files",self.logfile,"and",self.errfile)
+            return False
+        manifest.record( self.pkgname, self.version )
+        return True
+
+def main():
+    # The command line, run by pkgbuild.py
+    parser = argparse.ArgumentParser()
+    parser.add_argument( 'packages', nargs='*',
+                         help="packages to build, 'all', 'gc' to free disk space, "
+                              "'dedup' to share identical files in installdir or "
+                              "'history [packages]' to show previous builds" )
+    parser.add_argument( '--tags', '-t', default='default' )
+    parser.add_argument( '--location', '-l', default='default')
+    parser.add_argument( '--platform', '-p', default=os.uname().sysname )
+    parser.add_argument( '--config', '-c', default='~/.bleedingedge.json')
+    parser.add_argument( '--jobs', '-j', default=os.cpu_count() )
+    parser.add_argument( '--parallel', '-P', type=int, default=None,
+                         help='maximum number of packages built at the same time' )
+    parser.add_argument( '--deploy-mode', dest='deploymode', default=None,
+                         choices=DeployManifest.MODES,
+                         help='how files are put into deploydir' )
+    parser.add_argument( '--snapshot', default=None,
+                         help='file to persist the parsed configs and tags into' )
+    parser.add_argument( '--refresh-tags', dest='refreshtags', action='store_true',
+                         default=False, help='revalidate cached Ubuntu tags now' )
+    parser.add_argument( '--fetch-only', dest='fetchonly', action='store_true',
+                         default=False, help='only download the sources' )
+    parser.add_argument( '--fetch-jobs', dest='fetchjobs', type=int, default=4,
+                         help='number of concurrent downloads' )
+    parser.add_argument( '--follow', '-f', action='store_true', default=False,
+                         help='show the output of the build commands as they run' )
+    parser.add_argument( '--log-compress', dest='logcompress', default=None,
+                         choices=('gzip','zstd'), help='compress the build logs' )
+    parser.add_argument( '--no-artifacts', dest='useartifacts', action='store_false',
+                         default=True, help='do not use the artifact cache' )
+    parser.add_argument( '--no-ccache', dest='useccache', action='store_false',
+                         default=True, help='do not use the compiler cache' )
+    parser.add_argument( '--from-step', dest='fromstep', default=None,
+                         choices=Builder.STEPS,
+                         help='rerun the requested packages from this step on' )
+    parser.add_argument( '--force-step', dest='forcestep', default=None,
+                         choices=Builder.STEPS,
+                         help='rerun only this step of the requested packages' )
+    parser.add_argument( '--farm', default=None,
+                         help='deploy into the link farm FARM instead of deploydir. '
+                              'With --dump-environ, a comma separated list of farms' )
+    parser.add_argument( '--matrix', action='append', default=None,
+                         help='comma separated packages to build as variants, e.g. '
+                              'gcc-5.3.0,gcc-7.3.0. Repeat for more axes' )
+    parser.add_argument( '--matrix-report', dest='matrixreport', default=None,
+                         help='write the matrix results to this file (.json for JSON)' )
+    parser.add_argument( '--trace', default=None,
+                         help='write <TRACE>.jsonl and a Chrome trace <TRACE>.trace.json' )
+    parser.add_argument( '--plan', action='store_true', default=False,
+                         help='print what would be built, restored or skipped and exit' )
+    parser.add_argument( '--json', action='store_true', default=False,
+                         help='print the --plan as JSON' )
+    parser.add_argument( '--list-versions', dest='listversions', action='store_true',
+                         default=False,
+                         help='list the versions in the config of the packages and which one is picked' )
+    parser.add_argument( '--dump-environ', '-e', dest='dumpenv',
+                         action='store_true', default=False )
+    opt = parser.parse_args()
+
+    if len(opt.packages)==0 and (not opt.dumpenv) and (not opt.matrix):
+        parser.print_help()
+        sys.exit(1)
+
+    mytags = opt.tags.split(',') if isinstance(opt.tags,str) else opt.tags
+    stdout = sys.stdout
+    if opt.plan and opt.json:
+        # keep stdout for the JSON alone
+        sys.stdout = sys.stderr
+    mgr = BuildManager( tags=mytags, location=opt.location, config=opt.config,
+                        snapshot=opt.snapshot,
+                        tagttl=0 if opt.refreshtags else None,
+                        trace=opt.trace )
+    mgr.numjobs = int( opt.jobs )
+    mgr.fetchjobs = opt.fetchjobs
+    mgr.follow = opt.follow
+    mgr.useartifacts = opt.useartifacts
+    mgr.useccache = opt.useccache
+    mgr.fromstep = opt.fromstep
+    mgr.forcestep = opt.forcestep
+    if opt.logcompress:
+        mgr.logcompress = opt.logcompress
+    farms = opt.farm.split(',') if opt.farm else None
+
+    if opt.dumpenv:
+        print(mgr.dumpEnvironment( farms ))
+        sys.exit(0)
+
+    if farms:
+        if len(farms)>1:
+            print("Only one farm can be deployed into at a time")
+            sys.exit(1)
+        mgr.useFarm( farms[0] )
+    if opt.deploymode:
+        mgr.deploymode = opt.deploymode
+
+    if opt.packages==['gc']:
+        # with --plan, only tell what would be done
+        ok = mgr.collectGarbage( mgr.diskbudget, dryrun=opt.plan )
+        sys.exit( 0 if ok else 1 )
+
+    if opt.packages==['dedup']:
+        # with --plan, only tell what would be shared
+        if not mgr.dedup:
+            mgr.dedup = 'auto'
+        ok = mgr.dedupInstalls( dryrun=opt.plan )
+        sys.exit( 0 if ok else 1 )
+
+    if opt.packages[:1]==['history']:
+        # exits with 1 if any version got slower or bigger than the one before
+        report,flagged = mgr.getHistory().report( opt.packages[1:] )
+        print( report )
+        sys.exit( 1 if flagged else 0 )
+
+    if opt.matrix:
+        # every combination of one package per axis is a variant
+        axes = []
+        for axis in opt.matrix:
+            parsed = [ mgr.parse( pkg ) for pkg in axis.split(',') if pkg ]
+            for pkg,(pkgname,version) in zip( axis.split(','), parsed ):
+                if pkgname is None:
+                    print("Package string",pkg,"does not match any in database")
+                    sys.exit(1)
+            axes.append( [ (pkgname,version or None) for pkgname,version in parsed ] )
+        variants = [ list(combo) for combo in itertools.product( *axes ) ]
+        if opt.listversions:
+            print("--list-versions cannot be used with --matrix")
+            sys.exit(1)
+        if opt.plan:
+            plan = mgr.planMatrix( variants, opt.json )
+            if plan is None:
+                sys.exit(1)
+            print(plan, file=stdout)
+            sys.exit(0)
+        if opt.fetchonly:
+            # variants can need different versions of the same package
+            ok = all( [ mgr.fetchPackages( pkglist ) for pkglist in variants ] )
+            sys.exit( 0 if ok else 1 )
+        ok = mgr.buildMatrix( variants, opt.matrixreport, maxparallel=opt.parallel )
+        print(mgr.buildSummary())
+        if opt.trace:
+            mgr.tracer.save()
+            print(mgr.tracer.importSummary())
+        sys.exit( 0 if ok else 1 )
+
+    if len(opt.packages)==1 and (opt.packages[0].lower()=='all'):
+        opt.packages = mgr.getAllPackages()
+
+    pkglist = []
+    for pkg in opt.packages:
+        # things get dicy for cases like apache-maven-3.3.3
+        # (pkgname,version) = (apache,maven-3.3.3) or (apache-maven,3.3.3)?
+        pkgname,version = mgr.parse( pkg )
+        if pkgname is None:
+            print("Package string",pkg,"does not match any in database")
+            continue
+        pkglist.append( (pkgname,version or None) )
+    if opt.listversions:
+        # '*' is the version picked, versions in () do not match the tags
+        for pkgname,version in sorted( pkglist, key=lambda x: x[0] ):
+            pkg = mgr.getPackage( pkgname, version )
+            picked = pkg['version'] if pkg else None
+            vslist = mgr.listVersions( pkgname ) or []
+            print("%s:" % pkgname, " ".join(
+                ('*' if vs==picked else '') + (vs if match else '(%s)' % vs)
+                for vs,match in vslist ))
+        sys.exit(0)
+    if opt.plan:
+        actions = mgr.planPackages( pkglist )
+        if actions is None:
+            sys.exit(1)
+        print(mgr.formatPlan( actions, opt.json ), file=stdout)
+        sys.exit(0)
+    if opt.fetchonly:
+        ok = mgr.fetchPackages( pkglist )
+    else:
+        ok = mgr.buildPackages( pkglist, maxparallel=opt.parallel )
+        print(mgr.buildSummary())
+    if opt.trace:
+        mgr.tracer.save()
+        print(mgr.tracer.importSummary())
+    sys.exit( 0 if ok else 1 )
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+# Spreads the builds of pkgbuild.py over several machines.
+# Every machine runs one or more workers, each with its own location
+# (builddir, deploydir) but the same installdir path as the coordinator,
+# since prefixes end up baked into the binaries:
+#   ./buildfarm.py worker --listen 0.0.0.0:7070 --token SECRET -l worker1
+# The coordinator resolves the packages as pkgbuild.py does and sends
+# every package that is not in its artifact cache to a free worker. The
+# worker installs the dependencies it lacks from archives sent by the
+# coordinator, builds the package from checkout to install and sends back
+# its packed install prefix, which goes into the artifact cache of the
+# coordinator and from there into its installdir and deploydir:
+#   ./buildfarm.py build --workers host1:7070,host2:7070 --token SECRET gcc-7.3.0
+# Packages go preferably to the worker that already has most of their
+# dependencies. Several workers on localhost, with locations that share
+# installdir, work too and need no transfers at all.
+# Workers listen on localhost unless told otherwise and only talk to a
+# coordinator that starts with the token they were given, as what it sends
+# ends up installed and run. The token can also be in BLEEDINGEDGE_TOKEN.
+# The protocol is one JSON object per line, some of them followed by
+# 'size' bytes of an archive:
+#   coordinator              worker
+#   hello {token}         => hello {host,platform,installdir,have}
+#   build {name,version,key,seed,depkeys,depends}
+#                         <= need {name,version,key}      for every dependency
+#   archive {size} + data =>                              it does not have
+#                         <= progress {line}              while it builds
+#                         <= done {ok,size} + data
+import os
+import sys
+import json
+import socket
+import re
+import hmac
+import argparse
+import threading
+import contextlib
+import multiprocessing
+import platform as plat
+
+import bleedingedge
+
+def validNode( name, version, key ):
+    # Names and versions from the wire end up in file names under installdir
+    # and the artifact cache, keys are sha256 digests
+    for part in (name,version):
+        if not isinstance( part, str ) or not part or '/' in part or '..' in part:
+            return False
+    return isinstance( key, str ) and re.fullmatch( '[0-9a-f]+', key ) is not None
+
+def validDir( dirname ):
+    # An install prefix relative to installdir, nothing outside of it
+    return ( isinstance( dirname, str ) and dirname!='' and not dirname.startswith( '/' )
+             and '..' not in dirname.split( '/' ) )
+
+class Channel():
+    # Messages over a socket: a JSON line, optionally followed by a payload
+    CHUNK = 1<<20
+
+    def __init__( self, sock ):
+        self.sock = sock
+        self.reader = sock.makefile( 'rb' )
+        self.lock = threading.Lock()
+
+    def send( self, msg, fname=None ):
+        # Sends the message and the contents of fname, if given
+        with self.lock:
+            if fname is not None:
+                msg['size'] = os.path.getsize( fname )
+            self.sock.sendall( (json.dumps( msg ) + "\n").encode( 'utf-8' ) )
+            if fname is not None:
+                with open( fname, 'rb' ) as f:
+                    while True:
+                        data = f.read( self.CHUNK )
+                        if not data:
+                            break
+                        self.sock.sendall( data )
+
+    def recv( self ):
+        line = self.reader.readline()
+        if not line:
+            raise EOFError( "Connection closed" )
+        msg = json.loads( line.decode( 'utf-8' ) )
+        if not isinstance( msg, dict ):
+            raise ValueError( "Not a message: %r" % (msg,) )
+        return msg
+
+    def recvFile( self, size, fname ):
+        # Writes the payload that follows a message into fname
+        with open( fname, 'wb' ) as f:
+            while size > 0:
+                data = self.reader.read( min( size, self.CHUNK ) )
+                if not data:
+                    raise EOFError( "Connection closed in the middle of a transfer" )
+                f.write( data )
+                size -= len(data)
+
+    def close( self ):
+        self.reader.close()
+        self.sock.close()
+
+class ProgressWriter():
+    # Stands for stdout on the worker while it builds. Everything goes to
+    # the worker's own stdout and the lines that tell where the build is
+    # go to the coordinator as well
+    PREFIXES = ( '>>', 'Exec:', 'Package' )
+
+    def __init__( self, channel, stdout ):
+        self.channel = channel
+        self.stdout = stdout
+        self.buffer = ''
+
+    def write( self, text ):
+        self.stdout.write( text )
+        self.buffer += text
+        while "\n" in self.buffer:
+            line,self.buffer = self.buffer.split( "\n", 1 )
+            if line.startswith( self.PREFIXES ):
+                try:
+                    self.channel.send( { 'op':'progress', 'line':line } )
+                except OSError:
+                    pass
+
+    def flush( self ):
+        self.stdout.flush()
+
+class Worker():
+    # Builds the packages a coordinator sends, one at a time
+    def __init__( self, buildmgr, token ):
+        self.buildmgr = buildmgr
+        self.token = token
+        # the artifact cache is what the install prefixes are packed with
+        buildmgr.useartifacts = True
+
+    def have( self ):
+        # The keys of the packages in installdir
+        keys = []
+        installdir = self.buildmgr.installdir
+        for fname in os.listdir( installdir ) if os.path.isdir( installdir ) else []:
+            if fname.endswith( '.done' ):
+                with open( os.path.join( installdir, fname ) ) as f:
+                    lines = f.read().splitlines()
+                if len(lines)>1:
+                    keys.append( lines[1] )
+        return keys
+
+    def serve( self, address ):
+        host,port = address.rsplit( ':', 1 )
+        server = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
+        server.setsockopt( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+        server.bind( (host,int(port)) )
+        server.listen( 4 )
+        print("Worker listening on %s:%s" % server.getsockname()[:2])
+        while True:
+            sock,peer = server.accept()
+            print("Coordinator connected from %s:%s" % peer[:2])
+            channel = Channel( sock )
+            try:
+                self.session( channel )
+            except (EOFError,OSError,ValueError) as e:
+                print("Coordinator %s:%s went away: %s" % (peer[0],peer[1],e))
+            finally:
+                channel.close()
+
+    def session( self, channel ):
+        mgr = self.buildmgr
+        # nothing but hello with the right token comes first
+        msg = channel.recv()
+        token = msg.get('token') if msg.get('op')=='hello' else None
+        if not isinstance( token, str ) or not hmac.compare_digest( token.encode(), self.token.encode() ):
+            print("Coordinator did not give the right token, disconnecting")
+            channel.send( { 'op':'error', 'error':'bad token' } )
+            return
+        while True:
+            if msg.get('op')=='hello':
+                channel.send( { 'op':'hello', 'host':socket.gethostname(),
+                                'platform':[ mgr.platform, plat.machine() ],
+                                'installdir':mgr.installdir, 'have':self.have() } )
+            elif msg.get('op')=='build':
+                ok = False
+                with contextlib.redirect_stdout( ProgressWriter( channel, sys.stdout ) ):
+                    try:
+                        ok = self.build( channel, msg )
+                    except (EOFError,OSError):
+                        raise
+                    except Exception as e:
+                        print("Exception caught building",msg['name'],msg['version'],":",e)
+                fname = None
+                if ok:
+                    fname = mgr.getArtifactCache().lookup( msg['name'], msg['version'], msg['key'] )
+                channel.send( { 'op':'done', 'ok':bool(fname), 'have':self.have() }, fname )
+            else:
+                print("Unknown message",msg)
+            msg = channel.recv()
+
+    def build( self, channel, msg ):
+        mgr = self.buildmgr
+        pkgname,version,key = msg['name'],msg['version'],msg['key']
+        depends = [ tuple(dep) for dep in msg['depends'] ]
+        if not all( validNode( *node ) for node in [ (pkgname,version,key) ] + depends ):
+            print("Invalid package name, version or key, not building",pkgname,version)
+            return False
+        if msg.get('revisions'):
+            mgr.getBuilder( pkgname, version ).pinRevisions( msg['revisions'] )
+        # the same key means the same config, which is what was asked for
+        mine = mgr.artifactKey( pkgname, version, msg['depkeys'] )
+        if mine!=key:
+            print("Package %s %s has a different config here, not building it" % (pkgname,version))
+            return False
+        # the dependencies go into installdir, from the coordinator if need
+        # be, and from there into our deploydir
+        cache = mgr.getArtifactCache()
+        for depname,depversion,depkey in depends:
+            if mgr.checkIsBuilt( depname, depversion, depkey ):
+                continue
+            if not cache.lookup( depname, depversion, depkey ):
+                channel.send( { 'op':'need', 'name':depname, 'version':depversion, 'key':depkey } )
+                reply = channel.recv()
+                if reply.get('size') is None:
+                    print("Coordinator does not have",depname,depversion)
+                    return False
+                if not validDir( reply.get('dirname') ):
+                    print("Invalid install directory for",depname,depversion,":",reply.get('dirname'))
+                    return False
+                tmpname = cache.tmpname( cache.archive( depname, depversion, depkey ) )
+                channel.recvFile( reply['size'], tmpname )
+                cache.insert( depname, depversion, depkey, reply['dirname'], tmpname,
+                              reply.get('host') )
+            if not mgr.restoreNode( depname, depversion, depkey ):
+                return False
+        mgr.getManifest().prune( set( (name,version) for name,version,key in depends ) )
+        for depname,depversion,depkey in depends:
+            if not mgr.getBuilder( depname, depversion ).deploy():
+                return False
+        return mgr.buildNode( pkgname, version, mgr.numjobs, key, msg['seed'] )
+
+class RemoteWorker():
+    # The coordinator side of the connection to one worker
+    def __init__( self, address, token ):
+        self.address = address
+        host,port = address.rsplit( ':', 1 )
+        self.channel = Channel( socket.create_connection( (host,int(port)) ) )
+        self.channel.send( { 'op':'hello', 'token':token } )
+        hello = self.channel.recv()
+        if hello.get('op')!='hello':
+            self.channel.close()
+            raise ValueError( hello.get('error') or 'unexpected reply' )
+        self.host = hello['host']
+        self.platform = hello['platform']
+        self.installdir = hello['installdir']
+        self.have = set( hello['have'] )
+
+    def build( self, mgr, node, key, seed, depkeys, depends, revisions=() ):
+        # Has the worker build this node and puts the result into the
+        # artifact cache. Returns True if it did
+        pkgname,version = node
+        cache = mgr.getArtifactCache()
+        self.channel.send( { 'op':'build', 'name':pkgname, 'version':version, 'key':key,
+                             'seed':seed, 'depkeys':depkeys, 'depends':depends,
+                             'revisions':list( revisions ) } )
+        while True:
+            msg = self.channel.recv()
+            if msg['op']=='progress':
+                print("[%s] %s" % (self.address,msg['line']))
+            elif msg['op']=='need':
+                if not validNode( msg.get('name'), msg.get('version'), msg.get('key') ):
+                    # not something we would have an archive of
+                    self.channel.send( { 'op':'archive' } )
+                    continue
+                self.send( mgr, msg['name'], msg['version'], msg['key'] )
+            elif msg['op']=='done':
+                self.have = set( msg['have'] )
+                if not msg['ok']:
+                    return False
+                tmpname = cache.tmpname( cache.archive( pkgname, version, key ) )
+                self.channel.recvFile( msg['size'], tmpname )
+                cache.insert( pkgname, version, key, packageDir( mgr, pkgname, version ),
+                              tmpname, self.host )
+                return True
+
+    def send( self, mgr, pkgname, version, key ):
+        # Sends the archive of a package we have built or restored
+        cache = mgr.getArtifactCache()
+        dirname = packageDir( mgr, pkgname, version )
+        fname = cache.lookup( pkgname, version, key )
+        if fname is None and mgr.checkIsBuilt( pkgname, version, key ):
+            # built before there was an artifact cache
+            cache.store( pkgname, version, key, mgr.installdir, dirname )
+            fname = cache.lookup( pkgname, version, key )
+        self.channel.send( { 'op':'archive', 'dirname':dirname,
+                             'host':socket.gethostname() }, fname )
+
+    def close( self ):
+        self.channel.close()
+
+def packageDir( mgr, pkgname, version ):
+    # {dirname} of this package, what goes under installdir
+    pkg = mgr.getPackage( pkgname, version )
+    return mgr.resolve( pkg.get('dirname') or '{name}-{version}', pkg )
+
+class WorkerPool():
+    # The workers that are free, handed out to the packages that would
+    # need to transfer the least dependencies to them
+    def __init__( self, workers ):
+        self.workers = list( workers )
+        self.free = list( workers )
+        self.lock = threading.Condition()
+
+    def acquire( self, depkeys, exclude=() ):
+        # A free worker or None if there are none left that can be used
+        with self.lock:
+            while True:
+                if not [ w for w in self.workers if w not in exclude ]:
+                    return None
+                candidates = [ w for w in self.free if w not in exclude ]
+                if candidates:
+                    best = max( candidates, key=lambda w: len( w.have.intersection( depkeys ) ) )
+                    self.free.remove( best )
+                    return best
+                self.lock.wait()
+
+    def release( self, worker, dead=False ):
+        with self.lock:
+            if dead:
+                self.workers.remove( worker )
+                worker.close()
+            else:
+                self.free.append( worker )
+            self.lock.notify_all()
+
+class FarmScheduler( bleedingedge.BuildScheduler ):
+    # The BuildScheduler with the builds done by workers. What is in the
+    # artifact cache is restored here, as it would be anyway
+    def __init__( self, buildmgr, pool ):
+        bleedingedge.BuildScheduler.__init__( self, buildmgr, maxparallel=len(pool.workers) )
+        self.pool = pool
+
+    def prefetch( self, nodes ):
+        # the workers fetch their own sources
+        pass
+
+    def runNode( self, node, numjobs ):
+        ok = False
+        try:
+            mgr = self.buildmgr
+            if self.settle( node ):
+                print("Package",node[0],node[1],': nothing to do')
+                ok = self.deploy( node )
+            else:
+                key = self.nodeKey( node )
+                seed = ','.join( self.nodeKey( dep ) for dep in self.nodes[node] )
+                with mgr.tracer.span( 'build', node[0], node[1] ) as ev:
+                    ok = True
+                    if not mgr.getArtifactCache().lookup( node[0], node[1], key ):
+                        ok = self.remoteBuild( node, key, seed )
+                        if not ok:
+                            print("Package",node[0],node[1],": no worker could build it")
+                    ok = ok and mgr.restoreNode( node[0], node[1], key ) and self.deploy( node )
+                    if not ok:
+                        ev['status'] = 'failed'
+        except Exception as e:
+            print("Exception caught building", node[0], node[1], ":", e)
+            ok = False
+        with self.lock:
+            self.finished.append( (node,ok) )
+            self.lock.notify()
+
+    def remoteBuild( self, node, key, seed ):
+        # Tries the workers until one builds it. A worker that fails the
+        # build is not asked again, one that disconnects is dropped
+        depends = [ dep for dep in self.order if self.dependsOn( node, dep ) ]
+        depkeys = [ self.nodeKey( dep ) for dep in self.nodes[node] ]
+        closure = [ [dep[0],dep[1],self.nodeKey( dep )] for dep in depends ]
+        # the worker builds the revisions the key was made with
+        revisions = self.buildmgr.getBuilder( *node ).revisions( fetch=False )
+        tried = []
+        while True:
+            worker = self.pool.acquire( set( dep[2] for dep in closure ), tried )
+            if worker is None:
+                return False
+            tried.append( worker )
+            print(">> Building %s %s on %s" % (node[0],node[1],worker.address))
+            try:
+                ok = worker.build( self.buildmgr, node, key, seed, depkeys, closure, revisions )
+            except (EOFError,OSError,ValueError) as e:
+                print("Worker %s lost: %s" % (worker.address,e))
+                self.pool.release( worker, dead=True )
+                continue
+            self.pool.release( worker )
+            if ok:
+                return True
+
+def connect( mgr, addresses, token ):
+    # Connects to the workers that are up and can build for us
+    workers = []
+    for address in addresses:
+        try:
+            worker = RemoteWorker( address, token )
+        except (OSError,EOFError,ValueError) as e:
+            print("Could not connect to worker %s: %s" % (address,e))
+            continue
+        if worker.installdir!=mgr.installdir:
+            print("Worker %s installs into %s instead of %s, not using it" %
+                  (address,worker.installdir,mgr.installdir))
+        elif worker.platform!=[ mgr.platform, plat.machine() ]:
+            print("Worker %s is a %s, not using it" % (address,'/'.join(worker.platform)))
+        else:
+            print("Using worker %s on %s" % (address,worker.host))
+            workers.append( worker )
+            continue
+        worker.close()
+    return workers
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='Builds packages on several machines' )
+    parser.add_argument( 'mode', choices=('worker','build') )
+    parser.add_argument( 'packages', nargs='*', help='packages to build' )
+    parser.add_argument( '--listen', default='127.0.0.1:7070',
+                         help='address and port the worker listens on' )
+    parser.add_argument( '--token', default=os.environ.get( 'BLEEDINGEDGE_TOKEN' ),
+                         help='secret shared by the coordinator and the workers' )
+    parser.add_argument( '--workers', '-w', default='',
+                         help='comma separated host:port of the workers' )
+    parser.add_argument( '--tags', '-t', default='default' )
+    parser.add_argument( '--location', '-l', default='default')
+    parser.add_argument( '--platform', '-p', default=plat.system())
+    parser.add_argument( '--config', '-c', default='~/.bleedingedge.json')
+    parser.add_argument( '--jobs', '-j', default=multiprocessing.cpu_count() )
+    opt = parser.parse_intermixed_args()
+    if not opt.token:
+        print("A --token shared by the coordinator and the workers is needed")
+        sys.exit(1)
+
+    mgr = bleedingedge.BuildManager( tags=opt.tags.split(','), location=opt.location,
+                                 platform=opt.platform, config=opt.config )
+    mgr.numjobs = int( opt.jobs )
+    if opt.mode=='worker':
+        Worker( mgr, opt.token ).serve( opt.listen )
+        sys.exit(0)
+
+    pkglist = []
+    for pkg in opt.packages:
+        pkgname,version = mgr.parse( pkg )
+        if pkgname is None:
+            print("Package string",pkg,"does not match any in database")
+            sys.exit(1)
+        pkglist.append( (pkgname,version or None) )
+    workers = connect( mgr, [ w for w in opt.workers.split(',') if w ], opt.token )
+    if not workers:
+        print("No workers to build with")
+        sys.exit(1)
+    pool = WorkerPool( workers )
+    sched = FarmScheduler( mgr, pool )
+    for pkgname,version in pkglist:
+        print("Requested package [%s] version [%s]" % (pkgname,version))
+        node = sched.addPackage( pkgname, version )
+        if not node:
+            sys.exit(1)
+        sched.roots.add( node )
+    ok = sched.run()
+    for worker in pool.free:
+        worker.close()
+    sys.exit( 0 if ok else 1 )
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Compiler cache used by pkgbuild.py while building packages.
+# pkgbuild.py puts a directory with links named gcc, g++, cc, c++, clang
+# and clang++ to this script in front of the PATH of the build commands.
+# Every compilation of one source into one object (-c) is looked up in a
+# content addressed cache by the hash of the compiler, the arguments and
+# the preprocessed source. On a hit the object (and the dependency file
+# and warnings, if any) is taken from the cache, otherwise the real
+# compiler is run and its output is stored. Everything else (linking,
+# preprocessing, several sources at once) goes straight to the compiler.
+# It is driven by these environment variables:
+#   COMPCACHE_DIR    where the objects are kept
+#   COMPCACHE_BIN    the directory with the links, skipped to find the compiler
+#   COMPCACHE_STATS  file where one line per compilation is appended:
+#                    hit, miss or skip
+# The size of the cache is kept in check by pkgbuild.py, which evicts the
+# least recently used objects - hits touch their object for that reason
+import os
+import sys
+import hashlib
+import subprocess
+import tempfile
+
+# options followed by a value in the next argument
+VALUEOPTS = set( [ '-o', '-I', '-D', '-U', '-include', '-imacros', '-isystem',
+                   '-iquote', '-idirafter', '-iprefix', '-isysroot', '-x',
+                   '-MF', '-MT', '-MQ', '-L', '-arch', '-target', '--param',
+                   '-Xpreprocessor', '-Xassembler', '-Xlinker', '-Xclang',
+                   '-aux-info', '--sysroot' ] )
+# options that make the compiler write files we do not know about
+UNCACHEABLE = set( [ '-E', '-S', '-M', '-MM', '-save-temps', '--coverage',
+                     '-fprofile-arcs', '-ftest-coverage', '-fprofile-generate',
+                     '-fsyntax-only' ] )
+UNCACHEABLEPREFIXES = ( '-fdump-', '-Wp,', '-save-temps=', '-fprofile-generate=' )
+SOURCES = ( '.c', '.cc', '.cpp', '.cxx', '.c++', '.C', '.cp', '.S', '.m', '.mm' )
+
+def findCompiler( name, skipdir ):
+    # The first executable with this name in PATH that is not us
+    for dname in os.environ.get( 'PATH', '' ).split( os.pathsep ):
+        if not dname or os.path.realpath( dname )==skipdir:
+            continue
+        path = os.path.join( dname, name )
+        if os.path.isfile( path ) and os.access( path, os.X_OK ):
+            if os.path.realpath( path )!=os.path.realpath( __file__ ):
+                return path
+    return None
+
+def parseArgs( args ):
+    # Returns (source, output, depfile, cppargs) for a cacheable compilation
+    # or None. cppargs are the arguments to preprocess the source with
+    source = output = depfile = None
+    compile = deps = False
+    cppargs = []
+    j = 0
+    while j<len(args):
+        arg = args[j]
+        if arg.startswith( '@' ) or arg=='-':
+            return None
+        if arg in UNCACHEABLE or arg.startswith( UNCACHEABLEPREFIXES ):
+            return None
+        if arg in VALUEOPTS:
+            if j+1>=len(args):
+                return None
+            value = args[j+1]
+            if arg=='-o':
+                output = value
+            elif arg=='-MF':
+                depfile = value
+            elif arg not in ('-MT','-MQ'):
+                cppargs += [ arg, value ]
+            j += 2
+            continue
+        if arg=='-c':
+            compile = True
+        elif arg in ('-MD','-MMD'):
+            deps = True
+        elif arg=='-MP':
+            pass
+        elif arg.startswith( '-o' ):
+            output = arg[2:]
+        elif arg.startswith( '-MF' ):
+            depfile = arg[3:]
+        elif arg.startswith( '-MT' ) or arg.startswith( '-MQ' ):
+            pass
+        elif not arg.startswith( '-' ):
+            if source is not None or not arg.endswith( SOURCES ):
+                return None
+            source = arg
+            cppargs.append( arg )
+        else:
+            cppargs.append( arg )
+        j += 1
+    if not compile or source is None:
+        return None
+    if output is None:
+        output = os.path.splitext( os.path.basename( source ) )[0] + '.o'
+    if deps and depfile is None:
+        depfile = os.path.splitext( output )[0] + '.d'
+    if not deps:
+        depfile = None
+    return source,output,depfile,cppargs
+
+def hashCompilation( compiler, args, cppargs ):
+    # Hash of the compiler binary, the arguments and the preprocessed
+    # source. Returns None if the source does not preprocess
+    h = hashlib.sha256()
+    st = os.stat( compiler )
+    h.update( ("%s %d %d\n" % (os.path.realpath(compiler),st.st_size,st.st_mtime_ns)).encode() )
+    h.update( "\0".join( args ).encode( 'utf-8', 'surrogateescape' ) )
+    pc = subprocess.run( [compiler,'-E'] + cppargs, stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL )
+    if pc.returncode!=0:
+        return None
+    h.update( pc.stdout )
+    return h.hexdigest()
+
+def writeFile( fname, data ):
+    # Writes to a temporary and renames so nobody sees half a file
+    dname = os.path.dirname( fname ) or '.'
+    fd,tmpname = tempfile.mkstemp( dir=dname, prefix='.compcache-' )
+    try:
+        os.fchmod( fd, 0o644 )
+        with os.fdopen( fd, 'wb' ) as f:
+            f.write( data )
+        os.replace( tmpname, fname )
+    except:
+        if os.path.exists( tmpname ):
+            os.unlink( tmpname )
+        raise
+
+def readFile( fname ):
+    with open( fname, 'rb' ) as f:
+        return f.read()
+
+def record( result ):
+    statsfile = os.environ.get( 'COMPCACHE_STATS' )
+    if statsfile:
+        try:
+            with open( statsfile, 'a' ) as f:
+                f.write( result + "\n" )
+        except OSError:
+            pass
+
+def main( argv ):
+    name = os.path.basename( argv[0] )
+    args = argv[1:]
+    cachedir = os.environ.get( 'COMPCACHE_DIR' )
+    bindir = os.path.realpath( os.environ.get( 'COMPCACHE_BIN' ) or
+                               os.path.dirname( os.path.abspath( argv[0] ) ) )
+    compiler = findCompiler( name, bindir )
+    if compiler is None:
+        print( "compcache: could not find the real", name, file=sys.stderr )
+        return 127
+    parsed = parseArgs( args ) if cachedir else None
+    if parsed is None:
+        record( 'skip' )
+        os.execv( compiler, [compiler] + args )
+    source,output,depfile,cppargs = parsed
+    digest = hashCompilation( compiler, args, cppargs )
+    if digest is None:
+        record( 'skip' )
+        os.execv( compiler, [compiler] + args )
+
+    base = os.path.join( cachedir, 'objects', digest[:2], digest )
+    if os.path.isfile( base + '.o' ):
+        try:
+            writeFile( output, readFile( base + '.o' ) )
+            if depfile:
+                writeFile( depfile, readFile( base + '.d' ) )
+            if os.path.isfile( base + '.stderr' ):
+                sys.stderr.buffer.write( readFile( base + '.stderr' ) )
+            # used now, for the LRU eviction
+            os.utime( base + '.o' )
+            record( 'hit' )
+            return 0
+        except OSError:
+            # evicted while we were reading it, compile it
+            pass
+
+    pc = subprocess.run( [compiler] + args, stderr=subprocess.PIPE )
+    sys.stderr.buffer.write( pc.stderr )
+    if pc.returncode!=0:
+        record( 'skip' )
+        return pc.returncode
+    try:
+        os.makedirs( os.path.dirname( base ), exist_ok=True )
+        if depfile:
+            writeFile( base + '.d', readFile( depfile ) )
+        if pc.stderr:
+            writeFile( base + '.stderr', pc.stderr )
+        # the object goes last, it is what tells there is an entry
+        writeFile( base + '.o', readFile( output ) )
+    except OSError as e:
+        print( "compcache: could not store", output, ":", e, file=sys.stderr )
+    record( 'miss' )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit( main( sys.argv ) )
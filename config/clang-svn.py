@@ -1,30 +1,20 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 # clang has an awkward tree configuration so we have to implement
 # a custom builder to override the default downloader
+# The four trunks are mirrored and exported into one tree, see
+# Builder.repositories()
 
 import pkgbuild
 
+LLVMSVN = "http://llvm.org/svn/llvm-project"
+
 class CustomBuilder( pkgbuild.Builder ):
     def __init__( self, buildmgr, pkgname, version ):
         pkgbuild.Builder.__init__( self, buildmgr, pkgname, version )
 
-    def checkout( self ):
-        cmd = """
-        rm -rf {builddir}/clang-{version} || exit 1
-        cd {builddir} || exit 1
-        svn co http://llvm.org/svn/llvm-project/llvm/trunk clang-{version} || exit 1
-
-        cd {builddir}/clang-{version}/tools || exit 1
-        svn co http://llvm.org/svn/llvm-project/cfe/trunk clang || exit 1
-
-        cd {builddir}/clang-{version}/tools/clang/tools || exit 1
-        svn co http://llvm.org/svn/llvm-project/clang-tools-extra/trunk extra || exit 1
-
-        cd {builddir}/clang-{version}/projects || exit 1
-        svn co http://llvm.org/svn/llvm-project/compiler-rt/trunk compiler-rt || exit 1
-        """
-        status = self.runcmd( cmd )
-        if status!=0:
-            print "Command failed. Please check logs"
-        return status==0
+    def repositories( self ):
+        return [ ('svn', LLVMSVN + "/llvm/trunk", ''),
+                 ('svn', LLVMSVN + "/cfe/trunk", 'tools/clang'),
+                 ('svn', LLVMSVN + "/clang-tools-extra/trunk", 'tools/clang/tools/extra'),
+                 ('svn', LLVMSVN + "/compiler-rt/trunk", 'projects/compiler-rt') ]
@@ -3,32 +3,44 @@
 # clang has an awkward tree configuration so we have to implement
 # a custom builder to override the default downloader
 
+import os
+import shutil
+import concurrent.futures
 import pkgbuild
 
 class CustomBuilder( pkgbuild.Builder ):
     def __init__( self, buildmgr, pkgname, version ):
         pkgbuild.Builder.__init__( self, buildmgr, pkgname, version )
 
-    def checkout( self ):
-        fullpath = self.resolve( '{builddir}/{dirname}' )
+    def sources( self ):
+        # llvm, clang and friends come in separate tarballs
         baseurl = self.resolve( self.pkg["url"] )
+        srcs = []
         for subpkg in ( 'llvm','cfe','compiler-rt','clang-tools-extra'):
             filename = '%s-%s.src.tar.xz' % (subpkg,self.version,)
             pkgfile = self.resolve( '{builddir}/%s' % (filename,) )
             url = '%s/%s' % (baseurl,filename,)
-            if not self.download( url, pkgfile ):
-                print "Could not download", url
-                return False
+            srcs.append( (url,pkgfile,None) )
+        return srcs
+
+    def checkout( self ):
+        fullpath = self.resolve( '{builddir}/{dirname}' )
+        if os.path.exists( fullpath ):
+            shutil.rmtree( fullpath )
+
+        # fetch and extract all packages at the same time
+        srcs = self.sources()
+        with concurrent.futures.ThreadPoolExecutor( max_workers=len(srcs) ) as pool:
+            futures = [ pool.submit( self.fetchExtract, url, pkgfile, sha256,
+                                     pkgfile[:-len('.tar.xz')] )
+                        for url,pkgfile,sha256 in srcs ]
+            ok = all( [ fut.result() for fut in futures ] )
+        if not ok:
+            print("Could not fetch the sources. Please check logs")
+            return False
 
         cmd = """
         cd {builddir}
-        rm -rf {builddir}/clang-{version}
-
-        # untar all packages
-        tar xJvf {builddir}/llvm-{version}.src.tar.xz
-        tar xJvf {builddir}/cfe-{version}.src.tar.xz
-        tar xJvf {builddir}/clang-tools-extra-{version}.src.tar.xz
-        tar xJvf {builddir}/compiler-rt-{version}.src.tar.xz
         mv llvm-{version}.src clang-{version}
 
         # move to respective places
@@ -39,5 +51,5 @@ class CustomBuilder( pkgbuild.Builder ):
         """
         status = self.runcmd( cmd )
         if status!=0:
-            print "Command failed. Please check logs"
+            print("Command failed. Please check logs")
         return status==0
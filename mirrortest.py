@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Checks the repository mirrors of pkgbuild.py against a local bare git
+# repository, without network. It creates the repository and a config/
+# with a package built from it in a few ways and then checks that:
+#   mirror    - the first build clones a bare mirror of the repository
+#   worktree  - the build tree is a git worktree of the mirror
+#   shallow   - with 'depth: 1' the build tree has a single commit
+#   pinned    - with 'revision' the tree is at that commit, not the latest
+#   unchanged - a trunk that did not move is not built again
+#   moved     - a new commit upstream is fetched and built
+# Exits with 1 if any check failed:
+#   ./mirrortest.py [--workdir DIR]
+import os
+import sys
+import io
+import json
+import shutil
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+import pkgbuild
+
+def git( *args, cwd=None ):
+    out = subprocess.run( ['git'] + list(args), cwd=cwd, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+    return out.stdout.decode( 'utf-8' ).strip()
+
+def commit( srcdir, text ):
+    # Commits README with this text and returns the commit
+    with open( os.path.join( srcdir, 'README' ), 'w' ) as f:
+        f.write( text + '\n' )
+    git( 'add', 'README', cwd=srcdir )
+    git( '-c', 'user.name=test', '-c', 'user.email=test@localhost',
+         'commit', '--quiet', '-m', text, cwd=srcdir )
+    return git( 'rev-parse', 'HEAD', cwd=srcdir )
+
+def generate( rootdir ):
+    # Writes the upstream repository, its bare clone and config/tool.json
+    srcdir = os.path.join( rootdir, 'src' )
+    repo = os.path.join( rootdir, 'repo.git' )
+    os.makedirs( srcdir )
+    git( 'init', '--quiet', '-b', 'main', srcdir )
+    first = commit( srcdir, 'v1' )
+    commit( srcdir, 'v2' )
+    git( 'clone', '--quiet', '--bare', srcdir, repo )
+    for dname in ('config','tags'):
+        os.makedirs( os.path.join( rootdir, dname ) )
+    common = { 'dirname': '{name}-{version}', 'url': repo, 'configure': 'true', 'make': 'true',
+               'install': 'mkdir -p {installdir}/{dirname} && cp README {installdir}/{dirname}/' }
+    configs = [ dict( common, version='trunk' ),
+                dict( common, version='shallow', depth=1 ),
+                dict( common, version='pinned', revision=first ) ]
+    with open( os.path.join( rootdir, 'config', 'tool.json' ), 'w' ) as f:
+        f.write( json.dumps( configs, indent=1 ) )
+    with open( os.path.join( rootdir, 'tags', 'test.yaml' ), 'w' ) as f:
+        f.write( "tool: '*'\n" )
+    return srcdir
+
+class MirrorTest():
+    def __init__( self, rootdir ):
+        self.rootdir = rootdir
+        self.failed = []
+        self.location = os.path.join( rootdir, 'location.json' )
+        with open( self.location, 'w' ) as f:
+            f.write( json.dumps( { 'test': { 'repodir': os.path.join( rootdir, 'work' ),
+                                             'cachedir': os.path.join( rootdir, 'cache' ),
+                                             'mirrordir': os.path.join( rootdir, 'mirrors' ) } } ) )
+
+    def manager( self ):
+        # A new manager is a new run, the mirrors are fetched again
+        pkgbuild.PackageIndex.indexes.clear()
+        # the revisions are told apart by the artifact keys, which the
+        # install sentinels only have with the artifact cache on
+        return pkgbuild.BuildManager( location='test', tags=['test'],
+                                      config=self.location, rootdir=self.rootdir )
+
+    def build( self, version ):
+        # Builds tool-<version> in a new run. Returns (ok,output)
+        out = io.StringIO()
+        with contextlib.redirect_stdout( out ):
+            ok = self.manager().buildPackages( [ ('tool',version) ] )
+        return ok,out.getvalue()
+
+    def check( self, name, ok, detail='' ):
+        print( "%-10s %s %s" % (name,'ok' if ok else 'FAILED',detail) )
+        if not ok:
+            self.failed.append( name )
+
+    def installed( self, version ):
+        fname = os.path.join( self.rootdir, 'work', 'install', 'tool-%s' % version, 'README' )
+        if not os.path.isfile( fname ):
+            return None
+        with open( fname ) as f:
+            return f.read().strip()
+
+    def run( self, srcdir ):
+        mirrors = os.path.join( self.rootdir, 'mirrors', 'git' )
+        builddir = os.path.join( self.rootdir, 'work', 'build' )
+
+        ok,out = self.build( 'trunk' )
+        mirror = [ os.path.join( mirrors, d ) for d in os.listdir( mirrors )
+                   if os.path.isdir( os.path.join( mirrors, d ) ) ] if os.path.isdir( mirrors ) else []
+        self.check( 'mirror', ok and len(mirror)==1 and
+                    git( 'rev-parse', '--is-bare-repository', cwd=mirror[0] )=='true', out if not ok else '' )
+        tree = os.path.join( builddir, 'tool-trunk' )
+        self.check( 'worktree', os.path.isfile( os.path.join( tree, '.git' ) ) and
+                    self.installed( 'trunk' )=='v2', 'installed %s' % self.installed( 'trunk' ) )
+
+        ok,out = self.build( 'shallow' )
+        tree = os.path.join( builddir, 'tool-shallow' )
+        count = git( 'rev-list', '--count', 'HEAD', cwd=tree ) if ok else None
+        self.check( 'shallow', ok and count=='1' and self.installed( 'shallow' )=='v2',
+                    '%s commits' % count )
+
+        ok,out = self.build( 'pinned' )
+        self.check( 'pinned', ok and self.installed( 'pinned' )=='v1',
+                    'installed %s' % self.installed( 'pinned' ) )
+
+        sentinel = os.path.join( self.rootdir, 'work', 'install', 'tool-trunk.done' )
+        mtime = os.path.getmtime( sentinel )
+        ok,out = self.build( 'trunk' )
+        self.check( 'unchanged', ok and 'nothing to do' in out and
+                    os.path.getmtime( sentinel )==mtime )
+
+        commit( srcdir, 'v3' )
+        git( 'push', '--quiet', os.path.join( self.rootdir, 'repo.git' ), 'main', cwd=srcdir )
+        ok,out = self.build( 'trunk' )
+        self.check( 'moved', ok and self.installed( 'trunk' )=='v3' and
+                    self.installed( 'pinned' )=='v1', 'installed %s' % self.installed( 'trunk' ) )
+        return not self.failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description='Checks the repository mirrors on a local bare repository' )
+    parser.add_argument( '--workdir', default=None,
+                         help='where the repository and the builds go (default a temporary dir)' )
+    opt = parser.parse_args()
+
+    if shutil.which( 'git' ) is None:
+        print( "git is not installed" )
+        sys.exit(1)
+    rootdir = os.path.realpath( opt.workdir or tempfile.mkdtemp( prefix='bleedingedge-mirrors-' ) )
+    try:
+        srcdir = generate( rootdir )
+        ok = MirrorTest( rootdir ).run( srcdir )
+    finally:
+        if opt.workdir is None:
+            shutil.rmtree( rootdir, ignore_errors=True )
+    sys.exit( 0 if ok else 1 )